@@ -0,0 +1,394 @@
+# analytics.py
+# Supply/demand rollups per region and 5-minute bucket, folded from the
+# ride_events log like the read models in projections.py. A bucket row
+# counts the rides requested, accepted, released, completed and cancelled
+# in its region, keeps a histogram of time-to-accept, and snapshots the
+# region's open requests and idle drivers as of its last event. Regions
+# are the pickup grid cells of sharding.region_for, logged with each
+# event so deleted rides are still placed. Drivers have no stored
+# position, so a driver counts as supply in the region where their last
+# ride ended, until they accept another.
+#
+# The heatmap and the surge multiplier read only the buckets in their
+# window plus the current gauges, so they cost the same whatever the size
+# of the history; the per-region arithmetic is vectorized with NumPy.
+import asyncio
+import bisect
+import json
+import math
+from datetime import datetime, timedelta
+from typing import Iterable, Optional
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.orm import Session
+
+from projections import fold_events
+from ride_state import ACCEPTED, COMPLETED, DELETED, MERGED, PENDING, TRANSITIONS
+from sharding import DEFAULT_REGION, REGION_CELL_DEGREES, region_for, shards
+import models
+
+CHECKPOINT_NAME = "demand_rollups"
+BUCKET_SECONDS = 300
+WAIT_BIN_EDGES = (0, 30, 60, 120, 180, 300, 600, 900, 1800, 3600)  # Seconds; the last bin is open-ended
+SURGE_WINDOW_BUCKETS = 3  # Accepts of the last 15 minutes count toward surge
+SURGE_SENSITIVITY = 0.5  # Multiplier added per unit of demand/supply above 1
+SURGE_MIN_DEMAND = 3  # Regions with less demand than this never surge
+SURGE_MAX = 3.0
+SURGE_STEP = 0.1
+MAX_WINDOW_MINUTES = 24 * 60
+ANALYTICS_INTERVAL_SECONDS = 5.0
+
+EPOCH = datetime(1970, 1, 1)
+COUNTERS = ("requested", "accepted", "released", "completed", "cancelled")
+GAUGES = ("pending_rides", "idle_drivers")
+
+EVENT_COLUMNS = (
+    models.RideEvent.id,
+    models.RideEvent.ride_id,
+    models.RideEvent.event,
+    models.RideEvent.from_status,
+    models.RideEvent.driver_id,
+    models.RideEvent.region,
+    models.RideEvent.created_at,
+)
+
+
+def bucket_for(moment: datetime) -> int:
+    return int((moment - EPOCH).total_seconds()) // BUCKET_SECONDS
+
+
+def bucket_start(bucket: int) -> datetime:
+    return EPOCH + timedelta(seconds=bucket * BUCKET_SECONDS)
+
+
+def region_centre(region: str):
+    # (lat, lng) of a grid cell's centre; None for rides without coordinates
+    if region == DEFAULT_REGION:
+        return None, None
+    row, column = (int(part) for part in region.split(":"))
+    return (row + 0.5) * REGION_CELL_DEGREES, (column + 0.5) * REGION_CELL_DEGREES
+
+
+def wait_bin(seconds: float) -> int:
+    return max(bisect.bisect_right(WAIT_BIN_EDGES, seconds) - 1, 0)
+
+
+def _chunks(values, size=500):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class DemandDelta:
+    """One batch of events applied to the rollups in memory, then written in bulk.
+
+    The rides, drivers and regions the batch touches are loaded up front.
+    Events logged without a region are placed by the ride's row in
+    ride_requests; rides created before the rollups existed skip the
+    time-to-accept histogram.
+    """
+
+    def __init__(self, db: Session, events):
+        self.db = db
+        self.rides = {}
+        self.drivers = {}
+        self.regions = {}
+        self.buckets = {}
+        self.removed = set()
+        self._load(events)
+        self.existing_rides = set(self.rides)
+        self.existing_drivers = set(self.drivers)
+        for event_id, ride_id, event_name, from_status, driver_id, region, created_at in events:
+            self.apply(ride_id, event_name, from_status, driver_id, region or self.locations.get(ride_id, DEFAULT_REGION), created_at)
+
+    def _load(self, events):
+        ride_ids = {event[1] for event in events}
+        driver_ids = {event[4] for event in events if event[4] is not None}
+        ride_table = models.DemandRide.__table__
+        driver_table = models.DemandDriver.__table__
+        for chunk in _chunks(ride_ids):
+            for row in self.db.execute(select(ride_table).where(ride_table.c.ride_id.in_(chunk))).mappings():
+                self.rides[row["ride_id"]] = {"region": row["region"], "status": row["status"], "created_at": row["created_at"]}
+        self.locations = {}
+        unplaced = {event[1] for event in events if event[5] is None} - set(self.rides)
+        for chunk in _chunks(unplaced):
+            for ride_id, lat, lng in self.db.execute(
+                select(models.RideRequest.id, models.RideRequest.pickup_lat, models.RideRequest.pickup_lng)
+                .where(models.RideRequest.id.in_(chunk))
+            ):
+                self.locations[ride_id] = region_for(lat, lng)
+        for chunk in _chunks(driver_ids):
+            for row in self.db.execute(select(driver_table).where(driver_table.c.driver_id.in_(chunk))).mappings():
+                self.drivers[row["driver_id"]] = {"region": row["region"], "busy": row["busy"]}
+
+    def _region(self, region: str) -> dict:
+        state = self.regions.get(region)
+        if state is None:
+            row = self.db.execute(
+                select(models.DemandRegion.pending_rides, models.DemandRegion.idle_drivers)
+                .where(models.DemandRegion.region == region)
+            ).first()
+            state = self.regions[region] = {
+                "pending_rides": row.pending_rides if row else 0,
+                "idle_drivers": row.idle_drivers if row else 0,
+                "exists": row is not None,
+                "updated_at": None,
+            }
+        return state
+
+    def _bucket(self, region: str, bucket: int) -> dict:
+        counts = self.buckets.get((region, bucket))
+        if counts is None:
+            counts = self.buckets[(region, bucket)] = {name: 0 for name in COUNTERS}
+            counts["wait_histogram"] = [0] * len(WAIT_BIN_EDGES)
+        return counts
+
+    def _adjust(self, region: str, gauge: str, change: int, bucket: int, moment: datetime):
+        state = self._region(region)
+        # Clamped: events from before the rollups existed may release what was never counted
+        state[gauge] = max(state[gauge] + change, 0)
+        state["updated_at"] = moment
+        counts = self._bucket(region, bucket)
+        for name in GAUGES:
+            counts[name] = state[name]
+
+    def _driver_busy(self, driver_id, region, bucket, moment):
+        driver = self.drivers.get(driver_id)
+        if driver is not None and not driver["busy"]:
+            self._adjust(driver["region"], "idle_drivers", -1, bucket, moment)
+        self.drivers[driver_id] = {"region": region, "busy": True}
+
+    def _driver_idle(self, driver_id, region, bucket, moment):
+        driver = self.drivers.get(driver_id)
+        if driver is not None and not driver["busy"]:
+            self._adjust(driver["region"], "idle_drivers", -1, bucket, moment)
+        self.drivers[driver_id] = {"region": region, "busy": False}
+        self._adjust(region, "idle_drivers", 1, bucket, moment)
+
+    def apply(self, ride_id, event_name, from_status, driver_id, region, created_at):
+        bucket = bucket_for(created_at)
+        ride = self.rides.get(ride_id)
+        if ride is None or event_name == "create":
+            # Databases from before ride ids stopped being reused may repeat one, so a create starts afresh
+            ride = self.rides[ride_id] = {"region": region, "status": from_status, "created_at": None}
+            self.removed.discard(ride_id)
+        region = ride["region"]
+        counts = self._bucket(region, bucket)
+        # Every touched bucket carries the gauges, even if only counters changed
+        self._adjust(region, "pending_rides", 0, bucket, created_at)
+
+        if event_name == "create":
+            ride["created_at"] = created_at
+            counts["requested"] += 1
+            self._adjust(region, "pending_rides", 1, bucket, created_at)
+        elif event_name == "accept":
+            counts["accepted"] += 1
+            self._adjust(region, "pending_rides", -1, bucket, created_at)
+            if ride["created_at"] is not None:
+                counts["wait_histogram"][wait_bin((created_at - ride["created_at"]).total_seconds())] += 1
+            if driver_id is not None:
+                self._driver_busy(driver_id, region, bucket, created_at)
+        elif event_name == "release":
+            counts["released"] += 1
+            self._adjust(region, "pending_rides", 1, bucket, created_at)
+            if driver_id is not None:
+                self._driver_idle(driver_id, region, bucket, created_at)
+        elif event_name == "complete":
+            counts["completed"] += 1
+            if driver_id is not None:
+                self._driver_idle(driver_id, region, bucket, created_at)
+        elif event_name == "merge":
+            self._adjust(region, "pending_rides", -1, bucket, created_at)
+        elif event_name == "delete":
+            if from_status in (PENDING, ACCEPTED):
+                counts["cancelled"] += 1
+            if from_status == PENDING:
+                self._adjust(region, "pending_rides", -1, bucket, created_at)
+            elif from_status == ACCEPTED and driver_id is not None:
+                self._driver_idle(driver_id, region, bucket, created_at)
+
+        ride["status"] = TRANSITIONS[event_name][1]
+        if ride["status"] in (COMPLETED, MERGED, DELETED):
+            self.removed.add(ride_id)
+
+    def write(self, db: Session):
+        self._write_rollups(db)
+
+        region_rows = [
+            {"region": region, "pending_rides": state["pending_rides"], "idle_drivers": state["idle_drivers"], "updated_at": state["updated_at"]}
+            for region, state in self.regions.items()
+        ]
+        db.bulk_insert_mappings(models.DemandRegion, [row for row in region_rows if not self.regions[row["region"]]["exists"]])
+        db.bulk_update_mappings(models.DemandRegion, [row for row in region_rows if self.regions[row["region"]]["exists"]])
+
+        ride_rows = [
+            {"ride_id": ride_id, **ride} for ride_id, ride in self.rides.items() if ride_id not in self.removed
+        ]
+        db.bulk_insert_mappings(models.DemandRide, [row for row in ride_rows if row["ride_id"] not in self.existing_rides])
+        db.bulk_update_mappings(models.DemandRide, [row for row in ride_rows if row["ride_id"] in self.existing_rides])
+        for chunk in _chunks(self.removed & self.existing_rides):
+            db.execute(delete(models.DemandRide).where(models.DemandRide.ride_id.in_(chunk)))
+
+        driver_rows = [{"driver_id": driver_id, **driver} for driver_id, driver in self.drivers.items()]
+        db.bulk_insert_mappings(models.DemandDriver, [row for row in driver_rows if row["driver_id"] not in self.existing_drivers])
+        db.bulk_update_mappings(models.DemandDriver, [row for row in driver_rows if row["driver_id"] in self.existing_drivers])
+
+    def _write_rollups(self, db: Session):
+        # Counters and histograms add to the stored row; gauges replace it
+        table = models.DemandRollup.__table__
+        regions = {region for region, _ in self.buckets}
+        buckets = {bucket for _, bucket in self.buckets}
+        existing = {}
+        for chunk in _chunks(buckets):
+            for row in db.execute(
+                select(table).where(table.c.bucket.in_(chunk), table.c.region.in_(regions))
+            ).mappings():
+                existing[(row["region"], row["bucket"])] = row
+        inserts, updates = [], []
+        for (region, bucket), counts in self.buckets.items():
+            row = {"region": region, "bucket": bucket, **{name: counts[name] for name in GAUGES}}
+            stored = existing.get((region, bucket))
+            histogram = counts["wait_histogram"]
+            if stored is not None:
+                histogram = [a + b for a, b in zip(json.loads(stored["wait_histogram"]), histogram)]
+            for name in COUNTERS:
+                row[name] = counts[name] + (stored[name] if stored is not None else 0)
+            row["wait_histogram"] = json.dumps(histogram)
+            (updates if stored is not None else inserts).append(row)
+        if inserts:
+            db.bulk_insert_mappings(models.DemandRollup, inserts)
+        if updates:
+            db.bulk_update_mappings(models.DemandRollup, updates)
+
+
+def catch_up(db: Session, batch_size: int = 5000) -> int:
+    """Fold ride events newer than this shard's checkpoint into the rollups."""
+    return fold_events(db, CHECKPOINT_NAME, EVENT_COLUMNS, DemandDelta, batch_size)
+
+
+def surge_multipliers(pending, idle, accepted):
+    """Surge per region from arrays of open requests, idle drivers and recent accepts.
+
+    Riders still waiting plus riders recently matched, over idle drivers
+    plus drivers recently matched; above 1 the ratio is damped by
+    SURGE_SENSITIVITY, capped at SURGE_MAX and rounded down to SURGE_STEP.
+    """
+    demand = pending + accepted
+    supply = idle + accepted
+    ratio = demand / np.maximum(supply, 1)
+    surge = np.clip(1.0 + SURGE_SENSITIVITY * (ratio - 1.0), 1.0, SURGE_MAX)
+    surge = np.round(np.floor(surge / SURGE_STEP + 1e-9) * SURGE_STEP, 1)
+    return np.where(demand >= SURGE_MIN_DEMAND, surge, 1.0)
+
+
+def median_waits(histograms):
+    """Median seconds to accept per row of WAIT_BIN_EDGES histograms, interpolated within the bin; NaN without accepts."""
+    edges = np.asarray(WAIT_BIN_EDGES, dtype=float)
+    widths = np.diff(edges, append=edges[-1])  # The open-ended last bin reports its lower edge
+    totals = histograms.sum(axis=1)
+    cumulative = np.cumsum(histograms, axis=1)
+    half = totals / 2.0
+    bins = np.argmax(cumulative >= half[:, None], axis=1)
+    rows = np.arange(len(histograms))
+    in_bin = histograms[rows, bins]
+    before = cumulative[rows, bins] - in_bin
+    median = edges[bins] + (half - before) / np.maximum(in_bin, 1) * widths[bins]
+    return np.where(totals > 0, median, np.nan)
+
+
+def heatmap(db: Session, minutes: int = 60, now: Optional[datetime] = None, regions: Optional[Iterable[str]] = None) -> dict:
+    """Supply and demand per region over the ``minutes`` up to ``now``, with each region's surge multiplier.
+
+    Reads the window's buckets (through the bucket index) and the current
+    gauges only. Regions come back highest surge first.
+    """
+    last = bucket_for(now or datetime.utcnow())
+    window = max(1, math.ceil(minutes * 60 / BUCKET_SECONDS))
+    first = last - window + 1
+    earliest = min(first, last - SURGE_WINDOW_BUCKETS + 1)
+
+    rollups = select(models.DemandRollup).where(models.DemandRollup.bucket.between(earliest, last))
+    gauges = select(models.DemandRegion.region, models.DemandRegion.pending_rides, models.DemandRegion.idle_drivers).where(
+        (models.DemandRegion.pending_rides > 0) | (models.DemandRegion.idle_drivers > 0)
+    )
+    if regions is not None:
+        regions = list(regions)
+        rollups = rollups.where(models.DemandRollup.region.in_(regions))
+        gauges = gauges.where(models.DemandRegion.region.in_(regions))
+    rows = db.execute(rollups.with_only_columns(
+        models.DemandRollup.region, models.DemandRollup.bucket, *(getattr(models.DemandRollup, name) for name in COUNTERS),
+        models.DemandRollup.wait_histogram,
+    )).all()
+    current = db.execute(gauges).all()
+
+    names = sorted({row.region for row in rows} | {row.region for row in current})
+    index = {name: position for position, name in enumerate(names)}
+    counts = np.zeros((len(names), len(COUNTERS)), dtype=np.int64)
+    recent = np.zeros(len(names), dtype=np.int64)  # Accepted in the surge window
+    histograms = np.zeros((len(names), len(WAIT_BIN_EDGES)), dtype=np.int64)
+    pending = np.zeros(len(names), dtype=np.int64)
+    idle = np.zeros(len(names), dtype=np.int64)
+    if rows:
+        positions = np.fromiter((index[row.region] for row in rows), dtype=np.int64, count=len(rows))
+        row_buckets = np.fromiter((row.bucket for row in rows), dtype=np.int64, count=len(rows))
+        values = np.array([row[2:2 + len(COUNTERS)] for row in rows], dtype=np.int64)
+        waits = np.array([json.loads(row.wait_histogram) for row in rows], dtype=np.int64)
+        in_window = row_buckets >= first
+        in_surge = row_buckets > last - SURGE_WINDOW_BUCKETS
+        np.add.at(counts, positions[in_window], values[in_window])
+        np.add.at(histograms, positions[in_window], waits[in_window])
+        np.add.at(recent, positions[in_surge], values[in_surge, COUNTERS.index("accepted")])
+    for row in current:
+        pending[index[row.region]] = row.pending_rides
+        idle[index[row.region]] = row.idle_drivers
+
+    surge = surge_multipliers(pending, idle, recent)
+    medians = median_waits(histograms)
+
+    result = []
+    for position in np.lexsort((-pending, -surge)):
+        name = names[position]
+        lat, lng = region_centre(name)
+        entry = {"region": name, "lat": lat, "lng": lng}
+        entry.update({key: int(counts[position, column]) for column, key in enumerate(COUNTERS)})
+        entry.update({
+            "pending_rides": int(pending[position]),
+            "idle_drivers": int(idle[position]),
+            "median_wait_seconds": None if np.isnan(medians[position]) else round(float(medians[position]), 1),
+            "surge_multiplier": float(surge[position]),
+        })
+        result.append(entry)
+    return {"from": bucket_start(first), "to": bucket_start(last + 1), "regions": result}
+
+
+def surge_for(db: Session, lat: Optional[float], lng: Optional[float], now: Optional[datetime] = None) -> dict:
+    region = region_for(lat, lng)
+    entries = heatmap(db, SURGE_WINDOW_BUCKETS * BUCKET_SECONDS // 60, now, regions=[region])["regions"]
+    if not entries:
+        return {"region": region, "surge_multiplier": 1.0, "pending_rides": 0, "idle_drivers": 0}
+    entry = entries[0]
+    return {key: entry[key] for key in ("region", "surge_multiplier", "pending_rides", "idle_drivers")}
+
+
+def update_rollups(router=shards) -> int:
+    # Shards one after another: they share the region and driver rows
+    applied = 0
+    for shard in router:
+        db = shard.SessionLocal()
+        try:
+            applied += catch_up(db)
+        finally:
+            db.close()
+    return applied
+
+
+async def rollup_loop(router=shards, interval: float = ANALYTICS_INTERVAL_SECONDS):
+    # Background task: fold new ride events into the rollups every `interval` seconds, off the event loop
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, update_rollups, router)
+        except Exception as e:
+            print(f"Error updating demand rollups: {str(e)}")
+        await asyncio.sleep(interval)
@@ -0,0 +1,180 @@
+# benchmarks/bench_analytics.py
+# The supply/demand heatmap answered from the rollups against the same
+# question answered by scanning ride_requests and ride_events, as the
+# history grows to a year. Synthetic rides follow a daily demand curve
+# over a few cities, and each city's drivers serve them first come first
+# served, so waits grow at peak hours. The events are folded into the
+# rollups in stages (the fold rate is reported too) and both heatmaps are
+# timed at the end of each stage.
+#
+#   python benchmarks/bench_analytics.py [--days 365] [--rides-per-day 400] [--regions 16] [--stages 7,30,365]
+import argparse
+import heapq
+import os
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from common import percentile, temp_database
+
+from sqlalchemy import insert, select
+
+import analytics
+import models
+from sharding import REGION_CELL_DEGREES, region_for
+
+END = datetime(2026, 1, 1)
+DRIVERS_PER_REGION = 6
+
+
+def city_centres(count):
+    return [
+        (30.0 + (n // 4) * 2 * REGION_CELL_DEGREES + 0.25, 31.0 + (n % 4) * 2 * REGION_CELL_DEGREES + 0.25)
+        for n in range(count)
+    ]
+
+
+def simulate(days, rides_per_day, regions):
+    # Returns ride rows and the events, in time order
+    cities = city_centres(regions)
+    start = END - timedelta(days=days)
+    # Each city's drivers as a heap of (free at, driver id)
+    drivers = [
+        [(start, region * DRIVERS_PER_REGION + n + 1) for n in range(DRIVERS_PER_REGION)]
+        for region in range(regions)
+    ]
+    rides, events = [], []
+    ride_id = 0
+    for day in range(days):
+        midnight = start + timedelta(days=day)
+        # Demand peaks in the morning and the evening
+        minutes = sorted(
+            random.gauss(8.5 * 60, 70) if random.random() < 0.35 else random.gauss(18 * 60, 90) if random.random() < 0.5
+            else random.uniform(0, 24 * 60)
+            for _ in range(rides_per_day)
+        )
+        for minute in minutes:
+            at = midnight + timedelta(minutes=min(max(minute, 0), 24 * 60 - 1))
+            region = random.randrange(regions)
+            lat, lng = cities[region]
+            lat += random.uniform(-0.2, 0.2)
+            lng += random.uniform(-0.2, 0.2)
+            ride_id += 1
+            name = region_for(lat, lng)
+            events.append((at, ride_id, "create", None, None, name))
+            if random.random() < 0.08:
+                events.append((at + timedelta(minutes=random.uniform(1, 8)), ride_id, "delete", "pending", None, name))
+                continue
+            free_at, driver = heapq.heappop(drivers[region])
+            accepted_at = max(at + timedelta(seconds=random.expovariate(1 / 40)), free_at)
+            events.append((accepted_at, ride_id, "accept", "pending", driver, name))
+            done_at = accepted_at + timedelta(minutes=random.uniform(10, 35))
+            events.append((done_at, ride_id, "complete", "accepted", driver, name))
+            heapq.heappush(drivers[region], (done_at, driver))
+            rides.append({
+                "id": ride_id, "user_id": 1, "driver_id": driver, "pickup": "A", "destination": "B",
+                "created_at": at, "status": "completed", "participant_count": 1, "fare": 25.0,
+                "pickup_lat": lat, "pickup_lng": lng,
+            })
+    events.sort()
+    return rides, events
+
+
+def event_rows(events):
+    statuses = {"create": "pending", "accept": "accepted", "complete": "completed", "delete": "deleted"}
+    return [
+        {"ride_id": ride_id, "event": event, "from_status": from_status, "to_status": statuses[event],
+         "actor_type": "driver" if driver else "user", "actor_id": driver or 1, "driver_id": driver,
+         "region": region, "created_at": at}
+        for at, ride_id, event, from_status, driver, region in events
+    ]
+
+
+def scan_heatmap(db, since, now):
+    # The same question without rollups: scan the rides and the log
+    requested = Counter()
+    pending = Counter()
+    for lat, lng, created_at, status in db.execute(select(
+        models.RideRequest.pickup_lat, models.RideRequest.pickup_lng, models.RideRequest.created_at, models.RideRequest.status
+    ).where((models.RideRequest.created_at >= since) | (models.RideRequest.status == "pending"))):
+        region = region_for(lat, lng)
+        if since <= created_at < now:
+            requested[region] += 1
+        if status == "pending":
+            pending[region] += 1
+    accepted = Counter()
+    waits = {}
+    for region, created_at, accepted_at in db.execute(
+        select(models.RideEvent.region, models.RideRequest.created_at, models.RideEvent.created_at)
+        .join(models.RideRequest, models.RideRequest.id == models.RideEvent.ride_id)
+        .where(models.RideEvent.event == "accept", models.RideEvent.created_at >= since, models.RideEvent.created_at < now)
+    ):
+        accepted[region] += 1
+        waits.setdefault(region, []).append((accepted_at - created_at).total_seconds())
+    return requested, accepted, pending, {region: sorted(values)[len(values) // 2] for region, values in waits.items()}
+
+
+def time_call(call, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = call()
+        samples.append(time.perf_counter() - start)
+    return result, percentile(samples, 50)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--rides-per-day", type=int, default=400)
+    parser.add_argument("--regions", type=int, default=16)
+    parser.add_argument("--stages", default="7,30,365", help="days of history at which to measure")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    random.seed(3)
+    rides, events = simulate(args.days, args.rides_per_day, args.regions)
+    start = END - timedelta(days=args.days)
+    engine, SessionLocal, path = temp_database("analytics")
+    try:
+        print(f"{len(rides) + sum(1 for e in events if e[2] == 'delete')} rides, {len(events)} events over {args.days} days, {args.regions} regions")
+        print(f"{'history':>8} {'events':>9} {'fold ev/s':>10} {'rollup rows':>12} {'heatmap ms':>11} {'scan ms':>9} {'scan/heatmap':>13}")
+        written_rides = written_events = 0
+        for stage_days in (int(value) for value in args.stages.split(",")):
+            cutoff = start + timedelta(days=min(stage_days, args.days))
+            stage_events = []
+            while written_events + len(stage_events) < len(events) and events[written_events + len(stage_events)][0] < cutoff:
+                stage_events.append(events[written_events + len(stage_events)])
+            stage_rides = [ride for ride in rides[written_rides:] if ride["created_at"] < cutoff]
+            with engine.begin() as conn:
+                if stage_rides:
+                    conn.execute(insert(models.RideRequest), stage_rides)
+                if stage_events:
+                    conn.execute(insert(models.RideEvent), event_rows(stage_events))
+            written_rides += len(stage_rides)
+            written_events += len(stage_events)
+
+            db = SessionLocal()
+            fold_start = time.perf_counter()
+            applied = analytics.catch_up(db)
+            fold_seconds = time.perf_counter() - fold_start
+            rollup_rows = db.query(models.DemandRollup).count()
+            # The last hour before the cutoff
+            now = cutoff - timedelta(seconds=1)
+            result, heatmap_time = time_call(lambda: analytics.heatmap(db, 60, now), args.repeat)
+            scanned, scan_time = time_call(lambda: scan_heatmap(db, result["from"], result["to"]), args.repeat)
+            db.close()
+
+            # Both agree on the window's accepts
+            accepted = {entry["region"]: entry["accepted"] for entry in result["regions"] if entry["accepted"]}
+            assert accepted == dict(scanned[1]), (accepted, scanned[1])
+            print(f"{stage_days:>7}d {written_events:>9} {applied / max(fold_seconds, 1e-9):>10,.0f} {rollup_rows:>12} "
+                  f"{heatmap_time * 1000:>11.2f} {scan_time * 1000:>9.1f} {scan_time / heatmap_time:>12.0f}x")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
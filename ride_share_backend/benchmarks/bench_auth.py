@@ -0,0 +1,92 @@
+# benchmarks/bench_auth.py
+# Per-request authentication overhead: the old decode + TokenData + user
+# query path against the cached, claims-only principal path.
+#
+#   python benchmarks/bench_auth.py [--iterations 5000]
+import argparse
+import os
+import time
+from datetime import timedelta
+from typing import Optional
+
+from common import temp_database
+
+from jose import jwt
+from pydantic import BaseModel
+
+import models
+import security
+
+
+class TokenData(BaseModel):
+    email: Optional[str] = None
+    user_type: Optional[str] = None
+
+
+def legacy_get_current_user(token, db):
+    payload = jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
+    token_data = TokenData(email=payload.get("sub"), user_type=payload.get("user_type"))
+    return db.query(models.User).filter(models.User.email == token_data.email).first()
+
+
+def per_request(label, iterations, fn):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed / iterations * 1e6:10.1f} us/request")
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=5000)
+    args = parser.parse_args()
+
+    engine, SessionLocal, path = temp_database("auth")
+    try:
+        db = SessionLocal()
+        db.bulk_insert_mappings(models.User, [
+            {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"}
+            for i in range(1, 10001)
+        ])
+        db.commit()
+
+        tokens = security.issue_tokens(5000, "user5000@example.com", "user")
+        token = tokens["access_token"]
+
+        before = per_request("before: jwt.decode + TokenData + user query", args.iterations,
+                             lambda: legacy_get_current_user(token, db))
+
+        def uncached():
+            security.token_cache.clear()
+            return security.decode_token(token)
+
+        per_request("after: cache miss (verify, no DB)", args.iterations, uncached)
+        security.decode_token(token)
+        after = per_request("after: cache hit (no DB)", args.iterations, lambda: security.decode_token(token))
+        per_request("after: cache hit + user row by id", args.iterations,
+                    lambda: db.get(models.User, security.decode_token(token).id))
+
+        # Refresh replaces re-login: compare against a bcrypt verify
+        from passlib.context import CryptContext
+        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+        hashed = pwd_context.hash("password")
+        per_request("re-login (bcrypt verify + token)", 20,
+                    lambda: (pwd_context.verify("password", hashed),
+                             security.create_access_token({"sub": "x", "uid": 1, "user_type": "user"}, timedelta(minutes=30))))
+
+        def refresh():
+            principal = security.decode_token(tokens["refresh_token"], expected_type=security.REFRESH_TOKEN)
+            return security.issue_tokens(principal.id, principal.email, principal.user_type)
+
+        per_request("refresh (verify refresh token + new pair)", 1000, refresh)
+        print(f"auth overhead reduced {before / after:.0f}x on the hot path")
+        db.close()
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# benchmarks/bench_delta_sync.py
+# Steady-state polling: full refresh against a delta refresh with a
+# since_version token for /available-rides, /user/rides and
+# /driver/my-rides, after a handful of rides changed.
+#
+#   python benchmarks/bench_delta_sync.py [--rides 20000] [--changes 20] [--iterations 3]
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import temp_database
+
+from fastapi.encoders import jsonable_encoder
+
+import models
+import sync
+from routes.driver import get_available_rides, get_driver_rides
+from routes.rides import get_user_rides
+from security import Principal
+
+
+def populate(SessionLocal, rides):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(models.User, [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, 1001)
+    ])
+    db.bulk_insert_mappings(models.Driver, [
+        {"id": i, "name": f"Driver {i}", "email": f"driver{i}@example.com", "password": "x",
+         "license_number": f"L{i}", "vehicle_type": "car", "vehicle_number": f"V{i}", "is_available": True}
+        for i in range(1, 51)
+    ])
+    rows, participants = [], []
+    for n in range(1, rides + 1):
+        # User 1 created every 10th ride; driver 1 has every 20th ride
+        assigned = n % 20 == 0
+        rows.append({
+            "id": n, "user_id": 1 if n % 10 == 0 else random.randint(2, 1000),
+            "driver_id": 1 if assigned else None,
+            "pickup": f"Place {random.randint(1, 200)}", "destination": f"Place {random.randint(1, 200)}",
+            "created_at": now - timedelta(minutes=n), "status": "accepted" if assigned else "pending",
+            "participant_count": 2, "fare": 25.0, "version": 1, "updated_at": now,
+        })
+        participants.append({"ride_id": n, "user_id": random.randint(2, 1000), "created_at": now, "version": 1, "updated_at": now})
+    db.bulk_insert_mappings(models.RideRequest, rows)
+    db.bulk_insert_mappings(models.RideParticipant, participants)
+    db.add(models.SyncClock(name=sync.CLOCK_NAME, version=1, pruned_version=0))
+    db.commit()
+    db.close()
+
+
+def make_changes(SessionLocal, rides, changes):
+    # A few joins and a few accepts, through the ORM like the endpoints
+    db = SessionLocal()
+    for n in random.sample(range(1, rides + 1), changes):
+        ride = db.get(models.RideRequest, n)
+        if ride.status == "pending" and n % 2:
+            ride.driver_id = 1
+            ride.status = "accepted"
+        else:
+            db.add(models.RideParticipant(ride_id=n, user_id=1))
+            ride.participant_count += 1
+        db.commit()
+    db.close()
+
+
+def measure(label, SessionLocal, iterations, call):
+    samples = []
+    size = 0
+    for _ in range(iterations):
+        db = SessionLocal()
+        start = time.perf_counter()
+        response = asyncio.run(call(db))
+        size = len(json.dumps(jsonable_encoder(response)))
+        samples.append(time.perf_counter() - start)
+        db.close()
+    best = min(samples)
+    print(f"{label:<38} {best * 1000:9.2f} ms  {size / 1024:10.1f} KiB")
+    return best, size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=20000)
+    parser.add_argument("--changes", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=3)
+    args = parser.parse_args()
+
+    random.seed(11)
+    engine, SessionLocal, path = temp_database("delta_sync")
+    try:
+        populate(SessionLocal, args.rides)
+        db = SessionLocal()
+        token = sync.current_version(db)
+        driver = db.get(models.Driver, 1)
+        db.close()
+        make_changes(SessionLocal, args.rides, args.changes)
+
+        driver_principal = Principal(1, "driver1@example.com", "driver")
+        user_principal = Principal(1, "user1@example.com", "user")
+        endpoints = {
+            "/available-rides": lambda db, since: get_available_rides(
+                since_version=since, limit=None, lat=None, lng=None, current_user=driver_principal, db=db),
+            "/user/rides": lambda db, since: get_user_rides(
+                since=None, until=None, since_version=since, current_user=user_principal, db=db),
+            "/driver/my-rides": lambda db, since: get_driver_rides(
+                status=None, since_version=since, current_user=db.merge(driver, load=False), db=db),
+        }
+
+        print(f"{args.rides} rides, {args.changes} changed since the client's token")
+        print(f"{'':<38} {'best time':>12}  {'payload':>10}")
+        for path_name, call in endpoints.items():
+            full_time, full_size = measure(f"{path_name} full", SessionLocal, args.iterations,
+                                           lambda db: call(db, None))
+            delta_time, delta_size = measure(f"{path_name} delta", SessionLocal, args.iterations,
+                                             lambda db: call(db, token))
+            print(f"{'':<38} {full_time / delta_time:8.0f}x faster, {full_size / max(delta_size, 1):6.0f}x smaller")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
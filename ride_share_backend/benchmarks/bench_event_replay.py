@@ -0,0 +1,78 @@
+# benchmarks/bench_event_replay.py
+# Throughput of rebuilding the read models from the ride_events log, and of
+# the incremental catch_up run by projections_loop.
+#
+#   python benchmarks/bench_event_replay.py [--rides 200000]
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from common import temp_database, timer
+
+from sqlalchemy import insert
+
+import models
+from projections import catch_up
+from replay_events import replay
+
+
+def synthetic_events(first_ride_id, rides, drivers=2000):
+    # create -> accept -> (release -> accept)? -> complete, per ride
+    now = datetime.utcnow()
+    events = []
+    for ride_id in range(first_ride_id, first_ride_id + rides):
+        at = now - timedelta(minutes=ride_id)
+        driver = random.randint(1, drivers)
+        events.append({"ride_id": ride_id, "event": "create", "from_status": None, "to_status": "pending",
+                       "actor_type": "user", "actor_id": 1, "driver_id": None, "created_at": at})
+        events.append({"ride_id": ride_id, "event": "accept", "from_status": "pending", "to_status": "accepted",
+                       "actor_type": "driver", "actor_id": driver, "driver_id": driver, "created_at": at})
+        if random.random() < 0.2:
+            events.append({"ride_id": ride_id, "event": "release", "from_status": "accepted", "to_status": "pending",
+                           "actor_type": "driver", "actor_id": driver, "driver_id": driver, "created_at": at})
+            driver = random.randint(1, drivers)
+            events.append({"ride_id": ride_id, "event": "accept", "from_status": "pending", "to_status": "accepted",
+                           "actor_type": "driver", "actor_id": driver, "driver_id": driver, "created_at": at})
+        events.append({"ride_id": ride_id, "event": "complete", "from_status": "accepted", "to_status": "completed",
+                       "actor_type": "driver", "actor_id": driver, "driver_id": driver, "created_at": at})
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=200000)
+    parser.add_argument("--incremental", type=int, default=5000)
+    args = parser.parse_args()
+
+    random.seed(11)
+    engine, SessionLocal, path = temp_database("event_replay")
+    try:
+        events = synthetic_events(1, args.rides)
+        with timer(f"write {len(events)} events"):
+            with engine.begin() as conn:
+                conn.execute(insert(models.RideEvent), events)
+
+        count, elapsed = replay(bind=engine)
+        print(f"{'full replay':<40} {elapsed * 1000:10.1f} ms  ({count / elapsed:,.0f} events/s)")
+
+        # New activity after the rebuild is applied incrementally
+        more = synthetic_events(args.rides + 1, args.incremental)
+        with engine.begin() as conn:
+            conn.execute(insert(models.RideEvent), more)
+        db = SessionLocal()
+        results = {}
+        with timer(f"catch_up {len(more)} new events", results):
+            applied = catch_up(db)
+        with timer("catch_up with nothing new"):
+            catch_up(db)
+        db.close()
+        assert applied == len(more)
+        print(f"{'incremental rate':<40} {applied / results[f'catch_up {len(more)} new events']:,.0f} events/s")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+# benchmarks/bench_export.py
+# Columnar export of a large ride history (ride_export.py): throughput and
+# peak memory of full Parquet and Arrow exports, exports narrowed by driver
+# and by date range (the filters run in SQL), and driver earnings computed
+# with grouped Arrow aggregations against a Python loop over ORM rows.
+# The history is generated in SQL, a year of rides with a third of them
+# joined by other riders. Each export runs in a fresh process so its peak
+# RSS is its own; the RSS right before the export starts is shown next to it.
+#
+#   python benchmarks/bench_export.py [--rows 10000000] [--drivers 2000] [--chunk-rows 50000] [--orm-days 30]
+import argparse
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from common import temp_database
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+START = datetime(2025, 1, 1)
+DAYS = 365
+
+
+def populate(engine, rows, drivers):
+    # Rides spread evenly over the year, ids in time order like the live table
+    seconds = DAYS * 24 * 3600 / rows
+    with engine.begin() as conn:
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :drivers)
+            INSERT INTO drivers (id, name, email, password, license_number, vehicle_number, is_available)
+            SELECT i, 'driver ' || i, 'driver' || i || '@example.com', 'x', 'L' || i, 'V' || i, 1 FROM n
+        """), {"drivers": drivers})
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rows)
+            INSERT INTO ride_requests (id, user_id, driver_id, pickup, destination, created_at, participant_count,
+                                       status, distance, fare, pickup_lat, pickup_lng)
+            SELECT i, 1 + i % 50000,
+                   CASE WHEN i % 10 = 0 THEN NULL ELSE 1 + (i * 7919) % :drivers END,
+                   'Pickup ' || (i % 500), 'Destination ' || (i % 700),
+                   datetime(:start, '+' || CAST(i * :seconds AS INTEGER) || ' seconds') || '.000000',
+                   1 + (i % 3 = 0) + (i % 7 = 0),
+                   CASE WHEN i % 10 = 0 THEN 'pending' WHEN i % 10 = 1 THEN 'accepted' ELSE 'completed' END,
+                   2.0 + (i % 37) * 0.5, 20.0 + (i % 53), 30.0 + (i % 1000) * 0.001, 31.0 + (i % 997) * 0.001
+            FROM n
+        """), {"rows": rows, "drivers": drivers, "start": START.isoformat(" "), "seconds": seconds})
+        conn.execute(text("""
+            INSERT INTO ride_participants (ride_id, user_id)
+            SELECT id, 1 + (id * 31) % 50000 FROM ride_requests WHERE id % 3 = 0
+            UNION ALL
+            SELECT id, 1 + (id * 17) % 50000 FROM ride_requests WHERE id % 7 = 0
+        """))
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _session(db_path):
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+    return sessionmaker(bind=engine)()
+
+
+def run_export(db_path, out_path, format, filters, chunk_rows):
+    # In a child process: export and report rows, seconds and memory
+    import ride_export
+
+    db = _session(db_path)
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    rows = ride_export.write_rides(out_path, ride_export.iter_ride_batches(db, chunk_rows=chunk_rows, **filters), format)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return rows, elapsed, baseline, max_rss_mb()
+
+
+def run_earnings(db_path, until, chunk_rows):
+    import ride_export
+
+    db = _session(db_path)
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    summary = ride_export.earnings_summary(
+        ride_export.iter_ride_batches(
+            db, until=until, status="completed", chunk_rows=chunk_rows, columns=ride_export.EARNINGS_COLUMNS
+        )
+    )
+    elapsed = time.perf_counter() - start
+    db.close()
+    totals = {row["driver_id"]: (row["rides"], round(row["total_fare"], 2)) for row in summary.to_pylist()}
+    return totals, elapsed, baseline, max_rss_mb()
+
+
+def run_orm_earnings(db_path, until, chunk_rows):
+    # The per-object way: load every completed ride and add it up in Python
+    import models
+
+    db = _session(db_path)
+    baseline = max_rss_mb()
+    start = time.perf_counter()
+    totals = {}
+    query = db.query(models.RideRequest).filter(
+        models.RideRequest.status == "completed",
+        models.RideRequest.driver_id.isnot(None),
+        models.RideRequest.created_at < until,
+    )
+    for ride in query.yield_per(chunk_rows):
+        rides, fare, distance = totals.get(ride.driver_id, (0, 0.0, 0.0))
+        totals[ride.driver_id] = (rides + 1, fare + (ride.fare or 0.0), distance + (ride.distance or 0.0))
+    elapsed = time.perf_counter() - start
+    db.close()
+    return {driver: (rides, round(fare, 2)) for driver, (rides, fare, _) in totals.items()}, elapsed, baseline, max_rss_mb()
+
+
+def in_child(fn, *args):
+    # Fresh interpreter per run, so ru_maxrss is this run's peak alone
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(fn, args)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--drivers", type=int, default=2000)
+    parser.add_argument("--chunk-rows", type=int, default=50_000)
+    parser.add_argument("--orm-days", type=int, default=30, help="days of history for the earnings comparison")
+    args = parser.parse_args()
+
+    engine, _, db_path = temp_database("export")
+    out_dir = tempfile.mkdtemp(prefix="export_")
+    try:
+        start = time.perf_counter()
+        populate(engine, args.rows, args.drivers)
+        engine.dispose()
+        print(f"{args.rows:,} rides, {args.drivers} drivers generated in {time.perf_counter() - start:.0f}s "
+              f"({os.path.getsize(db_path) / 1e6:,.0f} MB database), chunks of {args.chunk_rows:,}")
+
+        print(f"{'export':<28} {'rows':>11} {'seconds':>8} {'rows/s':>10} {'file MB':>8} {'RSS before':>11} {'peak RSS':>9}")
+        cases = [
+            ("parquet, everything", "parquet", {}),
+            ("arrow, everything", "arrow", {}),
+            ("parquet, one driver", "parquet", {"driver_id": 7}),
+            ("parquet, one month", "parquet", {"since": START + timedelta(days=181), "until": START + timedelta(days=212)}),
+            ("parquet, completed", "parquet", {"status": "completed"}),
+        ]
+        for label, format, filters in cases:
+            out_path = os.path.join(out_dir, f"rides.{format}")
+            rows, elapsed, baseline, peak = in_child(run_export, db_path, out_path, format, filters, args.chunk_rows)
+            print(f"{label:<28} {rows:>11,} {elapsed:>8.1f} {rows / elapsed:>10,.0f} "
+                  f"{os.path.getsize(out_path) / 1e6:>8.1f} {baseline:>9.0f}MB {peak:>7.0f}MB")
+            os.remove(out_path)
+
+        until = START + timedelta(days=args.orm_days)
+        print(f"\nearnings per driver, first {args.orm_days} days and the whole year")
+        arrow_totals, arrow_time, baseline, arrow_peak = in_child(run_earnings, db_path, until, args.chunk_rows)
+        orm_totals, orm_time, orm_baseline, orm_peak = in_child(run_orm_earnings, db_path, until, args.chunk_rows)
+        assert arrow_totals == orm_totals
+        rides = sum(count for count, _ in arrow_totals.values())
+        print(f"{'arrow aggregation':<28} {rides:>11,} {arrow_time:>8.2f} {rides / arrow_time:>10,.0f} {'':>8} "
+              f"{baseline:>9.0f}MB {arrow_peak:>7.0f}MB")
+        print(f"{'ORM loop':<28} {rides:>11,} {orm_time:>8.2f} {rides / orm_time:>10,.0f} {'':>8} "
+              f"{orm_baseline:>9.0f}MB {orm_peak:>7.0f}MB")
+        year_totals, year_time, baseline, year_peak = in_child(run_earnings, db_path, START + timedelta(days=DAYS + 1), args.chunk_rows)
+        rides = sum(count for count, _ in year_totals.values())
+        print(f"{'arrow aggregation, year':<28} {rides:>11,} {year_time:>8.2f} {rides / year_time:>10,.0f} {'':>8} "
+              f"{baseline:>9.0f}MB {year_peak:>7.0f}MB")
+    finally:
+        os.remove(db_path)
+        os.rmdir(out_dir)
+
+
+if __name__ == "__main__":
+    main()
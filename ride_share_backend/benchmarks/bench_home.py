@@ -0,0 +1,136 @@
+# benchmarks/bench_home.py
+# End-to-end screen load over HTTP: the requests the driver and "my rides"
+# screens used to make (list endpoints plus one /ride/{id} per ride for the
+# fare) against one /driver/home or /user/home request.
+#
+#   python benchmarks/bench_home.py [--open-rides 500] [--iterations 10]
+import argparse
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import percentile, temp_database
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import models
+from database import get_db
+from dependencies import get_read_db, get_ride_read_db
+from routes import driver, home, rides
+from security import issue_tokens
+
+
+def populate(SessionLocal, open_rides):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(models.User, [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, 501)
+    ])
+    db.add(models.Driver(id=1, name="Driver", email="driver@example.com", password="x",
+                         license_number="L1", vehicle_type="car", vehicle_number="V1", is_available=False))
+    rows, participants = [], []
+    for n in range(1, open_rides + 61):
+        # The first 30 rides belong to the driver, the next 30 involve user 1
+        assigned = n <= 30
+        rows.append({
+            "id": n, "user_id": 1 if 30 < n <= 45 else random.randint(2, 500),
+            "driver_id": 1 if assigned else None,
+            "pickup": f"Place {random.randint(1, 200)}", "destination": f"Place {random.randint(1, 200)}",
+            "created_at": now - timedelta(minutes=n), "status": ("accepted" if n <= 2 else "completed") if assigned else "pending",
+            "participant_count": 2, "fare": 25.0,
+            "pickup_lat": 30.0 + random.random() * 0.2, "pickup_lng": 31.1 + random.random() * 0.2,
+        })
+        participants.append({"ride_id": n, "user_id": 1 if 45 < n <= 60 else random.randint(2, 500), "created_at": now})
+    db.bulk_insert_mappings(models.RideRequest, rows)
+    db.bulk_insert_mappings(models.RideParticipant, participants)
+    db.commit()
+    db.close()
+
+
+def build_client(SessionLocal):
+    app = FastAPI()
+    for module in (rides, driver, home):
+        app.include_router(module.router)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    # Reads go to the same temporary database
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_ride_read_db] = override_get_db
+    return TestClient(app)
+
+
+def old_driver_screen(client, headers):
+    available = client.get("/available-rides", headers=headers).json()
+    client.get("/driver/my-rides", headers=headers)
+    for ride in available["available_rides"]:
+        client.get(f"/ride/{ride['id']}", headers=headers)
+    return 2 + len(available["available_rides"])
+
+
+def new_driver_screen(client, headers):
+    client.get("/driver/home", headers=headers)
+    return 1
+
+
+def old_rider_screen(client, headers):
+    client.get("/user/rides", headers=headers)
+    joined = client.get("/user/joined-rides", headers=headers).json()
+    for ride in joined["rides"]:
+        client.get(f"/ride/{ride['id']}", headers=headers)
+    return 2 + len(joined["rides"])
+
+
+def new_rider_screen(client, headers):
+    client.get("/user/home", headers=headers)
+    return 1
+
+
+def measure(label, iterations, load):
+    samples = []
+    requests = 0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        requests = load()
+        samples.append(time.perf_counter() - start)
+    p50 = percentile(samples, 50)
+    print(f"{label:<34} {requests:6d} requests   p50 {p50 * 1000:9.1f} ms   p95 {percentile(samples, 95) * 1000:9.1f} ms")
+    return p50
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--open-rides", type=int, default=500)
+    parser.add_argument("--iterations", type=int, default=10)
+    args = parser.parse_args()
+
+    random.seed(5)
+    engine, SessionLocal, path = temp_database("home")
+    try:
+        populate(SessionLocal, args.open_rides)
+        client = build_client(SessionLocal)
+        driver_headers = {"Authorization": "Bearer " + issue_tokens(1, "driver@example.com", "driver")["access_token"]}
+        rider_headers = {"Authorization": "Bearer " + issue_tokens(1, "user1@example.com", "user")["access_token"]}
+
+        print(f"{args.open_rides} open rides, driver with 30 rides, rider with 30 rides")
+        old = measure("driver screen, before", args.iterations, lambda: old_driver_screen(client, driver_headers))
+        new = measure("driver screen, /driver/home", args.iterations, lambda: new_driver_screen(client, driver_headers))
+        print(f"driver screen load {old / new:.0f}x faster")
+        old = measure("my rides screen, before", args.iterations, lambda: old_rider_screen(client, rider_headers))
+        new = measure("my rides screen, /user/home", args.iterations, lambda: new_rider_screen(client, rider_headers))
+        print(f"my rides screen load {old / new:.0f}x faster")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+# benchmarks/bench_maintenance.py
+# Bulk maintenance (maintenance.py) on a million-ride database: purging
+# stale pending rides with different chunk sizes, deleting a heavy rider's
+# account and releasing a driver's accepted rides, against the per-ride ORM
+# path the endpoints use (delete_ride, one transaction per ride). While
+# each operation runs, a writer thread keeps creating rides through the
+# ORM the way /ride-request does; its latency shows how long requests wait
+# for the write lock between chunks, with and without the pauses that
+# keep the operation to its BULK_LOCK_SHARE of the lock. The database runs in WAL mode with
+# the search index, as the app does.
+#
+#   python benchmarks/bench_maintenance.py [--rides 1000000] [--users 50000] [--drivers 2000] [--orm-rides 2000]
+import argparse
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import percentile, temp_database
+
+from sqlalchemy import text
+
+from database import use_wal
+from ride_state import transition
+from sharding import ShardRouter
+import maintenance
+import models
+import ride_search
+
+START = datetime(2025, 1, 1)
+DAYS = 365
+HEAVY_USER = 1  # Creates 1% of the rides and joins about 1.7% of the joined ones
+HEAVY_DRIVER = 1  # Holds 5,000 accepted rides per million
+
+
+def populate(engine, rides, users, drivers):
+    # A tenth of the rides are pending and unassigned, a tenth accepted, the rest completed
+    seconds = DAYS * 24 * 3600 / rides
+    with engine.begin() as conn:
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :users)
+            INSERT INTO users (id, name, email, password) SELECT i, 'user ' || i, 'user' || i || '@example.com', 'x' FROM n
+        """), {"users": users})
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :drivers)
+            INSERT INTO drivers (id, name, email, password, license_number, vehicle_number, is_available)
+            SELECT i, 'driver ' || i, 'driver' || i || '@example.com', 'x', 'L' || i, 'V' || i, 1 FROM n
+        """), {"drivers": drivers})
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rides)
+            INSERT INTO ride_requests (id, user_id, driver_id, pickup, destination, created_at, participant_count,
+                                       status, fare, pickup_lat, pickup_lng, version)
+            SELECT i, CASE WHEN i % 100 = 57 THEN :heavy_user ELSE 2 + i % (:users - 1) END,
+                   CASE WHEN i % 10 = 0 THEN NULL WHEN i % 200 = 1 THEN :heavy_driver ELSE 2 + (i * 7919) % (:drivers - 1) END,
+                   'Pickup ' || (i % 500), 'Destination ' || (i % 700),
+                   datetime(:start, '+' || CAST(i * :seconds AS INTEGER) || ' seconds') || '.000000',
+                   1 + (i % 3 = 0),
+                   CASE WHEN i % 10 = 0 THEN 'pending' WHEN i % 10 = 1 THEN 'accepted' ELSE 'completed' END,
+                   20.0 + (i % 53), 30.0 + (i % 1000) * 0.001, 31.0 + (i % 997) * 0.001, 1
+            FROM n
+        """), {"rides": rides, "users": users, "drivers": drivers, "start": START.isoformat(" "), "seconds": seconds,
+               "heavy_user": HEAVY_USER, "heavy_driver": HEAVY_DRIVER})
+        conn.execute(text("""
+            INSERT INTO ride_participants (ride_id, user_id, version)
+            SELECT id, CASE WHEN id % 60 = 33 THEN :heavy_user ELSE 2 + (id * 31) % (:users - 1) END, 1
+            FROM ride_requests WHERE id % 3 = 0
+        """), {"users": users, "heavy_user": HEAVY_USER})
+
+
+class Writer(threading.Thread):
+    """Creates a ride every ``interval`` seconds through the ORM, timing each commit."""
+
+    def __init__(self, SessionLocal, users, interval=0.01):
+        super().__init__(daemon=True)
+        self.SessionLocal = SessionLocal
+        self.users = users
+        self.interval = interval
+        self.latencies = []
+        self.errors = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        n = 0
+        while not self.stopped.is_set():
+            n += 1
+            db = self.SessionLocal()
+            start = time.perf_counter()
+            try:
+                ride = models.RideRequest(user_id=2 + n % (self.users - 1), pickup="Writer pickup", destination="Writer destination",
+                                          fare=20.0, pickup_lat=30.0, pickup_lng=31.0)
+                db.add(ride)
+                transition(db, ride, "create", actor_type="user", actor_id=ride.user_id)
+                db.commit()
+                self.latencies.append(time.perf_counter() - start)
+            except Exception:
+                self.errors += 1
+                db.rollback()
+            finally:
+                db.close()
+            self.stopped.wait(self.interval)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def while_writing(SessionLocal, users, fn):
+    # Run fn() with the writer going; returns fn's result, seconds, and the writer
+    writer = Writer(SessionLocal, users)
+    writer.start()
+    time.sleep(0.2)
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    writer.stop()
+    return result, elapsed, writer
+
+
+def orm_delete(SessionLocal, ride_ids):
+    # What DELETE /ride/{id} does, one ride per transaction
+    for ride_id in ride_ids:
+        db = SessionLocal()
+        try:
+            ride = db.get(models.RideRequest, ride_id)
+            transition(db, ride, "delete", actor_type="user", actor_id=ride.user_id)
+            for participant in db.query(models.RideParticipant).filter(models.RideParticipant.ride_id == ride_id):
+                db.delete(participant)
+            db.flush()
+            db.delete(ride)
+            db.commit()
+        finally:
+            db.close()
+
+
+def report(label, rows, elapsed, writer, longest_ms=None):
+    samples = writer.latencies
+    longest = f"{longest_ms:>9.1f}" if longest_ms is not None else f"{'':>9}"
+    print(f"{label:<34} {rows:>8,} {elapsed:>8.2f} {rows / elapsed:>9,.0f} {longest} "
+          f"{percentile(samples, 50) * 1000:>8.1f} {percentile(samples, 99) * 1000:>8.1f} "
+          f"{max(samples, default=0) * 1000:>8.1f} {writer.errors:>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=1_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--drivers", type=int, default=2000)
+    parser.add_argument("--orm-rides", type=int, default=2000, help="stale rides deleted one by one for the comparison")
+    args = parser.parse_args()
+
+    engine, SessionLocal, path = temp_database("maintenance")
+    use_wal(engine)
+    router = ShardRouter(engine, SessionLocal)
+    try:
+        start = time.perf_counter()
+        populate(engine, args.rides, args.users, args.drivers)
+        populated = time.perf_counter() - start
+        ride_search.ensure_search_index(engine)
+        with engine.connect() as conn:
+            participants = conn.execute(text("SELECT count(*) FROM ride_participants")).scalar()
+        print(f"{args.rides:,} rides, {participants:,} participants generated in {populated:.0f}s, "
+              f"indexed in {time.perf_counter() - start - populated:.0f}s ({os.path.getsize(path) / 1e6:,.0f} MB)")
+
+        print(f"{'operation':<34} {'rows':>8} {'seconds':>8} {'rows/s':>9} {'max tx ms':>9} "
+              f"{'write p50':>8} {'p99':>8} {'max':>8} {'errors':>6}")
+
+        # Without maintenance running
+        _, elapsed, writer = while_writing(SessionLocal, args.users, lambda: time.sleep(3))
+        report("(writer alone)", 0, elapsed, writer)
+
+        # The per-ride path, on the oldest stale rides
+        with engine.connect() as conn:
+            ids = conn.execute(text(
+                "SELECT id FROM ride_requests WHERE status = 'pending' AND driver_id IS NULL ORDER BY id LIMIT :limit"
+            ), {"limit": args.orm_rides}).scalars().all()
+        _, elapsed, writer = while_writing(SessionLocal, args.users, lambda: orm_delete(SessionLocal, ids))
+        report("purge, ORM one ride per tx", len(ids), elapsed, writer)
+
+        # Bulk purges, each over another quarter of the year
+        runs = ((100, maintenance.BULK_LOCK_SHARE), (maintenance.BULK_CHUNK_ROWS, 1.0),
+                (maintenance.BULK_CHUNK_ROWS, maintenance.BULK_LOCK_SHARE), (10000, maintenance.BULK_LOCK_SHARE))
+        for quarter, (chunk_rows, lock_share) in enumerate(runs, start=1):
+            now = START + timedelta(days=DAYS * quarter / 4)
+            result, elapsed, writer = while_writing(SessionLocal, args.users, lambda: maintenance.purge_stale_rides(
+                timedelta(0), now=now, router=router, chunk_rows=chunk_rows, lock_share=lock_share
+            ))
+            report(f"purge, chunks of {chunk_rows}, share {lock_share:g}", result["rides_deleted"], elapsed, writer,
+                   result["longest_transaction_ms"])
+
+        result, elapsed, writer = while_writing(SessionLocal, args.users, lambda: maintenance.delete_user_account(
+            HEAVY_USER, router=router
+        ))
+        report("delete account, rides", result["rides_deleted"], elapsed, writer, result["longest_transaction_ms"])
+        print(f"{'  and participations removed':<34} {result['participations_removed']:>8,}")
+
+        result, elapsed, writer = while_writing(SessionLocal, args.users, lambda: maintenance.release_driver_rides(
+            HEAVY_DRIVER, router=router
+        ))
+        report("release driver's rides", result["rides_released"], elapsed, writer, result["longest_transaction_ms"])
+
+        with engine.connect() as conn:
+            counts = conn.execute(text("""
+                SELECT (SELECT count(*) FROM ride_requests WHERE status = 'pending' AND driver_id IS NULL
+                        AND pickup <> 'Writer pickup'),
+                       (SELECT count(*) FROM ride_requests WHERE user_id = :user),
+                       (SELECT count(*) FROM ride_participants WHERE user_id = :user),
+                       (SELECT count(*) FROM ride_requests WHERE driver_id = :driver AND status = 'accepted'),
+                       (SELECT count(*) FROM ride_events), (SELECT count(*) FROM sync_tombstones),
+                       (SELECT count(*) FROM ride_requests) - (SELECT count(*) FROM ride_search)
+            """), {"user": HEAVY_USER, "driver": HEAVY_DRIVER}).one()
+        print(f"\nleft: {counts[0]:,} generated pending rides (released ones included), {counts[1]} rides and "
+              f"{counts[2]} participations of the deleted user, {counts[3]} accepted rides of the driver; "
+              f"{counts[4]:,} events and {counts[5]:,} tombstones written; rides missing from the index: {counts[6]}")
+    finally:
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+if __name__ == "__main__":
+    main()
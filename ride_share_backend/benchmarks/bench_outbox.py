@@ -0,0 +1,201 @@
+# benchmarks/bench_outbox.py
+# Outbox worker throughput (with and without failing deliveries), and
+# /join-ride latency while the worker drains a large notification backlog
+# through a slow sink, against delivering the notification inline.
+#
+#   python benchmarks/bench_outbox.py [--messages 20000] [--backlog 50000] [--requests 300] [--sink-latency 0.02]
+import argparse
+import asyncio
+import os
+import random
+import threading
+import time
+from datetime import datetime
+
+from common import percentile, temp_database
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import insert
+
+import models
+import outbox
+from database import get_db
+from dependencies import get_read_db, get_ride_read_db
+from routes import rides
+from security import issue_tokens
+
+
+def seed_messages(SessionLocal, count):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.execute(insert(models.OutboxMessage), [{
+        "topic": outbox.RIDER_JOINED, "recipient_type": "user", "recipient_id": n % 1000 + 1,
+        "payload": '{"ride_id": %d, "rider": {"id": 2, "email": "user2@example.com"}}' % n,
+        "created_at": now, "next_attempt_at": now,
+    } for n in range(count)])
+    db.commit()
+    db.close()
+
+
+def drain(worker):
+    start = time.perf_counter()
+    while worker.drain_once():
+        pass
+    return time.perf_counter() - start
+
+
+def throughput(SessionLocal, messages):
+    seed_messages(SessionLocal, messages)
+    worker = outbox.OutboxWorker(SessionLocal, sink=outbox.LoopbackSink())
+    elapsed = drain(worker)
+    print(f"drain {messages:,} messages, loopback sink        {messages / elapsed:10.0f} msg/s   ({elapsed:.2f}s)")
+
+    # One delivery in ten fails; retries are due immediately so the run measures the bookkeeping
+    seed_messages(SessionLocal, messages)
+    base = outbox.BACKOFF_BASE_SECONDS
+    outbox.BACKOFF_BASE_SECONDS = 0.0
+    try:
+        worker = outbox.OutboxWorker(SessionLocal, sink=outbox.LoopbackSink(fail=lambda message: random.random() < 0.1))
+        elapsed = drain(worker)
+    finally:
+        outbox.BACKOFF_BASE_SECONDS = base
+    stats = worker.metrics.snapshot()
+    print(f"drain {messages:,} messages, 10% failing sink     {stats['delivered'] / elapsed:10.0f} msg/s   "
+          f"({stats['retried']} retries, {stats['dead_lettered']} dead-lettered)")
+
+
+def populate_rides(SessionLocal, requests):
+    # One ride per three joins; user 1 creates every ride, users 2.. join them
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.execute(insert(models.User), [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, requests + 2)
+    ])
+    db.execute(insert(models.RideRequest), [{
+        "id": n, "user_id": 1, "pickup": "A", "destination": "B", "created_at": now,
+        "status": "pending", "participant_count": 1, "fare": 25.0,
+    } for n in range(1, requests + 1)])
+    db.commit()
+    db.close()
+
+
+def build_client(SessionLocal):
+    app = FastAPI()
+    app.include_router(rides.router)
+
+    def override_get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    # Reads go to the same temporary database
+    app.dependency_overrides[get_read_db] = override_get_db
+    app.dependency_overrides[get_ride_read_db] = override_get_db
+    return TestClient(app)
+
+
+def start_worker(worker):
+    # Run OutboxWorker.run() on its own event loop thread, as the app's lifespan would
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(worker.run())
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+
+    thread = threading.Thread(target=serve)
+    thread.start()
+
+    def stop():
+        loop.call_soon_threadsafe(task.cancel)
+        thread.join()
+
+    return stop
+
+
+def join_latencies(client, joins, after=None):
+    samples = []
+    for ride_id, headers in joins:
+        start = time.perf_counter()
+        response = client.post(f"/join-ride/{ride_id}", headers=headers)
+        assert response.status_code == 200, response.text
+        if after is not None:
+            after(response.json())
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def report(label, samples):
+    print(f"{label:<46} p50 {percentile(samples, 50) * 1000:8.2f} ms   p95 {percentile(samples, 95) * 1000:8.2f} ms")
+
+
+def request_latency(SessionLocal, requests, backlog, sink_latency):
+    populate_rides(SessionLocal, requests)
+    client = build_client(SessionLocal)
+    users = iter(range(2, requests + 2))
+
+    def next_joins(rides):
+        # Each join by a different rider, so every request succeeds
+        return [
+            (ride_id, {"Authorization": "Bearer " + issue_tokens(user_id, f"user{user_id}@example.com", "user")["access_token"]})
+            for ride_id, user_id in zip(rides, users)
+        ]
+
+    third = requests // 3
+    ride_ids = list(range(1, requests + 1))
+
+    # Outbox write only, nothing draining
+    samples = join_latencies(client, next_joins(ride_ids[:third]))
+    report("join, outbox, worker idle", samples)
+
+    # Outbox write while the worker drains a large backlog through a slow sink
+    seed_messages(SessionLocal, backlog)
+    worker = outbox.OutboxWorker(SessionLocal, sink=outbox.LoopbackSink(latency=sink_latency))
+    stop = start_worker(worker)
+    try:
+        samples = join_latencies(client, next_joins(ride_ids[third:2 * third]))
+    finally:
+        stop()
+    stats = worker.metrics.snapshot()
+    report(f"join, outbox, worker draining {backlog:,} backlog", samples)
+    print(f"{'':<46} worker delivered {stats['delivered']:,} at {stats['delivered_per_second']:.0f} msg/s meanwhile")
+
+    # Delivering inside the request instead: one sink round trip per notification
+    inline_sink = outbox.LoopbackSink(latency=sink_latency)
+
+    def deliver_inline(body):
+        inline_sink.deliver([outbox.Message(None, outbox.RIDER_JOINED, "user", 1, body, 0, datetime.utcnow())])
+
+    samples = join_latencies(client, next_joins(ride_ids[2 * third:]), after=deliver_inline)
+    report(f"join, inline delivery ({sink_latency * 1000:.0f} ms sink)", samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--backlog", type=int, default=50000)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--sink-latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    random.seed(35)
+    engine, SessionLocal, path = temp_database("outbox")
+    try:
+        throughput(SessionLocal, args.messages)
+        request_latency(SessionLocal, args.requests, args.backlog, args.sink_latency)
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# benchmarks/bench_pooling.py
+# Pooling optimizer cycle time on synthetic city data: open requests drawn
+# around a handful of hotspots in a 30x30 km city over a 3 hour window.
+#
+#   python benchmarks/bench_pooling.py [--requests 100000]
+import argparse
+import random
+import time
+
+import common  # noqa: F401 - sets up sys.path
+
+from pooling import OpenRequest, PoolingOptimizer
+
+CITY_LAT, CITY_LNG = 30.05, 31.24  # City centre
+CITY_SPAN_DEG = 0.27  # About 30 km
+
+
+def synthetic_city(count, first_id=1, start=1_700_000_000):
+    random.seed(first_id)
+    hotspots = [
+        (CITY_LAT + random.uniform(-0.1, 0.1), CITY_LNG + random.uniform(-0.1, 0.1))
+        for _ in range(40)
+    ]
+
+    def point():
+        if random.random() < 0.6:
+            lat, lng = random.choice(hotspots)
+            return lat + random.gauss(0, 0.008), lng + random.gauss(0, 0.008)
+        return (CITY_LAT + random.uniform(-CITY_SPAN_DEG / 2, CITY_SPAN_DEG / 2),
+                CITY_LNG + random.uniform(-CITY_SPAN_DEG / 2, CITY_SPAN_DEG / 2))
+
+    requests = []
+    for n in range(count):
+        (plat, plng), (dlat, dlng) = point(), point()
+        requests.append(OpenRequest(
+            id=first_id + n,
+            user_id=first_id + n,
+            seats=1 if random.random() < 0.8 else 2,
+            fare=random.uniform(20, 120),
+            departure=start + random.uniform(0, 3 * 3600),
+            pickup=f"{plat:.4f},{plng:.4f}",
+            destination=f"{dlat:.4f},{dlng:.4f}",
+            pickup_lat=plat, pickup_lng=plng, destination_lat=dlat, destination_lng=dlng,
+        ))
+    return requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=100000)
+    parser.add_argument("--incremental", type=int, default=2000)
+    args = parser.parse_args()
+
+    requests = synthetic_city(args.requests)
+    optimizer = PoolingOptimizer()
+
+    start = time.perf_counter()
+    optimizer.sync(requests)
+    indexed = time.perf_counter()
+    trips = optimizer.solve()
+    solved = time.perf_counter()
+
+    pooled = sum(len(trip.members) for trip in trips)
+    solo_km = sum(member.direct_km for trip in trips for member in trip.members)
+    shared_km = sum(trip.route_km for trip in trips)
+    print(f"{'index ' + str(args.requests) + ' requests':<40} {(indexed - start) * 1000:10.1f} ms")
+    print(f"{'full cycle solve':<40} {(solved - indexed) * 1000:10.1f} ms")
+    print(f"trips formed: {len(trips)}, requests pooled: {pooled} ({pooled / args.requests:.0%})")
+    print(f"vehicle-km for pooled riders: {solo_km:,.0f} solo -> {shared_km:,.0f} shared")
+
+    # Next cycle: unmatched requests stay indexed, only new arrivals seed
+    remaining = list(optimizer.requests.values())
+    arrivals = synthetic_city(args.incremental, first_id=args.requests + 1)
+    start = time.perf_counter()
+    optimizer.sync(remaining + arrivals)
+    trips = optimizer.solve()
+    print(f"{'incremental cycle (' + str(args.incremental) + ' new)':<40} {(time.perf_counter() - start) * 1000:10.1f} ms, {len(trips)} trips")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# benchmarks/bench_rate_limit.py
+# Drive a polling-style endpoint past its capacity and compare tail latency
+# of admitted requests with and without the load shedding middleware.
+#
+#   python benchmarks/bench_rate_limit.py [--clients 300] [--requests 20]
+import argparse
+import asyncio
+import time
+
+import common  # noqa: F401 - sets up sys.path
+from common import percentile
+
+import httpx
+from fastapi import FastAPI
+from rate_limit import RateLimitMiddleware, RateLimiter, LoadShedder, RouteBudget
+from security import issue_tokens
+
+WORK_SECONDS = 0.004  # simulated DB time per request
+
+
+def build_app(with_middleware: bool):
+    app = FastAPI()
+
+    @app.get("/available-rides")
+    def available_rides():
+        time.sleep(WORK_SECONDS)
+        return {"available_rides": []}
+
+    if with_middleware:
+        # Generous per-client budgets: this run measures shedding, not limits
+        limiter = RateLimiter(default_budget=RouteBudget(1000.0, 1000.0), route_budgets={})
+        app.add_middleware(RateLimitMiddleware, limiter=limiter, shedder=LoadShedder(max_in_flight=32))
+    return app
+
+
+async def run_clients(app, clients: int, requests_per_client: int, retry: bool):
+    latencies = []
+    statuses = {}
+    transport = httpx.ASGITransport(app=app)
+
+    async def client(n):
+        token = issue_tokens(n, f"driver{n}@example.com", "driver")["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            for _ in range(requests_per_client):
+                start = time.perf_counter()
+                response = await http.get("/available-rides", headers=headers)
+                elapsed = time.perf_counter() - start
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                elif retry:
+                    # Well-behaved clients back off for a fraction of Retry-After
+                    await asyncio.sleep(float(response.headers.get("retry-after", 1)) * 0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(n) for n in range(clients)))
+    return latencies, statuses, time.perf_counter() - start
+
+
+def report(label, latencies, statuses, wall):
+    print(f"{label}")
+    print(f"  statuses          {dict(sorted(statuses.items()))}")
+    print(f"  admitted/s        {len(latencies) / wall:10.1f}")
+    print(f"  p50 latency       {percentile(latencies, 50) * 1000:10.1f} ms")
+    print(f"  p99 latency       {percentile(latencies, 99) * 1000:10.1f} ms")
+    print(f"  max latency       {max(latencies or [0]) * 1000:10.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=20)
+    args = parser.parse_args()
+
+    for label, with_middleware in (("no middleware", False), ("rate limit + load shedding", True)):
+        latencies, statuses, wall = asyncio.run(
+            run_clients(build_app(with_middleware), args.clients, args.requests, retry=with_middleware)
+        )
+        report(label, latencies, statuses, wall)
+
+    # Per-principal limiting: a single client hammering the polling route
+    limiter = RateLimiter()
+    limited = 0
+    now = 0.0
+    for _ in range(1000):
+        now += 0.01  # 100 requests per second
+        if limiter.check("/available-rides", "driver:flood@example.com", "10.0.0.1", now=now):
+            limited += 1
+    print(f"single principal at 100 req/s for 10s: {1000 - limited} admitted, {limited} rejected")
+
+
+if __name__ == "__main__":
+    main()
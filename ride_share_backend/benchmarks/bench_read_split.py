@@ -0,0 +1,195 @@
+# benchmarks/bench_read_split.py
+# Read latency under write bursts. Reader threads poll /user/rides and
+# /ride/{id} while writer processes write in bursts: either rides created
+# one by one through the same route functions the API uses, or batch
+# transactions of --batch rides each (a backfill, replay or bulk import),
+# which hold the write lock much longer. Three setups:
+#   primary, rollback journal  reads share the read-write pool, the old default
+#   primary, WAL               same pool, database in WAL mode
+#   read pool, WAL             reads on mode=ro connections (get_read_db)
+# Each setup is measured idle and then under each kind of write burst.
+#
+#   python benchmarks/bench_read_split.py [--seconds 5] [--readers 2] [--writers 2] [--burst-ms 200] [--pause-ms 100] [--batch 20000]
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+
+from common import percentile, temp_database
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+import sync
+from database import read_engine_for, ReadSessionFactory
+from routes.rides import create_ride_request, get_ride_details, get_user_rides
+from schemas import RideCreate
+from security import Principal
+
+USERS = 1000
+RIDES = 20000
+
+SETUPS = [
+    ("primary, rollback journal", "delete", False),
+    ("primary, WAL", "wal", False),
+    ("read pool, WAL", "wal", True),
+]
+
+
+def populate(SessionLocal):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(models.User, [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, USERS + 1)
+    ])
+    db.bulk_insert_mappings(models.RideRequest, [{
+        "id": n, "user_id": random.randint(1, USERS),
+        "pickup": f"Place {random.randint(1, 200)}", "destination": f"Place {random.randint(1, 200)}",
+        "created_at": now - timedelta(minutes=n), "status": "pending",
+        "participant_count": 1, "fare": 25.0, "version": 1, "updated_at": now,
+    } for n in range(1, RIDES + 1)])
+    db.add(models.SyncClock(name=sync.CLOCK_NAME, version=1, pruned_version=0))
+    db.commit()
+    db.close()
+
+
+def write_batch(db, rng, size):
+    # One transaction inserting many rides
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(models.RideRequest, [{
+        "user_id": rng.randint(1, USERS), "pickup": "A", "destination": "B", "created_at": now,
+        "status": "pending", "participant_count": 1, "fare": 25.0, "version": 1, "updated_at": now,
+    } for _ in range(size)])
+    db.commit()
+
+
+def writer(path, deadline, burst, pause, batch, seed, results):
+    # Bursts of writes with pauses in between, like a busy API worker or a batch job
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    rng = random.Random(seed)
+    writes = errors = 0
+    while time.perf_counter() < deadline:
+        burst_end = min(time.perf_counter() + burst, deadline)
+        while time.perf_counter() < burst_end:
+            user = rng.randint(1, USERS)
+            db = SessionLocal()
+            try:
+                if batch > 1:
+                    write_batch(db, rng, batch)
+                    writes += batch
+                else:
+                    create_ride_request(RideCreate(pickup="A", destination="B", fare=25.0),
+                                        Principal(user, f"user{user}@example.com", "user"), db)
+                    writes += 1
+            except Exception:
+                errors += 1
+            finally:
+                db.close()
+        time.sleep(pause)
+    engine.dispose()
+    results.put((writes, errors))
+
+
+def reader(read_sessions, deadline, seed, latencies, errors):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        user = rng.randint(1, USERS)
+        principal = Principal(user, f"user{user}@example.com", "user")
+        db = read_sessions()
+        start = time.perf_counter()
+        try:
+            if rng.random() < 0.5:
+                asyncio.run(get_user_rides(since=None, until=None, since_version=None, current_user=principal, db=db))
+            else:
+                asyncio.run(get_ride_details(ride_id=rng.randint(1, RIDES), current_user=principal, db=db))
+            latencies.append(time.perf_counter() - start)
+        except Exception:
+            errors.append(time.perf_counter() - start)
+        finally:
+            db.close()
+
+
+def measure(path, read_sessions, args, writers, batch):
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    deadline = time.perf_counter() + args.seconds
+    processes = [
+        context.Process(target=writer, args=(path, deadline, args.burst_ms / 1000, args.pause_ms / 1000, batch, n, results))
+        for n in range(writers)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], []
+    threads = [threading.Thread(target=reader, args=(read_sessions, deadline, n, latencies, errors)) for n in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writes = 0
+    for _ in processes:
+        writes += results.get()[0]
+    for process in processes:
+        process.join()
+    return {
+        "reads": len(latencies), "read_errors": len(errors), "writes_per_second": writes / args.seconds,
+        "p50": percentile(latencies, 50), "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99), "max": max(latencies, default=0.0),
+    }
+
+
+def run(label, journal_mode, read_pool, args):
+    random.seed(5)
+    engine, SessionLocal, path = temp_database("read_split")
+    read_engine = None
+    try:
+        with engine.connect() as conn:
+            conn.exec_driver_sql(f"PRAGMA journal_mode={journal_mode}")
+        populate(SessionLocal)
+        if read_pool:
+            read_engine = read_engine_for(f"sqlite:///{path}")
+            read_sessions = ReadSessionFactory([read_engine])
+        else:
+            read_sessions = SessionLocal
+        # Connections must not be shared with the writer processes
+        engine.dispose()
+        phases = ((0, 1, "idle"), (args.writers, 1, "API writes"), (args.writers, args.batch, "batch writes"))
+        for writers, batch, phase in phases:
+            result = measure(path, read_sessions, args, writers, batch)
+            print(f"{label:<26} {phase:<13} {result['p50'] * 1000:>8.2f} {result['p95'] * 1000:>8.2f} "
+                  f"{result['p99'] * 1000:>8.2f} {result['max'] * 1000:>9.1f} {result['reads']:>7} "
+                  f"{result['read_errors']:>7} {result['writes_per_second']:>9.1f}")
+    finally:
+        if read_engine is not None:
+            read_engine.dispose()
+        engine.dispose()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--burst-ms", type=float, default=200.0)
+    parser.add_argument("--pause-ms", type=float, default=100.0)
+    parser.add_argument("--batch", type=int, default=20000, help="rides per transaction in the batch write bursts")
+    args = parser.parse_args()
+
+    print(f"{args.readers} reader threads, {args.writers} writer processes on {os.cpu_count()} CPUs; "
+          f"{RIDES} rides, writes in {args.burst_ms:.0f} ms bursts every {args.burst_ms + args.pause_ms:.0f} ms, "
+          f"batches of {args.batch}")
+    print(f"{'':<26} {'':<13} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>9} {'reads':>7} {'errors':>7} {'writes/s':>9}")
+    for label, journal_mode, read_pool in SETUPS:
+        run(label, journal_mode, read_pool, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+# benchmarks/bench_ride_store.py
+# Memory per ride and queries/sec of the in-memory open ride store against
+# the database-backed /available-rides and /match-rides, at 100k and 1M
+# open rides.
+#
+#   python benchmarks/bench_ride_store.py [--sizes 100000,1000000] [--seconds 2]
+import argparse
+import asyncio
+import gc
+import os
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from common import temp_database
+
+from sqlalchemy import insert
+
+import models
+from ride_store import OpenRideStore, open_rides
+from routes.driver import get_available_rides
+from routes.rides import match_rides
+from security import Principal
+
+PLACES = 200
+
+
+def populate(SessionLocal, rides, chunk=50000):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    db.execute(insert(models.User), [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, 10001)
+    ])
+    for start in range(1, rides + 1, chunk):
+        ids = range(start, min(start + chunk, rides + 1))
+        db.execute(insert(models.RideRequest), [{
+            "id": n, "user_id": random.randint(1, 10000),
+            "pickup": f"Place {random.randint(1, PLACES)}", "destination": f"Place {random.randint(1, PLACES)}",
+            "created_at": now - timedelta(seconds=n), "departure_time": now + timedelta(minutes=n % 600),
+            "status": "pending", "participant_count": 2, "fare": 25.0,
+            "pickup_lat": 30.0 + random.random() * 0.2, "pickup_lng": 31.1 + random.random() * 0.2,
+            "version": 1,
+        } for n in ids])
+        db.execute(insert(models.RideParticipant), [
+            {"ride_id": n, "user_id": random.randint(1, 10000), "created_at": now} for n in ids
+        ])
+    db.commit()
+    db.close()
+
+
+def hydrate(SessionLocal):
+    store = OpenRideStore()
+    db = SessionLocal()
+    start = time.perf_counter()
+    store.hydrate(db)
+    elapsed = time.perf_counter() - start
+    db.close()
+    return store, elapsed
+
+
+def measure_orm_memory(SessionLocal, limit):
+    # What holding the same rides as ORM objects in a session costs
+    db = SessionLocal()
+    gc.collect()
+    tracemalloc.start()
+    rides = db.query(models.RideRequest).limit(limit).all()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    db.close()
+    return current / len(rides)
+
+
+def qps(seconds, call):
+    count = 0
+    deadline = time.perf_counter() + seconds
+    start = time.perf_counter()
+    while time.perf_counter() < deadline:
+        call()
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def run(size, seconds):
+    random.seed(size)
+    engine, SessionLocal, path = temp_database("ride_store")
+    try:
+        start = time.perf_counter()
+        populate(SessionLocal, size)
+        print(f"\n{size:,} open rides (populated in {time.perf_counter() - start:.1f}s)")
+
+        store, hydrate_time = hydrate(SessionLocal)
+        memory = store.memory_usage()
+        print(f"  store memory         {memory / 1024 / 1024:8.1f} MiB  ({memory / size:6.0f} bytes/ride, hydrated in {hydrate_time:.1f}s)")
+        orm_bytes = measure_orm_memory(SessionLocal, min(size, 20000))
+        print(f"  ORM objects          {orm_bytes:8.0f} bytes/ride (tracemalloc, first {min(size, 20000):,} rides)")
+
+        # Route the endpoints through the store just measured
+        open_rides.__dict__.update(store.__dict__)
+        driver = Principal(1, "driver@example.com", "driver")
+        rider = Principal(1, "user1@example.com", "user")
+
+        def route():
+            return f"Place {random.randint(1, PLACES)}", f"Place {random.randint(1, PLACES)}"
+
+        def match_call(db):
+            pickup, destination = route()
+            return match_rides(pickup=pickup, destination=destination, lat=None, lng=None, current_user=rider, db=db)
+
+        loop = asyncio.new_event_loop()
+
+        def available_call(db):
+            return loop.run_until_complete(get_available_rides(since_version=None, limit=50, lat=None, lng=None, current_user=driver, db=db))
+
+        for label, call in (("/match-rides", match_call), ("/available-rides?limit=50", available_call)):
+            results = {}
+            for backend, ready in (("database", False), ("store", True)):
+                open_rides.ready = ready
+                db = SessionLocal()
+                results[backend] = qps(seconds, lambda: call(db))
+                db.close()
+            print(f"  {label:<26} database {results['database']:10.1f} qps   store {results['store']:10.1f} qps   "
+                  f"({results['store'] / results['database']:.0f}x)")
+
+        loop.close()
+
+        open_rides.ready = True
+        start = time.perf_counter()
+        full = open_rides.available_rides()
+        print(f"  full /available-rides from the store: {len(full):,} rides in {(time.perf_counter() - start) * 1000:.0f} ms")
+    finally:
+        open_rides.__init__()
+        engine.dispose()
+        os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100000,1000000")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    for size in (int(value) for value in args.sizes.split(",")):
+        run(size, args.seconds)
+
+
+if __name__ == "__main__":
+    main()
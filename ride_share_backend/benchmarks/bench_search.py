@@ -0,0 +1,182 @@
+# benchmarks/bench_search.py
+# Ride search (ride_search.py) over a large history: FTS5 queries against
+# the LIKE scans they replace, searching every ride (as support staff
+# would) and only one user's or driver's rides (as /rides/search does).
+# Also reports how fast the index is built from existing rides, its size,
+# what keeping it current costs each ride created through the ORM, and
+# how long the background segment merge takes after those writes.
+#
+#   python benchmarks/bench_search.py [--rides 2000000] [--users 50000] [--drivers 2000] [--repeat 30]
+import argparse
+import os
+import random
+import string
+import time
+
+from common import percentile, temp_database
+
+from sqlalchemy import insert, text
+
+import models
+import ride_search
+
+SYLLABLES = ["al", "ex", "an", "dri", "ca", "iro", "gi", "za", "ma", "adi", "na", "sr", "he", "lio", "po", "lis",
+             "zam", "ek", "mo", "har", "ram", "ses", "shu", "bra", "ta", "hri", "du", "kki", "ab", "bas", "si", "ya"]
+PLACE_KINDS = ["Street", "Square", "Mall", "Station", "Gate", "Club", "University", "Hospital", "Bridge", "Tower"]
+
+
+def words(count, rng, syllables=(2, 4)):
+    made = set()
+    while len(made) < count:
+        made.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(*syllables))).capitalize())
+    return sorted(made)
+
+
+def populate(engine, rides, users, drivers, rng):
+    places = [f"{word} {rng.choice(PLACE_KINDS)}" for word in words(3000, rng)]
+    first, last = words(300, rng), words(500, rng)
+    with engine.begin() as conn:
+        conn.execute(insert(models.User), [
+            {"id": n, "name": f"{rng.choice(first)} {rng.choice(last)}", "email": f"user{n}@example.com", "password": "x"}
+            for n in range(1, users + 1)
+        ])
+        conn.execute(insert(models.Driver), [
+            {"id": n, "name": f"{rng.choice(first)} {rng.choice(last)}", "email": f"driver{n}@example.com", "password": "x",
+             "license_number": f"L{n}", "vehicle_type": "car",
+             "vehicle_number": f"{''.join(rng.choices(string.ascii_uppercase, k=3))}-{n:04d}"}
+            for n in range(1, drivers + 1)
+        ])
+        conn.execute(text("CREATE TEMP TABLE places (id INTEGER PRIMARY KEY, name TEXT)"))
+        conn.execute(text("INSERT INTO places (id, name) VALUES (:id, :name)"), [{"id": id, "name": name} for id, name in enumerate(places)])
+        # Place popularity is skewed: the first places are the most common. The
+        # "+ 0 * i" makes the subqueries run per ride rather than once
+        conn.execute(text("""
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < :rides)
+            INSERT INTO ride_requests (id, user_id, driver_id, pickup, destination, created_at, participant_count, status, fare)
+            SELECT i, 1 + (i * 7919) % :users, CASE WHEN i % 10 = 0 THEN NULL ELSE 1 + (i * 104729) % :drivers END,
+                   (SELECT name FROM places WHERE id = (abs(random()) % 3000) * (abs(random()) % 3000) / 3000 + 0 * i),
+                   (SELECT name FROM places WHERE id = (abs(random()) % 3000) * (abs(random()) % 3000) / 3000 + 0 * i),
+                   datetime('2025-01-01', '+' || (i / 8) || ' seconds') || '.000000', 1, 'completed', 20.0
+            FROM n
+        """), {"rides": rides, "users": users, "drivers": drivers})
+        conn.execute(text("""
+            INSERT INTO ride_participants (ride_id, user_id)
+            SELECT id, 1 + (id * 31) % :users FROM ride_requests WHERE id % 4 = 0
+        """), {"users": users})
+    return places, first, last
+
+
+def like_search(db, term, user_id=None, driver_id=None, limit=20):
+    # The scan the index replaces: substring matches on every column, newest first
+    pattern = f"%{term}%"
+    scope = ""
+    if user_id is not None:
+        scope = ("AND (r.user_id = :user_id OR r.id IN "
+                 "(SELECT ride_id FROM ride_participants WHERE user_id = :user_id))")
+    elif driver_id is not None:
+        scope = "AND r.driver_id = :driver_id"
+    return db.execute(text(f"""
+        SELECT r.id FROM ride_requests r
+        LEFT JOIN users u ON u.id = r.user_id
+        LEFT JOIN drivers d ON d.id = r.driver_id
+        WHERE (r.pickup LIKE :pattern OR r.destination LIKE :pattern OR u.name LIKE :pattern
+               OR d.name LIKE :pattern OR d.vehicle_number LIKE :pattern) {scope}
+        ORDER BY r.created_at DESC LIMIT :limit
+    """), {"pattern": pattern, "user_id": user_id, "driver_id": driver_id, "limit": limit}).all()
+
+
+def time_queries(run, queries):
+    samples = []
+    hits = 0
+    for query in queries:
+        start = time.perf_counter()
+        hits += len(run(query))
+        samples.append(time.perf_counter() - start)
+    return samples, hits
+
+
+def report(label, samples, hits):
+    print(f"{label:<44} {len(samples):>5} {percentile(samples, 50) * 1000:>9.2f} {percentile(samples, 95) * 1000:>9.2f} "
+          f"{percentile(samples, 99) * 1000:>9.2f} {hits / len(samples):>9.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=50_000)
+    parser.add_argument("--drivers", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=30, help="queries per case")
+    parser.add_argument("--like-repeat", type=int, default=3, help="queries per unscoped LIKE case; each scans every ride")
+    parser.add_argument("--writes", type=int, default=500, help="rides created through the ORM to time index upkeep")
+    args = parser.parse_args()
+
+    rng = random.Random(11)
+    engine, SessionLocal, path = temp_database("search")
+    try:
+        start = time.perf_counter()
+        places, first, last = populate(engine, args.rides, args.users, args.drivers, rng)
+        populate_seconds = time.perf_counter() - start
+        size_before = os.path.getsize(path)
+        start = time.perf_counter()
+        ride_search.ensure_search_index(engine)
+        build_seconds = time.perf_counter() - start
+        print(f"{args.rides:,} rides generated in {populate_seconds:.0f}s; indexed in {build_seconds:.0f}s "
+              f"({args.rides / build_seconds:,.0f} rides/s), index {(os.path.getsize(path) - size_before) / 1e6:,.0f} MB")
+
+        db = SessionLocal()
+        place_words = [place.split()[0] for place in places]
+        # Popular places come first in the skewed generator; rare ones last
+        common_terms = [word[:4].lower() for word in place_words[:20]]
+        rare_terms = [word.lower() for word in place_words[-200:]]
+        names = [f"{rng.choice(first)} {rng.choice(last)[:3]}" for _ in range(args.repeat)]
+        users = [rng.randint(1, args.users) for _ in range(args.repeat)]
+        drivers = [rng.randint(1, args.drivers) for _ in range(args.repeat)]
+        vehicles = dict(db.execute(text("SELECT id, vehicle_number FROM drivers")).all())
+
+        print(f"{'query':<44} {'runs':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'hits':>9}")
+        # Each query: (words, people token, user id, driver id)
+        cases = [
+            ("every ride, common prefix", [(rng.choice(common_terms), None, None, None) for _ in range(args.repeat)]),
+            ("every ride, rare place", [(rng.choice(rare_terms), None, None, None) for _ in range(args.repeat)]),
+            ("every ride, creator name", [(name, None, None, None) for name in names]),
+            ("one user's rides, common prefix", [
+                (rng.choice(common_terms), ride_search.people_token("user", user), user, None) for user in users
+            ]),
+            ("one driver's rides, vehicle number", [
+                (vehicles[driver][-4:], ride_search.people_token("driver", driver), None, driver) for driver in drivers
+            ]),
+        ]
+        for label, queries in cases:
+            samples, hits = time_queries(lambda query: ride_search.search(db, query[0], query[1]), queries)
+            report(f"fts   {label}", samples, hits)
+            # LIKE gets the first word only; unscoped, each query reads every ride
+            if queries[0][1] is None:
+                queries = queries[:args.like_repeat]
+            samples, hits = time_queries(lambda query: like_search(db, query[0].split()[0], query[2], query[3]), queries)
+            report(f"like  {label}", samples, hits)
+        db.close()
+
+        # Index upkeep in the write path: create rides one transaction each, with and without the index
+        for label in ("with index", "without index"):
+            db = SessionLocal()
+            start = time.perf_counter()
+            for n in range(args.writes):
+                db.add(models.RideRequest(user_id=users[n % len(users)], pickup=rng.choice(places),
+                                          destination=rng.choice(places), fare=20.0))
+                db.commit()
+            elapsed = time.perf_counter() - start
+            db.close()
+            print(f"create ride {label:<32} {elapsed / args.writes * 1000:>8.2f} ms per ride")
+            if ride_search.search_index_exists(engine):
+                # The background merge pass that follows those writes
+                start = time.perf_counter()
+                ride_search.merge_segments(engine)
+                print(f"{'merge pass':<44} {(time.perf_counter() - start) * 1000:>8.2f} ms")
+            ride_search.drop_search_index(engine)
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
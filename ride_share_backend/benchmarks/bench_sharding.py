@@ -0,0 +1,150 @@
+# benchmarks/bench_sharding.py
+# Write throughput against the number of regional shards. Writer
+# processes (as with several API worker processes) create rides in cities
+# spread over a region grid and have a second rider join each one,
+# through the same route functions the API uses; every shard is a local
+# SQLite file next to the main database.
+#
+#   python benchmarks/bench_sharding.py [--shards 1,2,4,8] [--writers 8] [--seconds 5] [--cities 32]
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from collections import Counter
+
+from common import percentile
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from database import Base, use_wal
+from init_db import ensure_schema
+from routes.rides import create_ride_request, join_ride
+from schemas import RideCreate
+from security import Principal
+import models
+import sharding
+
+USERS = 2000
+
+# Restored after every run
+_home = sharding.shards.shards[0]
+
+
+def city_centres(count):
+    # One city per region cell, far enough apart that no two share a cell
+    random.seed(count)
+    cells = random.sample(range(200), count)
+    return [
+        (20.0 + (cell // 20) * sharding.REGION_CELL_DEGREES + 0.25, 20.0 + (cell % 20) * sharding.REGION_CELL_DEGREES + 0.25)
+        for cell in cells
+    ]
+
+
+def build(directory, shard_count):
+    path = os.path.join(directory, "main.db")
+    engine = create_engine(f"sqlite:///{path}", connect_args={"check_same_thread": False})
+    # WAL, like the main database and the shards in the app
+    use_wal(engine)
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    sharding.shards.configure(engine, SessionLocal, sharding.local_shard_urls(shard_count, directory))
+    for shard in list(sharding.shards)[1:]:
+        ensure_schema(shard.engine, sharding.SHARD_TABLES)
+
+    db = SessionLocal()
+    db.execute(insert(models.User), [
+        {"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"} for i in range(1, USERS + 1)
+    ])
+    db.commit()
+    db.close()
+
+
+def writer(cities, deadline, seed, results):
+    # Connections must not be shared with the parent process
+    for shard in sharding.shards:
+        shard.engine.dispose(close=False)
+    rng = random.Random(seed)
+    latencies, errors = [], []
+    while time.perf_counter() < deadline:
+        lat, lng = rng.choice(cities)
+        creator, rider = rng.sample(range(1, USERS + 1), 2)
+        request = RideCreate(
+            pickup="A", destination="B", fare=25.0,
+            pickup_lat=lat + rng.uniform(-0.2, 0.2), pickup_lng=lng + rng.uniform(-0.2, 0.2)
+        )
+        start = time.perf_counter()
+        # The same shard routing the request dependencies do
+        db = sharding.shards.session(sharding.shards.shard_for_location(request.pickup_lat, request.pickup_lng))
+        try:
+            ride = create_ride_request(request, Principal(creator, f"user{creator}@example.com", "user"), db)
+            join_ride(ride["id"], Principal(rider, f"user{rider}@example.com", "user"), db)
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            errors.append(str(e))
+        finally:
+            db.close()
+    results.put((latencies, errors))
+
+
+def run(shard_count, writers, seconds, cities):
+    directory = tempfile.mkdtemp(prefix="bench_sharding_")
+    try:
+        build(directory, shard_count)
+        placement = Counter(sharding.shards.shard_for_location(lat, lng) for lat, lng in cities)
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        start = time.perf_counter()
+        deadline = start + seconds
+        workers = [context.Process(target=writer, args=(cities, deadline, n, results)) for n in range(writers)]
+        for worker in workers:
+            worker.start()
+        latencies, errors = [], []
+        for _ in workers:
+            worker_latencies, worker_errors = results.get()
+            latencies += worker_latencies
+            errors += worker_errors
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        busiest = max(placement.values()) / len(cities)
+        return {
+            "rides_per_second": len(latencies) / elapsed,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "errors": len(errors),
+            "busiest_share": busiest,
+        }
+    finally:
+        for shard in sharding.shards:
+            shard.engine.dispose()
+        sharding.shards.configure(_home.engine, _home.SessionLocal, (), _home.ReadSessionLocal)
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--shards", default="1,2,4,8")
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--cities", type=int, default=32)
+    args = parser.parse_args()
+
+    cities = city_centres(args.cities)
+    print(f"{args.writers} writer processes on {os.cpu_count()} CPUs, {args.cities} cities; each ride is a create plus a join (2 write transactions)")
+    print(f"{'shards':>6} {'rides/s':>10} {'speedup':>8} {'p50 ms':>8} {'p95 ms':>8} {'busiest shard':>14} {'errors':>7}")
+    baseline = None
+    for shard_count in (int(value) for value in args.shards.split(",")):
+        result = run(shard_count, args.writers, args.seconds, cities)
+        baseline = baseline or result["rides_per_second"]
+        print(f"{shard_count:>6} {result['rides_per_second']:>10.1f} {result['rides_per_second'] / baseline:>7.2f}x "
+              f"{result['p50'] * 1000:>8.1f} {result['p95'] * 1000:>8.1f} {result['busiest_share']:>13.0%} {result['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
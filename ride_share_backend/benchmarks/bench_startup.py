@@ -0,0 +1,68 @@
+# benchmarks/bench_startup.py
+# Cold start: time from a fresh interpreter importing main to the first 200
+# from /health, split into import, lifespan startup and first request.
+# Each run is a separate process in an empty directory, so the database is
+# created from scratch ("cold") or already exists from the previous run ("warm").
+#
+#   python benchmarks/bench_startup.py [--runs 5]
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+from common import BACKEND_DIR, percentile
+
+CHILD = r"""
+import json, time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(main.app) as client:
+    t2 = time.perf_counter()
+    response = client.get("/health")
+    t3 = time.perf_counter()
+    assert response.status_code == 200, response.text
+print(json.dumps({"import": t1 - t0, "lifespan": t2 - t1, "first_request": t3 - t2, "total": t3 - t0}))
+"""
+
+
+def run_once(workdir):
+    env = dict(os.environ, PYTHONPATH=BACKEND_DIR)
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD], cwd=workdir, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def report(label, samples):
+    print(label)
+    for phase in ("import", "lifespan", "first_request", "total"):
+        values = [s[phase] * 1000 for s in samples]
+        print(f"  {phase:<15} p50 {percentile(values, 50):8.1f} ms   max {max(values):8.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        workdir = tempfile.mkdtemp(prefix="bench_startup_")
+        try:
+            cold.append(run_once(workdir))  # Creates test.db from scratch
+            warm.append(run_once(workdir))  # Schema already in place
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report(f"cold start, new database ({args.runs} runs)", cold)
+    report(f"warm start, existing database ({args.runs} runs)", warm)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/bench_user_rides.py
+# Compare the old per-ride query loop behind /user/rides with the single
+# query ride history service for a user with 10k rides.
+#
+#   python benchmarks/bench_user_rides.py [--rides 10000] [--background 50000]
+import argparse
+import os
+import random
+from datetime import datetime, timedelta
+
+from common import temp_database, timer
+
+import models
+from ride_history import get_user_ride_history
+
+
+def populate(SessionLocal, user_rides, background_rides):
+    db = SessionLocal()
+    now = datetime.utcnow()
+    users = [{"id": i, "name": f"User {i}", "email": f"user{i}@example.com", "password": "x"}
+             for i in range(1, 1001)]
+    db.bulk_insert_mappings(models.User, users)
+
+    rides = []
+    participants = []
+    ride_id = 0
+    total = user_rides + background_rides
+    for n in range(total):
+        ride_id += 1
+        # Half of the target user's rides are created, half joined
+        if n < user_rides // 2:
+            creator = 1
+        else:
+            creator = random.randint(2, 1000)
+        rides.append({
+            "id": ride_id,
+            "user_id": creator,
+            "pickup": f"Place {random.randint(1, 200)}",
+            "destination": f"Place {random.randint(1, 200)}",
+            "created_at": now - timedelta(minutes=n),
+            "status": "pending",
+            "participant_count": 1,
+            "fare": 25.0,
+        })
+        if user_rides // 2 <= n < user_rides:
+            participants.append({"ride_id": ride_id, "user_id": 1, "created_at": now})
+        for other in random.sample(range(2, 1001), 2):
+            participants.append({"ride_id": ride_id, "user_id": other, "created_at": now})
+
+    db.bulk_insert_mappings(models.RideRequest, rides)
+    db.bulk_insert_mappings(models.RideParticipant, participants)
+    db.commit()
+    db.close()
+
+
+def legacy_user_rides(db, user_id):
+    # The pre-service implementation: two queries, set() merge and two
+    # extra queries per ride
+    created_rides = db.query(models.RideRequest).filter(models.RideRequest.user_id == user_id).all()
+    joined_rides = (
+        db.query(models.RideRequest)
+        .join(models.RideParticipant, models.RideParticipant.ride_id == models.RideRequest.id)
+        .filter(models.RideParticipant.user_id == user_id)
+        .all()
+    )
+    result = []
+    for ride in set(created_rides + joined_rides):
+        creator = db.query(models.User).filter(models.User.id == ride.user_id).first()
+        driver = ride.driver
+        participants_count = db.query(models.RideParticipant).filter(
+            models.RideParticipant.ride_id == ride.id
+        ).count()
+        result.append((ride.id, creator.name, participants_count, driver))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rides", type=int, default=10000)
+    parser.add_argument("--background", type=int, default=50000)
+    args = parser.parse_args()
+
+    random.seed(7)
+    engine, SessionLocal, path = temp_database("user_rides")
+    try:
+        with timer("populate"):
+            populate(SessionLocal, args.rides, args.background)
+
+        results = {}
+        db = SessionLocal()
+        with timer("legacy /user/rides", results):
+            legacy = legacy_user_rides(db, 1)
+        db.close()
+
+        db = SessionLocal()
+        with timer("ride history service", results):
+            history = get_user_ride_history(db, 1)
+        db.close()
+
+        db = SessionLocal()
+        window_start = datetime.utcnow() - timedelta(days=1)
+        with timer("ride history service (1 day window)", results):
+            windowed = get_user_ride_history(db, 1, since=window_start)
+        db.close()
+
+        assert len(legacy) == len(history) == args.rides
+        print(f"rides returned: {len(history)} (window: {len(windowed)})")
+        print(f"speedup: {results['legacy /user/rides'] / results['ride history service']:.1f}x")
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+# benchmarks/common.py
+# Shared helpers for the benchmark scripts. Every benchmark runs against a
+# throwaway SQLite file so the development database is never touched.
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+# Make the backend modules importable when running `python benchmarks/<name>.py`
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def temp_database(prefix="bench"):
+    # Create an empty database with the full schema and return (engine, SessionLocal, path)
+    from database import Base
+    import models  # noqa: F401 - registers the tables on Base
+
+    fd, path = tempfile.mkstemp(prefix=f"{prefix}_", suffix=".db")
+    os.close(fd)
+    engine = create_engine(
+        f"sqlite:///{path}", connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(bind=engine)
+    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    return engine, SessionLocal, path
+
+
+@contextmanager
+def timer(label, results=None):
+    start = time.perf_counter()
+    yield
+    elapsed = time.perf_counter() - start
+    if results is not None:
+        results[label] = elapsed
+    print(f"{label:<40} {elapsed * 1000:10.1f} ms")
+
+
+def percentile(samples, pct):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
@@ -0,0 +1,602 @@
+# benchmarks/soak.py
+# Soak test: run the whole app in-process (lifespan, background tasks,
+# middleware) under synthetic riders and drivers for as long as asked,
+# and look for resources that only ever grow. Every --sample-seconds it
+# records RSS, tracemalloc usage per allocation site, connections checked
+# out of each pool, open SQLite file handles, threads and event-loop lag,
+# plus request counts and latency per route. Once the traffic stops, each
+# route is probed on its own: the same request repeated in rounds, with
+# the memory left behind measured between rounds.
+#
+# A series counts as growing if, after the warm-up, it correlates with
+# time and its fitted growth is above a noise floor. The report is JSON
+# with sorted keys and rounded values, so two runs diff cleanly. The leak
+# budget (LEAK_BUDGET, or --budget FILE to override some of it) turns the
+# report into an exit status, so a short run can gate CI:
+#
+#   python benchmarks/soak.py --duration 3600 --report soak.json   # an hour
+#   python benchmarks/soak.py --duration 60 --clients 8            # CI; exits 1 over budget
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from common import percentile
+
+import httpx
+
+# Fails the run when exceeded; None only reports
+LEAK_BUDGET = {
+    "rss_growth_mb": 40.0,
+    "traced_growth_mb": 10.0,
+    "site_growth_kb": 1024.0,  # Any one allocation site that keeps growing
+    "checked_out_after_drain": 0,  # Pooled connections still checked out once the traffic has stopped
+    "sqlite_handles_growth": 4,  # Open database files over the count after warm-up
+    "threads_growth": 2,
+    "route_retained_kb_per_request": 1.0,  # Memory a probed route keeps in every round
+    "error_rate": 0.01,  # 5xx responses other than load shedding, over all requests
+    "shed_rate": None,  # 503s from the load shedder
+    "loop_lag_p99_ms": None,
+}
+
+MIN_CORRELATION = 0.8  # With time, for a series to count as growing
+PROBE_ROUNDS = 5
+PROBE_REQUESTS = 40
+LAG_TICK_SECONDS = 0.05
+RESERVOIR = 5000  # Latencies kept per route for the overall percentiles
+
+CITIES = [(30.05, 31.24), (31.20, 29.92), (30.01, 31.21), (27.18, 31.18)]
+PLACES = ["Tahrir Square", "Ramses Station", "Giza Pyramids", "Maadi Corniche", "Heliopolis Club",
+          "Nasr City Mall", "Zamalek Bridge", "Dokki Street", "Airport Terminal", "University Gate"]
+
+
+class RouteStats:
+    """Requests per route template: status counts, a latency reservoir and per-interval p50s."""
+
+    def __init__(self, rng):
+        self.rng = rng
+        self.routes = {}
+        self.paused = False  # While routes are probed: the harness's own memory must not count
+
+    def record(self, route, status, seconds):
+        if self.paused:
+            return
+        entry = self.routes.setdefault(route, {"statuses": {}, "count": 0, "reservoir": [], "interval": [], "p50s": []})
+        entry["count"] += 1
+        entry["statuses"][status] = entry["statuses"].get(status, 0) + 1
+        entry["interval"].append(seconds)
+        if len(entry["reservoir"]) < RESERVOIR:
+            entry["reservoir"].append(seconds)
+        else:
+            slot = self.rng.randrange(entry["count"])
+            if slot < RESERVOIR:
+                entry["reservoir"][slot] = seconds
+
+    def close_interval(self, elapsed):
+        for entry in self.routes.values():
+            if entry["interval"]:
+                entry["p50s"].append((elapsed, percentile(entry["interval"], 50)))
+            entry["interval"] = []
+
+
+class Client:
+    def __init__(self, http, stats, role, n, rng):
+        self.http = http
+        self.stats = stats
+        self.role = role
+        self.n = n
+        self.rng = rng
+        self.headers = {}
+        self.refresh_token = None
+        self.open_rides = []  # Rides this rider created and may still delete
+        self.joined = []
+        self.current_ride = None  # The ride this driver has accepted
+        self.city = CITIES[n % len(CITIES)]
+
+    async def call(self, method, route, url=None, **kwargs):
+        start = time.perf_counter()
+        response = await self.http.request(method, url or route, headers=self.headers, **kwargs)
+        self.stats.record(f"{method} {route}", response.status_code, time.perf_counter() - start)
+        return response
+
+    def spot(self):
+        lat, lng = self.city
+        return lat + self.rng.uniform(-0.05, 0.05), lng + self.rng.uniform(-0.05, 0.05)
+
+    async def sign_up(self):
+        email = f"{self.role}{self.n}@soak.example.com"
+        if self.role == "driver":
+            await self.call("POST", "/register/driver", json={
+                "name": f"Driver {self.n}", "email": email, "password": "soak", "license_number": f"L{self.n}",
+                "vehicle_type": "car", "vehicle_number": f"SOAK-{self.n:04d}"
+            })
+            response = await self.call("POST", "/login/driver", data={"username": email, "password": "soak"})
+        else:
+            await self.call("POST", "/register", json={"name": f"Rider {self.n}", "email": email, "password": "soak"})
+            response = await self.call("POST", "/login/user", data={"username": email, "password": "soak"})
+        tokens = response.json()
+        self.headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+        self.refresh_token = tokens.get("refresh_token")
+
+    async def refresh(self):
+        response = await self.call("POST", "/token/refresh", json={"refresh_token": self.refresh_token})
+        if response.status_code == 200:
+            tokens = response.json()
+            self.headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+            self.refresh_token = tokens.get("refresh_token", self.refresh_token)
+
+    # Rider actions
+
+    async def create_ride(self):
+        # Riders keep a few rides open; the oldest goes first
+        if len(self.open_rides) >= 3:
+            await self.delete_ride()
+        lat, lng = self.spot()
+        pickup, destination = self.rng.sample(PLACES, 2)
+        response = await self.call("POST", "/ride-request", json={
+            "pickup": pickup, "destination": destination, "fare": round(self.rng.uniform(20, 80), 2),
+            "distance": round(self.rng.uniform(2, 30), 1), "pickup_lat": lat, "pickup_lng": lng
+        })
+        if response.status_code == 200:
+            self.open_rides.append(response.json()["id"])
+
+    async def delete_ride(self):
+        if self.open_rides:
+            ride_id = self.open_rides.pop(0)
+            await self.call("DELETE", "/ride/{ride_id}", f"/ride/{ride_id}")
+
+    async def view_ride(self):
+        if self.open_rides:
+            ride_id = self.rng.choice(self.open_rides)
+            await self.call("GET", "/ride/{ride_id}", f"/ride/{ride_id}")
+            await self.call("GET", "/ride/{ride_id}/timeline", f"/ride/{ride_id}/timeline")
+
+    async def join_or_leave(self):
+        if self.joined and self.rng.random() < 0.5:
+            ride_id = self.joined.pop()
+            await self.call("POST", "/leave-ride/{ride_id}", f"/leave-ride/{ride_id}")
+            return
+        pickup, destination = self.rng.sample(PLACES, 2)
+        lat, lng = self.spot()
+        response = await self.call("GET", "/match-rides", params={"pickup": pickup, "destination": destination, "lat": lat, "lng": lng})
+        matches = [match for match in response.json().get("matches", []) if not match.get("has_joined")] if response.status_code == 200 else []
+        if matches:
+            ride_id = self.rng.choice(matches)["id"]
+            joined = await self.call("POST", "/join-ride/{ride_id}", f"/join-ride/{ride_id}")
+            if joined.status_code == 200:
+                self.joined.append(ride_id)
+
+    async def browse(self):
+        route = self.rng.choice(["/user/rides", "/user/joined-rides", "/user/home"])
+        await self.call("GET", route)
+
+    async def search(self):
+        await self.call("GET", "/rides/search", params={"q": self.rng.choice(PLACES).split()[0][:4]})
+
+    async def surge(self):
+        lat, lng = self.spot()
+        await self.call("GET", "/analytics/surge", params={"lat": lat, "lng": lng})
+
+    # Driver actions
+
+    async def work(self):
+        # Accept a nearby ride, or finish the one in hand
+        if self.current_ride is not None:
+            ride_id, self.current_ride = self.current_ride, None
+            if self.rng.random() < 0.1:
+                await self.call("POST", "/cancel-ride/{ride_id}", f"/cancel-ride/{ride_id}")
+            else:
+                await self.call("POST", "/complete-ride/{ride_id}", f"/complete-ride/{ride_id}")
+            return
+        lat, lng = self.spot()
+        response = await self.call("GET", "/available-rides", params={"lat": lat, "lng": lng})
+        rides = response.json().get("available_rides", []) if response.status_code == 200 else []
+        if rides:
+            ride_id = self.rng.choice(rides[:5])["id"]
+            accepted = await self.call("POST", "/accept-ride/{ride_id}", f"/accept-ride/{ride_id}")
+            if accepted.status_code == 200:
+                self.current_ride = ride_id
+
+    async def dashboard(self):
+        route = self.rng.choice(["/driver/home", "/driver/my-rides", "/driver/availability", "/driver/stats", "/driver/earnings"])
+        await self.call("GET", route)
+
+    async def heatmap(self):
+        await self.call("GET", "/analytics/heatmap", params={"minutes": 60})
+
+    async def export(self):
+        await self.call("GET", "/driver/rides/export", params={"format": self.rng.choice(["parquet", "arrow"])})
+
+    def actions(self):
+        if self.role == "driver":
+            return [(self.work, 8), (self.dashboard, 4), (self.heatmap, 1), (self.export, 0.2), (self.refresh, 0.2)]
+        return [(self.create_ride, 4), (self.view_ride, 3), (self.join_or_leave, 3), (self.browse, 4),
+                (self.search, 2), (self.surge, 1), (self.refresh, 0.2)]
+
+    async def run(self, deadline, think_seconds):
+        actions, weights = zip(*self.actions())
+        while time.monotonic() < deadline:
+            action = self.rng.choices(actions, weights)[0]
+            try:
+                await action()
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                self.stats.record(f"{self.role} client error", type(e).__name__, 0.0)
+            await asyncio.sleep(self.rng.expovariate(1 / think_seconds))
+
+
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        # Peak, not current, where /proc is missing
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def sqlite_handles(workdir):
+    # Open descriptors on the database files (main, -wal, -shm, journals); None off Linux
+    fd_dir = "/proc/self/fd"
+    if not os.path.isdir(fd_dir):
+        return None
+    count = 0
+    for fd in os.listdir(fd_dir):
+        try:
+            if os.readlink(os.path.join(fd_dir, fd)).startswith(workdir):
+                count += 1
+        except OSError:
+            pass
+    return count
+
+
+def app_engines(shards):
+    engines = []
+    for shard in shards:
+        engines.append((f"shard{shard.index}", shard.engine))
+        for n, engine in enumerate(getattr(shard.ReadSessionLocal, "engines", [])):
+            engines.append((f"shard{shard.index} read{n}", engine))
+    return engines
+
+
+def checked_out(engines):
+    return sum(engine.pool.checkedout() for _, engine in engines if hasattr(engine.pool, "checkedout"))
+
+
+def allocation_sites(min_bytes):
+    # Current size per allocating line, leaving out this harness and the import machinery
+    snapshot = tracemalloc.take_snapshot().filter_traces([
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+    ])
+    return {
+        f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}": stat.size
+        for stat in snapshot.statistics("lineno")
+        if stat.size >= min_bytes
+    }
+
+
+def trend(points, floor):
+    """Fitted growth over the series and whether it keeps growing.
+
+    ``points`` is [(seconds, value)]. Growing means the values correlate
+    with time (MIN_CORRELATION) and the fitted growth exceeds ``floor``.
+    """
+    times = [t for t, _ in points]
+    values = [v for _, v in points]
+    result = {"start": values[0] if values else None, "end": values[-1] if values else None,
+              "peak": max(values) if values else None, "growth": 0.0, "correlation": 0.0, "growing": False}
+    if len(points) < 3 or len(set(values)) == 1 or len(set(times)) == 1:
+        return result
+    slope, _ = statistics.linear_regression(times, values)
+    correlation = statistics.correlation(times, values)
+    growth = slope * (times[-1] - times[0])
+    result.update(growth=growth, correlation=correlation, growing=correlation >= MIN_CORRELATION and growth > floor)
+    return result
+
+
+async def watch_loop_lag(lags):
+    # How late a short sleep wakes up: time the loop spent blocked by something else
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LAG_TICK_SECONDS)
+        lags.append(max(0.0, loop.time() - start - LAG_TICK_SECONDS))
+
+
+async def probe_routes(http, stats, rider, driver, rounds, requests):
+    """Memory each route keeps: the same request in rounds, with tracemalloc read between them.
+
+    Returns {route: [retained bytes per request, per round]}. Routes that
+    write are probed as do/undo pairs, so the data they leave is not counted.
+    """
+
+    async def create_and_delete():
+        await rider.create_ride()
+        await rider.delete_ride()
+
+    async def accept_and_release():
+        await rider.create_ride()
+        ride_id = rider.open_rides[-1]
+        accepted = await driver.call("POST", "/accept-ride/{ride_id}", f"/accept-ride/{ride_id}")
+        if accepted.status_code == 200:
+            await driver.call("POST", "/cancel-ride/{ride_id}", f"/cancel-ride/{ride_id}")
+        await rider.delete_ride()
+
+    lat, lng = rider.city
+    probes = {
+        "GET /user/rides": lambda: rider.call("GET", "/user/rides"),
+        "GET /user/home": lambda: rider.call("GET", "/user/home"),
+        "GET /match-rides": lambda: rider.call("GET", "/match-rides", params={"pickup": PLACES[0], "destination": PLACES[1]}),
+        "GET /rides/search": lambda: rider.call("GET", "/rides/search", params={"q": "tahrir"}),
+        "GET /analytics/surge": lambda: rider.call("GET", "/analytics/surge", params={"lat": lat, "lng": lng}),
+        "GET /available-rides": lambda: driver.call("GET", "/available-rides", params={"lat": lat, "lng": lng}),
+        "GET /driver/home": lambda: driver.call("GET", "/driver/home"),
+        "GET /driver/my-rides": lambda: driver.call("GET", "/driver/my-rides"),
+        "GET /driver/earnings": lambda: driver.call("GET", "/driver/earnings"),
+        "GET /analytics/heatmap": lambda: driver.call("GET", "/analytics/heatmap"),
+        "POST /ride-request + DELETE /ride/{ride_id}": create_and_delete,
+        "POST /accept-ride/{ride_id} + POST /cancel-ride/{ride_id}": accept_and_release,
+    }
+    retained = {}
+    stats.paused = True
+    for route, probe in probes.items():
+        # One unmeasured round fills the caches the route uses
+        for _ in range(requests):
+            await probe()
+        rounds_retained = []
+        for _ in range(rounds):
+            gc.collect()
+            before = tracemalloc.get_traced_memory()[0]
+            for _ in range(requests):
+                await probe()
+            gc.collect()
+            rounds_retained.append((tracemalloc.get_traced_memory()[0] - before) / requests)
+        retained[route] = rounds_retained
+    stats.paused = False
+    return retained
+
+
+def build_report(config, samples, stats, sites, site_floor, retained, drained, warmup_seconds):
+    steady = [sample for sample in samples if sample["elapsed"] >= warmup_seconds] or samples
+
+    def series(key, scale=1.0):
+        return [(sample["elapsed"], sample[key] * scale) for sample in steady if sample[key] is not None]
+
+    resources = {
+        "rss_mb": trend(series("rss_mb"), config["rss_floor_mb"]),
+        "traced_mb": trend(series("traced_bytes", 1 / 2 ** 20), config["rss_floor_mb"] / 4),
+        "checked_out": trend(series("checked_out"), 0.5),
+        "sqlite_handles": trend(series("sqlite_handles"), 0.5),
+        "threads": trend(series("threads"), 0.5),
+        "gc_objects": trend(series("gc_objects"), 10_000),
+        "loop_lag_p99_ms": trend(series("loop_lag_p99_ms"), 5.0),
+    }
+
+    first = next(i for i, sample in enumerate(samples) if sample is steady[0])
+    growing_sites = []
+    for site, sizes in sites.items():
+        points = [(samples[i]["elapsed"], sizes[i] if i < len(sizes) else 0) for i in range(first, len(samples))]
+        result = trend(points, site_floor)
+        if result["growing"]:
+            growing_sites.append({"site": site, "start_kb": round(result["start"] / 1024, 1),
+                                  "end_kb": round(result["end"] / 1024, 1), "growth_kb": round(result["growth"] / 1024, 1),
+                                  "correlation": round(result["correlation"], 2)})
+    growing_sites.sort(key=lambda site: -site["growth_kb"])
+
+    routes = {}
+    total = errors = shed = 0
+    for route, entry in sorted(stats.routes.items()):
+        route_errors = sum(
+            count for status, count in entry["statuses"].items() if isinstance(status, str) or (status >= 500 and status != 503)
+        )
+        total += entry["count"]
+        errors += route_errors
+        shed += entry["statuses"].get(503, 0)
+        latency = trend([(t, p50 * 1000) for t, p50 in entry["p50s"] if t >= warmup_seconds], 5.0)
+        routes[route] = {
+            "requests": entry["count"],
+            "errors": route_errors,
+            "statuses": {str(status): count for status, count in sorted(entry["statuses"].items(), key=lambda item: str(item[0]))},
+            "p50_ms": round(percentile(entry["reservoir"], 50) * 1000, 1),
+            "p99_ms": round(percentile(entry["reservoir"], 99) * 1000, 1),
+            "latency_growth_ms": round(latency["growth"], 1),
+            "latency_growing": latency["growing"],
+        }
+    for route, rounds in retained.items():
+        entry = routes.setdefault(route, {})
+        entry["retained_kb_per_request"] = [round(value / 1024, 2) for value in rounds]
+        # Keeps memory in every round, not just once
+        entry["retains_memory"] = min(rounds) > 0 and statistics.median(rounds) / 1024 > 0.1
+
+    lags = [sample["loop_lag_p99_ms"] for sample in steady if sample["loop_lag_p99_ms"] is not None]
+    rounded = {
+        name: {key: (round(value, 2) if isinstance(value, float) else value) for key, value in result.items()}
+        for name, result in resources.items()
+    }
+    return {
+        "config": config,
+        "requests": total,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "shed_rate": round(shed / total, 4) if total else 0.0,
+        "resources": rounded,
+        "growing_allocation_sites": growing_sites[:50],
+        "routes": routes,
+        "checked_out_after_drain": drained["checked_out"],
+        "loop_lag_p99_ms": round(max(lags), 1) if lags else None,
+        "retained_max_kb_per_request": round(max((statistics.median(rounds) for rounds in retained.values()), default=0) / 1024, 2),
+        "sqlite_handles_after_warmup": steady[0]["sqlite_handles"],
+    }
+
+
+def check_budget(report, budget):
+    # [(name, limit, value)] for every limit exceeded
+    resources = report["resources"]
+    values = {
+        "rss_growth_mb": resources["rss_mb"]["growth"] if resources["rss_mb"]["growing"] else 0.0,
+        "traced_growth_mb": resources["traced_mb"]["growth"] if resources["traced_mb"]["growing"] else 0.0,
+        "site_growth_kb": max((site["growth_kb"] for site in report["growing_allocation_sites"]), default=0.0),
+        "checked_out_after_drain": report["checked_out_after_drain"],
+        "sqlite_handles_growth": (resources["sqlite_handles"]["peak"] or 0) - (report["sqlite_handles_after_warmup"] or 0),
+        "threads_growth": (resources["threads"]["peak"] or 0) - (resources["threads"]["start"] or 0),
+        "route_retained_kb_per_request": max(
+            (statistics.median(route["retained_kb_per_request"]) for route in report["routes"].values()
+             if route.get("retains_memory")), default=0.0
+        ),
+        "error_rate": report["error_rate"],
+        "shed_rate": report["shed_rate"],
+        "loop_lag_p99_ms": report["loop_lag_p99_ms"] or 0.0,
+    }
+    return [(name, limit, values[name]) for name, limit in sorted(budget.items()) if limit is not None and values[name] > limit]
+
+
+async def soak(args, workdir):
+    # Imported here: the database files go in the working directory
+    import database
+    import main
+    import outbox
+    import rate_limit
+    import sharding
+
+    if args.shards > 1:
+        sharding.shards.configure(database.engine, database.SessionLocal, sharding.local_shard_urls(args.shards, workdir))
+    if not args.keep_rate_limits:
+        # The soak measures resources, not throttling
+        for budget in [*rate_limit.ROUTE_BUDGETS.values(), rate_limit.DEFAULT_BUDGET]:
+            budget.rate = budget.burst = 1e9
+
+    # Notifications go to a file: printing them drowns the samples, keeping them grows the heap
+    app = main.create_app(notification_sink=outbox.FileSink(os.path.join(workdir, "notifications.jsonl")))
+    engines = app_engines(sharding.shards)
+    rng = random.Random(args.seed)
+    stats = RouteStats(rng)
+    samples, sites, lags = [], {}, []
+    site_min_bytes = args.site_min_kb * 1024
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://soak", timeout=60) as http:
+            drivers = [Client(http, stats, "driver", n, random.Random(rng.random())) for n in range(max(1, args.clients // 4))]
+            riders = [Client(http, stats, "user", n, random.Random(rng.random())) for n in range(args.clients - len(drivers))]
+            for client in drivers + riders:
+                await client.sign_up()
+
+            lag_task = asyncio.create_task(watch_loop_lag(lags))
+            start = time.monotonic()
+            deadline = start + args.duration
+            traffic = [asyncio.create_task(client.run(deadline, args.think_ms / 1000)) for client in drivers + riders]
+
+            while time.monotonic() < deadline:
+                await asyncio.sleep(min(args.sample_seconds, max(0.0, deadline - time.monotonic())))
+                elapsed = time.monotonic() - start
+                stats.close_interval(elapsed)
+                interval_lags, lags[:] = list(lags), []
+                index = len(samples)
+                for site, size in allocation_sites(site_min_bytes).items():
+                    sizes = sites.setdefault(site, [])
+                    sizes.extend([0] * (index - len(sizes)))
+                    sizes.append(size)
+                samples.append({
+                    "elapsed": round(elapsed, 1),
+                    "rss_mb": rss_mb(),
+                    "traced_bytes": tracemalloc.get_traced_memory()[0],
+                    "checked_out": checked_out(engines),
+                    "sqlite_handles": sqlite_handles(workdir),
+                    "threads": threading.active_count(),
+                    "gc_objects": len(gc.get_objects()),
+                    "loop_lag_p99_ms": percentile(interval_lags, 99) * 1000 if interval_lags else None,
+                    "requests": sum(entry["count"] for entry in stats.routes.values()),
+                })
+                sample = samples[-1]
+                print(f"{sample['elapsed']:>7.0f}s {sample['requests']:>8} req  rss {sample['rss_mb']:7.1f} MB  "
+                      f"traced {sample['traced_bytes'] / 2 ** 20:6.1f} MB  checked out {sample['checked_out']:>2}  "
+                      f"db files {sample['sqlite_handles']}  threads {sample['threads']:>2}  "
+                      f"lag p99 {sample['loop_lag_p99_ms'] or 0:6.1f} ms", flush=True)
+
+            await asyncio.gather(*traffic)
+            lag_task.cancel()
+            # Let background work in flight finish before counting connections
+            await asyncio.sleep(1.0)
+            drained = {"checked_out": checked_out(engines)}
+
+            print("probing routes...", flush=True)
+            retained = await probe_routes(http, stats, riders[0], drivers[0], args.probe_rounds, args.probe_requests)
+
+    config = {
+        "duration_seconds": args.duration, "clients": args.clients, "think_ms": args.think_ms,
+        "sample_seconds": args.sample_seconds, "shards": args.shards, "seed": args.seed,
+        "rate_limits": args.keep_rate_limits, "rss_floor_mb": args.rss_floor_mb,
+    }
+    warmup = args.duration * args.warmup_fraction
+    return build_report(config, samples, stats, sites, args.site_floor_kb * 1024, retained, drained, warmup), samples
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=600, help="seconds of traffic")
+    parser.add_argument("--clients", type=int, default=16, help="simulated clients, a quarter of them drivers")
+    parser.add_argument("--think-ms", type=float, default=250, help="mean pause between a client's requests")
+    parser.add_argument("--sample-seconds", type=float, default=30, help="a sample takes a few seconds itself")
+    parser.add_argument("--warmup-fraction", type=float, default=0.2, help="share of the run left out of the trends")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep-rate-limits", action="store_true")
+    parser.add_argument("--trace-frames", type=int, default=1, help="tracemalloc frames per allocation")
+    parser.add_argument("--site-min-kb", type=float, default=16, help="allocation sites smaller than this are not tracked")
+    parser.add_argument("--site-floor-kb", type=float, default=256, help="growth below this is noise")
+    parser.add_argument("--rss-floor-mb", type=float, default=8, help="RSS growth below this is noise")
+    parser.add_argument("--probe-rounds", type=int, default=PROBE_ROUNDS)
+    parser.add_argument("--probe-requests", type=int, default=PROBE_REQUESTS)
+    parser.add_argument("--report", help="write the JSON report here")
+    parser.add_argument("--samples", help="write the raw samples here, one JSON object per line")
+    parser.add_argument("--budget", help="JSON file overriding entries of LEAK_BUDGET")
+    args = parser.parse_args()
+
+    budget = dict(LEAK_BUDGET)
+    if args.budget:
+        with open(args.budget) as f:
+            budget.update(json.load(f))
+
+    tracemalloc.start(args.trace_frames)
+    workdir = os.path.realpath(tempfile.mkdtemp(prefix="soak_"))
+    os.chdir(workdir)
+    report, samples = asyncio.run(soak(args, workdir))
+    report["budget"] = budget
+    violations = check_budget(report, budget)
+    report["over_budget"] = [name for name, _, _ in violations]
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    if args.samples:
+        with open(args.samples, "w") as f:
+            for sample in samples:
+                f.write(json.dumps(sample, sort_keys=True) + "\n")
+
+    resources = report["resources"]
+    print(f"\n{report['requests']} requests, error rate {report['error_rate']:.2%}, shed {report['shed_rate']:.2%}, database files in {workdir}")
+    for name, result in sorted(resources.items()):
+        print(f"  {name:<18} start {result['start']!s:>10} end {result['end']!s:>10} growth {result['growth']!s:>10} "
+              f"r {result['correlation']!s:>5} {'GROWING' if result['growing'] else ''}")
+    for site in report["growing_allocation_sites"][:10]:
+        print(f"  growing site {site['site']}  +{site['growth_kb']} KB (r {site['correlation']})")
+    for route, entry in report["routes"].items():
+        flags = [flag for flag, on in (("latency growing", entry.get("latency_growing")), ("retains memory", entry.get("retains_memory"))) if on]
+        if flags:
+            print(f"  {route}: {', '.join(flags)} {entry.get('retained_kb_per_request', '')}")
+    for name, limit, value in violations:
+        print(f"OVER BUDGET {name}: {value} > {limit}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,27 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 # Database URL (SQLite in this case)
 DATABASE_URL = "sqlite:///./test.db"
 
+# Read-only endpoints get their own connections (see dependencies.get_read_db).
+# By default they open the same SQLite file with mode=ro; the database runs
+# in WAL mode, so those readers never queue behind a write transaction.
+# List replica URLs here to send the reads to replicas instead.
+READ_REPLICA_URLS: List[str] = []
+READ_YOUR_WRITES_SECONDS = 5.0  # After a user's own write, their reads stay on the primary this long
+
+READ_ONLY_KEY = "read_only"  # Session.info flag on read-only sessions
+WRITER_KEY = "writer"  # Session.info key naming the principal a write session acts for
+_WROTE_KEY = "wrote"
+
 # Create an engine and a session
 engine = create_engine(
     DATABASE_URL, connect_args={"check_same_thread": False}
@@ -12,10 +29,116 @@ engine = create_engine(
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
+
+def use_wal(bind):
+    # Readers and the single writer stop blocking each other; a no-op for other databases
+    if bind.dialect.name != "sqlite" or bind.url.database in (None, "", ":memory:"):
+        return
+
+    @event.listens_for(bind, "connect")
+    def set_journal_mode(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+def read_only_url(url: str) -> str:
+    """URL for read-only connections to ``url``: a mode=ro URI for SQLite files, the URL itself otherwise."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() != "sqlite" or parsed.database in (None, "", ":memory:"):
+        return url
+    return f"sqlite:///file:{parsed.database}?mode=ro&uri=true"
+
+
+def read_engine_for(url: str):
+    return create_engine(read_only_url(url), connect_args={"check_same_thread": False})
+
+
+class ReadSessionFactory:
+    """Makes read-only sessions, spreading them over one or more engines in turn."""
+
+    def __init__(self, engines, info: Optional[dict] = None):
+        self.engines = list(engines)
+        self.info = {**(info or {}), READ_ONLY_KEY: True}
+        self._next = itertools.cycle(self.engines)
+        self._lock = threading.Lock()
+
+    def __call__(self) -> Session:
+        with self._lock:
+            bind = next(self._next)
+        return Session(bind=bind, autoflush=False, info=dict(self.info))
+
+    def dispose(self):
+        for bind in self.engines:
+            bind.dispose()
+
+
+class RecentWriters:
+    """Principals that committed a write in the last ``window_seconds``.
+
+    A replica may not have caught up with a write yet, so the writer's own
+    reads go to the primary for a while. Expired entries are swept once the
+    dict grows past ``max_keys``.
+    """
+
+    def __init__(self, window_seconds: float = READ_YOUR_WRITES_SECONDS, max_keys: int = 100_000):
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self._written: Dict[str, float] = {}
+
+    def record(self, key: str, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        if len(self._written) >= self.max_keys:
+            self._written = {k: at for k, at in self._written.items() if now - at < self.window_seconds}
+        self._written[key] = now
+
+    def is_recent(self, key: str, now: Optional[float] = None) -> bool:
+        at = self._written.get(key)
+        if at is None:
+            return False
+        now = time.monotonic() if now is None else now
+        return now - at < self.window_seconds
+
+
+use_wal(engine)
+read_engines = [read_engine_for(url) for url in READ_REPLICA_URLS] or [read_engine_for(DATABASE_URL)]
+ReadSessionLocal = ReadSessionFactory(read_engines)
+recent_writers = RecentWriters()
+
+
+@event.listens_for(Session, "after_flush")
+def _mark_written(session: Session, flush_context):
+    session.info[_WROTE_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _record_writer(session: Session):
+    # Only transactions that flushed something count as the principal's write
+    if session.info.pop(_WROTE_KEY, False):
+        key = session.info.get(WRITER_KEY)
+        if key is not None:
+            recent_writers.record(key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_written(session: Session):
+    session.info.pop(_WROTE_KEY, None)
+
+
 # Add this function to get a database session
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+# Open a few pooled connections up front so the first requests don't pay for it
+def warm_up(bind=engine, connections: int = 2):
+    opened = []
+    try:
+        for _ in range(connections):
+            conn = bind.connect()
+            conn.execute(text("SELECT 1"))
+            opened.append(conn)
+    finally:
+        for conn in opened:
+            conn.close()
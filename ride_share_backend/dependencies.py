@@ -0,0 +1,107 @@
+# dependencies.py
+# FastAPI dependencies shared by the routers
+from fastapi import Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.orm import Session
+
+from database import get_db, recent_writers, ReadSessionLocal, WRITER_KEY
+from schemas import RideCreate
+from security import Principal, decode_token
+from sharding import shards
+import models
+
+# OAuth2 scheme
+oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+
+def writer_key(principal: Principal) -> str:
+    return f"{principal.user_type}:{principal.id}"
+
+def get_current_principal(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)) -> Principal:
+    # Authorize from the token claims alone; no DB access for current tokens
+    principal = decode_token(token)
+    if principal is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    if principal.id is None:
+        # Tokens issued before the uid claim existed: resolve the id by email
+        model = models.Driver if principal.is_driver else models.User
+        row = db.query(model.id).filter(model.email == principal.email).first()
+        if row is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        principal = Principal(row.id, principal.email, principal.user_type, principal.jti, principal.expires_at)
+    # Writes committed on this session count toward the principal's read-your-writes window
+    db.info[WRITER_KEY] = writer_key(principal)
+    return principal
+
+async def get_current_user(principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    # Load the full user/driver row for endpoints that need more than the id and role
+    if principal.is_driver:
+        user = db.get(models.Driver, principal.id)
+    else:
+        user = db.get(models.User, principal.id)
+    
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return user
+
+def get_ride_db(ride_id: int, principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    # Session on the shard holding the ride; the main database's own session for shard 0
+    index = shards.shard_for_ride(ride_id)
+    if index == 0:
+        yield db
+        return
+    shard_db = shards.session(index)
+    shard_db.info[WRITER_KEY] = writer_key(principal)
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+def get_pickup_db(request: RideCreate, principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    # Session on the shard for a new ride's pickup region
+    index = shards.shard_for_location(request.pickup_lat, request.pickup_lng)
+    if index == 0:
+        yield db
+        return
+    shard_db = shards.session(index)
+    shard_db.info[WRITER_KEY] = writer_key(principal)
+    try:
+        yield shard_db
+    finally:
+        shard_db.close()
+
+def get_read_db(principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    # Read-only session for GET endpoints; a principal who just wrote reads from the primary
+    if recent_writers.is_recent(writer_key(principal)):
+        yield db
+        return
+    read_db = ReadSessionLocal()
+    try:
+        yield read_db
+    finally:
+        read_db.close()
+
+def get_ride_read_db(ride_id: int, principal: Principal = Depends(get_current_principal), db: Session = Depends(get_db)):
+    # Read-only session on the shard holding the ride, with the same stickiness as get_read_db
+    index = shards.shard_for_ride(ride_id)
+    sticky = recent_writers.is_recent(writer_key(principal))
+    if index == 0 and sticky:
+        yield db
+        return
+    read_db = shards.session(index, read_only=not sticky)
+    try:
+        yield read_db
+    finally:
+        read_db.close()
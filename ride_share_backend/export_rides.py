@@ -0,0 +1,61 @@
+# export_rides.py
+# Export ride history from the main database and every ride shard to a
+# Parquet (or Arrow IPC) file for offline reporting, optionally with a
+# per-driver earnings summary next to it.
+#
+#   python export_rides.py rides.parquet [--since 2025-01-01] [--until 2025-02-01] [--driver 7]
+#                          [--status completed] [--format parquet] [--earnings earnings.parquet]
+import argparse
+import time
+from datetime import datetime
+
+import pyarrow.parquet as pq
+
+from database import ReadSessionLocal
+import ride_export
+
+
+def export(path, format="parquet", earnings_path=None, chunk_rows=ride_export.EXPORT_CHUNK_ROWS, **filters):
+    """Write the matching rides to ``path``; returns (rows, seconds).
+
+    With ``earnings_path`` the earnings summary is computed from the same
+    pass over the rides and written there as Parquet.
+    """
+    start = time.perf_counter()
+    db = ReadSessionLocal()
+    try:
+        batches = ride_export.iter_ride_batches(db, chunk_rows=chunk_rows, **filters)
+        if earnings_path is None:
+            rows = ride_export.write_rides(path, batches, format)
+        else:
+            # Fold each batch into the running totals as it is written; no batch is kept
+            summary = ride_export.EarningsSummary()
+
+            def tally(batches):
+                for batch in batches:
+                    summary.add(batch)
+                    yield batch
+
+            rows = ride_export.write_rides(path, tally(batches), format)
+            pq.write_table(summary.table(), earnings_path)
+    finally:
+        db.close()
+    return rows, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export ride history to a columnar file")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=sorted(ride_export.FORMATS), default="parquet")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--driver", type=int)
+    parser.add_argument("--status")
+    parser.add_argument("--earnings", help="also write per-driver earnings to this Parquet file")
+    parser.add_argument("--chunk-rows", type=int, default=ride_export.EXPORT_CHUNK_ROWS)
+    args = parser.parse_args()
+
+    rows, elapsed = export(args.path, args.format, args.earnings, args.chunk_rows,
+                           since=args.since, until=args.until, driver_id=args.driver, status=args.status)
+    rate = rows / elapsed if elapsed else 0
+    print(f"Exported {rows} rides to {args.path} in {elapsed:.2f}s ({rate:,.0f} rides/s)")
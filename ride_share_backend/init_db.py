@@ -1,12 +1,72 @@
 # init_db.py
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateTable
+
 from database import engine, Base
+from ride_search import drop_search_index
 import models
 
+def use_autoincrement(conn, table):
+    # SQLite cannot add AUTOINCREMENT to a table, so rebuild it: create the
+    # new table under another name, copy the rows, drop the old one and take
+    # its name (other tables' REFERENCES name the table, so they still
+    # resolve). The copied ids seed sqlite_sequence. Indexes are recreated
+    # afterwards by upgrade_schema.
+    if conn.dialect.name != "sqlite" or not table.dialect_options["sqlite"]["autoincrement"]:
+        return
+    sql = conn.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": table.name}
+    ).scalar()
+    if sql is None or "AUTOINCREMENT" in sql.upper():
+        return
+    new_name = f"{table.name}_autoincrement"
+    create = str(CreateTable(table).compile(dialect=conn.dialect)).strip()
+    conn.execute(text(create.replace(f"CREATE TABLE {table.name} (", f"CREATE TABLE {new_name} (", 1)))
+    columns = ", ".join(column.name for column in table.columns)
+    conn.execute(text(f"INSERT INTO {new_name} ({columns}) SELECT {columns} FROM {table.name}"))
+    conn.execute(text(f"DROP TABLE {table.name}"))
+    conn.execute(text(f"ALTER TABLE {new_name} RENAME TO {table.name}"))
+
+def upgrade_schema(bind=engine, tables=None):
+    # create_all only creates missing tables, so bring existing tables up to
+    # date with the models: add nullable columns and indexes they lack, and
+    # switch tables to AUTOINCREMENT ids where the model asks for them.
+    # ``tables`` limits this to some of the tables (ride shards hold only theirs)
+    tables = Base.metadata.sorted_tables if tables is None else tables
+    inspector = inspect(bind)
+    existing_tables = set(inspector.get_table_names())
+    with bind.begin() as conn:
+        for table in tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(
+                        f"Cannot add NOT NULL column {table.name}.{column.name} to an existing table; "
+                        "run init_db.py to recreate the database"
+                    )
+                column_type = column.type.compile(dialect=bind.dialect)
+                conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            use_autoincrement(conn, table)
+
+    for table in tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+def ensure_schema(bind=engine, tables=None):
+    # Create missing tables, then add missing columns and indexes
+    Base.metadata.create_all(bind=bind, tables=tables)
+    upgrade_schema(bind, tables)
+
 def init_database():
     print("Creating database tables...")
+    drop_search_index(engine)  # Not a model table; recreated by the app on startup
     Base.metadata.drop_all(bind=engine)  # Drop all tables first
     Base.metadata.create_all(bind=engine)  # Create tables based on models
     print("Database tables created successfully!")
 
 if __name__ == "__main__":
-    init_database()
\ No newline at end of file
+    init_database()
@@ -0,0 +1,46 @@
+# maintain_rides.py
+# Bulk maintenance from the command line (maintenance.py), on the main
+# database and every ride shard. A running app picks the changes up
+# through delta sync on its next store refresh.
+#
+#   python maintain_rides.py purge-stale [--older-than-hours 24]
+#   python maintain_rides.py delete-user USER_ID
+#   python maintain_rides.py release-driver DRIVER_ID [--keep-available]
+#
+# Every command takes --chunk-rows (rows per transaction) and --lock-share
+# (how much of its time the command may hold the write lock; 1 for no
+# pauses between transactions).
+import argparse
+import json
+import sys
+from datetime import timedelta
+
+import maintenance
+
+
+if __name__ == "__main__":
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--chunk-rows", type=int, default=maintenance.BULK_CHUNK_ROWS)
+    common.add_argument("--lock-share", type=float, default=maintenance.BULK_LOCK_SHARE)
+    parser = argparse.ArgumentParser(description="Bulk ride maintenance")
+    commands = parser.add_subparsers(dest="command", required=True)
+    purge = commands.add_parser("purge-stale", parents=[common], help="delete pending rides nobody took")
+    purge.add_argument("--older-than-hours", type=float, default=maintenance.STALE_PENDING_HOURS)
+    delete_user = commands.add_parser("delete-user", parents=[common], help="delete a rider with their rides and participations")
+    delete_user.add_argument("user_id", type=int)
+    release = commands.add_parser("release-driver", parents=[common], help="put a driver's accepted rides back to pending")
+    release.add_argument("driver_id", type=int)
+    release.add_argument("--keep-available", action="store_true", help="do not mark the driver unavailable")
+    args = parser.parse_args()
+
+    options = {"chunk_rows": args.chunk_rows, "lock_share": args.lock_share}
+    if args.command == "purge-stale":
+        result = maintenance.purge_stale_rides(timedelta(hours=args.older_than_hours), **options)
+    elif args.command == "delete-user":
+        result = maintenance.delete_user_account(args.user_id, **options)
+    else:
+        result = maintenance.release_driver_rides(args.driver_id, not args.keep_available, **options)
+
+    if result is None:
+        sys.exit(f"No such {'user' if args.command == 'delete-user' else 'driver'}")
+    print(json.dumps(result, indent=2))
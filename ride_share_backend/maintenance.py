@@ -0,0 +1,436 @@
+# maintenance.py
+# Bulk maintenance of ride data: purging abandoned pending rides, deleting
+# a rider's account with their rides and participations, and handing a
+# deactivated driver's accepted rides back to the pool.
+#
+# These can touch many thousands of rows, so they run as set-based SQL
+# rather than one ORM object per row, and in chunks: each chunk of
+# BULK_CHUNK_ROWS rows is its own short transaction, so SQLite's write lock
+# is held for a fraction of a second at a time, and the operation pauses
+# between chunks (BULK_LOCK_SHARE) so request writes get in. Bulk statements bypass the flush listeners, so each chunk does
+# their work itself, in the same transaction:
+#   - a ride_events entry per ride ("delete" or "release", actor "system"),
+#     which the read models and the demand rollups fold as usual
+#   - a version from the sync clock on every changed row and a tombstone
+#     for every removed one, so delta sync clients see the change
+#   - the changed rides' search documents (ride_search.py)
+# An operation on a large table runs for minutes, so the /admin endpoints
+# queue it on a single background worker (MaintenanceJobs) and return at
+# once; one job runs at a time.
+#
+# After the commit the shard's open ride store applies the chunk. In a
+# process whose stores are not loaded (the CLI), the app picks the change
+# up from the sync versions on its next refresh.
+#
+# Deleting an account first records it in deleted_accounts, so its tokens
+# stop working at once in this process and within
+# DELETED_ACCOUNTS_POLL_SECONDS in the others (deleted_accounts_loop).
+#
+# Chunk ids are read first; the write transaction then takes the sync
+# version (and with it the write lock) and reads those rows again under
+# the same criteria, so a row that changed in between is skipped, not
+# overwritten.
+import asyncio
+import itertools
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import DateTime, bindparam, delete, func, insert, literal, or_, select, update
+
+from ride_state import ACCEPTED, DELETED, PENDING
+from sharding import region_for, shards
+import models
+import ride_search
+import ride_store
+import security
+import sync
+
+BULK_CHUNK_ROWS = 500  # Rows per transaction; up to about 120 ms of write lock on a 1M-ride table
+BULK_LOCK_SHARE = 0.5  # Of its running time, how much an operation may spend holding the write lock
+STALE_PENDING_HOURS = 24
+DELETED_ACCOUNTS_POLL_SECONDS = 5.0
+MAX_FINISHED_JOBS = 100  # Finished jobs kept for GET /admin/jobs/{id}
+
+SYSTEM_ACTOR = "system"
+
+# Columns each chunk is read with
+_CHUNK_COLUMNS = {
+    models.RideRequest: (
+        models.RideRequest.id, models.RideRequest.user_id, models.RideRequest.driver_id,
+        models.RideRequest.status, models.RideRequest.pickup_lat, models.RideRequest.pickup_lng,
+    ),
+    models.RideParticipant: (models.RideParticipant.id, models.RideParticipant.ride_id, models.RideParticipant.user_id),
+}
+
+
+class BulkResult:
+    """Rows changed by a bulk operation and how long its transactions ran."""
+
+    def __init__(self):
+        self.rows = 0
+        self.transactions = 0
+        self.longest_transaction = 0.0
+        self.started = time.perf_counter()
+
+    def add(self, rows: int, seconds: float):
+        self.rows += rows
+        self.transactions += 1
+        self.longest_transaction = max(self.longest_transaction, seconds)
+
+    def to_dict(self) -> dict:
+        return {
+            "transactions": self.transactions,
+            "longest_transaction_ms": round(self.longest_transaction * 1000, 1),
+            "seconds": round(time.perf_counter() - self.started, 3)
+        }
+
+
+def _in_chunks(shard, model, criteria, write, result: BulkResult, chunk_rows: int, lock_share: float) -> int:
+    """Run ``write(db, rows, ops)`` over the shard's ``model`` rows matching ``criteria``.
+
+    Rows are taken in id order, ``chunk_rows`` per transaction. After each
+    transaction the operation sleeps long enough to keep its share of the
+    write lock to ``lock_share``: SQLite's busy handler polls with growing
+    sleeps, and without a gap a request waiting for the lock can keep
+    missing it between chunks. Returns the rows written.
+    """
+    id_column = model.id
+    columns = _CHUNK_COLUMNS[model]
+    written = 0
+    after_id = 0
+    while True:
+        db = shard.SessionLocal()
+        try:
+            ids = db.execute(
+                select(id_column).where(id_column > after_id, *criteria).order_by(id_column).limit(chunk_rows)
+            ).scalars().all()
+            db.rollback()
+            if not ids:
+                return written
+            after_id = ids[-1]
+
+            start = time.perf_counter()
+            with ride_store.bulk_write(shard.index, shard.engine) as ops:
+                sync.transaction_version(db)
+                rows = db.execute(select(*columns).where(id_column.in_(ids), *criteria)).all()
+                if rows:
+                    write(db, rows, ops)
+                db.commit()
+            elapsed = time.perf_counter() - start
+            result.add(len(rows), elapsed)
+            written += len(rows)
+        finally:
+            db.close()
+        if lock_share < 1:
+            time.sleep(elapsed * (1 - lock_share) / lock_share)
+
+
+def _ride_events(rows, event_name: str, to_status: str, now: datetime) -> list:
+    # What ride_state.transition() would queue for each ride
+    return [
+        {
+            "ride_id": row.id,
+            "event": event_name,
+            "from_status": row.status,
+            "to_status": to_status,
+            "actor_type": SYSTEM_ACTOR,
+            "actor_id": None,
+            "driver_id": row.driver_id,
+            "region": region_for(row.pickup_lat, row.pickup_lng),
+            "created_at": now
+        }
+        for row in rows
+    ]
+
+
+def _delete_rides(db, rows, ops):
+    # Rides and their participants, as delete_ride does for one
+    version = sync.transaction_version(db)
+    now = datetime.utcnow()
+    conn = db.connection()
+    ids = [row.id for row in rows]
+
+    conn.execute(insert(models.RideEvent), _ride_events(rows, "delete", DELETED, now))
+    conn.execute(insert(models.SyncTombstone).from_select(
+        ["version", "kind", "ride_id", "user_id", "created_at"],
+        select(
+            literal(version), literal(sync.TOMBSTONE_PARTICIPANT), models.RideParticipant.ride_id,
+            models.RideParticipant.user_id, literal(now, DateTime)
+        ).where(models.RideParticipant.ride_id.in_(ids))
+    ))
+    conn.execute(insert(models.SyncTombstone), [
+        {"version": version, "kind": sync.TOMBSTONE_RIDE, "ride_id": row.id, "user_id": row.user_id,
+         "driver_id": row.driver_id, "created_at": now}
+        for row in rows
+    ])
+    conn.execute(delete(models.RideParticipant).where(models.RideParticipant.ride_id.in_(ids)))
+    conn.execute(delete(models.RideRequest).where(models.RideRequest.id.in_(ids)))
+    # Drivers of accepted rides among them are free again: busy is derived from accepted rides,
+    # and routes/driver.py clears their claims once the rides are gone
+
+    ride_search.update_documents(db, removed=ids)
+    ops.extend(("delete", ride_id) for ride_id in ids)
+    ops.append(("version", version))
+
+
+def _release_rides(db, rows, ops):
+    # Accepted rides back to pending without a driver, as cancel_ride does for one
+    version = sync.transaction_version(db)
+    now = datetime.utcnow()
+    conn = db.connection()
+    ids = [row.id for row in rows]
+
+    conn.execute(insert(models.RideEvent), _ride_events(rows, "release", PENDING, now))
+    conn.execute(insert(models.SyncTombstone), [
+        {"version": version, "kind": sync.TOMBSTONE_UNASSIGNED, "ride_id": row.id, "driver_id": row.driver_id,
+         "created_at": now}
+        for row in rows
+    ])
+    conn.execute(
+        update(models.RideRequest)
+        .where(models.RideRequest.id.in_(ids))
+        .values(status=PENDING, driver_id=None, version=version, updated_at=now)
+    )
+
+    ride_search.update_documents(db, changed=ids)
+    ops.extend(("ride", ride) for ride in ride_store.ride_rows(conn, ids))
+    ops.append(("version", version))
+
+
+def _remove_participations(db, rows, ops):
+    # Participant rows on other riders' rides, as leave_ride does for one
+    version = sync.transaction_version(db)
+    now = datetime.utcnow()
+    conn = db.connection()
+    seats = Counter(row.ride_id for row in rows)
+
+    conn.execute(insert(models.SyncTombstone), [
+        {"version": version, "kind": sync.TOMBSTONE_PARTICIPANT, "ride_id": row.ride_id, "user_id": row.user_id,
+         "created_at": now}
+        for row in rows
+    ])
+    conn.execute(delete(models.RideParticipant).where(models.RideParticipant.id.in_([row.id for row in rows])))
+    # A seat fewer per participant gone, never below the creator's own
+    conn.execute(
+        update(models.RideRequest)
+        .where(models.RideRequest.id == bindparam("ride"))
+        .values(
+            participant_count=func.max(1, models.RideRequest.participant_count - bindparam("seats")),
+            version=version,
+            updated_at=now
+        ),
+        [{"ride": ride_id, "seats": count} for ride_id, count in seats.items()]
+    )
+
+    ride_search.update_documents(db, changed=seats)
+    ops.extend(("leave", row.ride_id, row.user_id) for row in rows)
+    ops.extend(("ride", ride) for ride in ride_store.ride_rows(conn, seats))
+    ops.append(("version", version))
+
+
+def purge_stale_rides(
+    older_than: timedelta = timedelta(hours=STALE_PENDING_HOURS),
+    now: Optional[datetime] = None,
+    router=shards,
+    chunk_rows: int = BULK_CHUNK_ROWS,
+    lock_share: float = BULK_LOCK_SHARE
+) -> dict:
+    """Delete pending rides no driver took, requested more than ``older_than`` ago.
+
+    Rides with a departure time still ahead are kept however old the
+    request is.
+    """
+    now = now or datetime.utcnow()
+    criteria = (
+        models.RideRequest.status == PENDING,
+        models.RideRequest.driver_id.is_(None),
+        models.RideRequest.created_at < now - older_than,
+        or_(models.RideRequest.departure_time.is_(None), models.RideRequest.departure_time < now),
+    )
+    result = BulkResult()
+    for shard in router:
+        _in_chunks(shard, models.RideRequest, criteria, _delete_rides, result, chunk_rows, lock_share)
+    return {"rides_deleted": result.rows, **result.to_dict()}
+
+
+def delete_user_account(
+    user_id: int,
+    router=shards,
+    chunk_rows: int = BULK_CHUNK_ROWS,
+    lock_share: float = BULK_LOCK_SHARE
+) -> Optional[dict]:
+    """Delete a rider with every ride they created, their seats on other rides and their pending notifications.
+
+    Returns None if there is no such user. The user's tokens are refused
+    from the start; the user row goes last, so an interrupted run can
+    simply be started again.
+    """
+    home = router.shards[0]
+    db = home.SessionLocal()
+    try:
+        if db.get(models.User, user_id) is None:
+            return None
+        db.add(models.DeletedAccount(user_type="user", account_id=user_id))
+        db.commit()
+    finally:
+        db.close()
+    security.revoke_account("user", user_id)
+
+    result = BulkResult()
+    rides = participations = notifications = 0
+    for shard in router:
+        rides += _in_chunks(shard, models.RideRequest, (models.RideRequest.user_id == user_id,), _delete_rides,
+                            result, chunk_rows, lock_share)
+        participations += _in_chunks(shard, models.RideParticipant, (models.RideParticipant.user_id == user_id,),
+                                     _remove_participations, result, chunk_rows, lock_share)
+        db = shard.SessionLocal()
+        try:
+            notifications += db.execute(delete(models.OutboxMessage).where(
+                models.OutboxMessage.recipient_type == "user",
+                models.OutboxMessage.recipient_id == user_id
+            )).rowcount
+            db.commit()
+        finally:
+            db.close()
+
+    db = home.SessionLocal()
+    try:
+        # Tokens issued while this ran expire within ACCESS_TOKEN_EXPIRE_MINUTES of now
+        db.execute(delete(models.User).where(models.User.id == user_id))
+        db.execute(
+            update(models.DeletedAccount)
+            .where(models.DeletedAccount.user_type == "user", models.DeletedAccount.account_id == user_id)
+            .values(deleted_at=datetime.utcnow())
+        )
+        db.commit()
+    finally:
+        db.close()
+    security.revoke_account("user", user_id)
+
+    return {
+        "user_id": user_id,
+        "rides_deleted": rides,
+        "participations_removed": participations,
+        "notifications_deleted": notifications,
+        **result.to_dict()
+    }
+
+
+def release_driver_rides(
+    driver_id: int,
+    deactivate: bool = True,
+    router=shards,
+    chunk_rows: int = BULK_CHUNK_ROWS,
+    lock_share: float = BULK_LOCK_SHARE
+) -> Optional[dict]:
+    """Put a driver's accepted rides back to pending for other drivers to take.
+
+    With ``deactivate`` the driver is first marked unavailable, so they
+    cannot accept new rides meanwhile. Returns None if there is no such
+    driver.
+    """
+    home = router.shards[0]
+    db = home.SessionLocal()
+    started = datetime.utcnow()
+    try:
+        driver = db.get(models.Driver, driver_id)
+        if driver is None:
+            return None
+        if deactivate:
+            driver.is_available = False
+            db.commit()
+    finally:
+        db.close()
+
+    criteria = (models.RideRequest.driver_id == driver_id, models.RideRequest.status == ACCEPTED)
+    result = BulkResult()
+    for shard in router:
+        _in_chunks(shard, models.RideRequest, criteria, _release_rides, result, chunk_rows, lock_share)
+
+    db = home.SessionLocal()
+    try:
+        # The claim of an accept from before the release named a ride released above
+        db.execute(
+            update(models.Driver)
+            .where(models.Driver.id == driver_id, models.Driver.busy_since < started)
+            .values(busy_ride_id=None, busy_since=None)
+        )
+        db.commit()
+    finally:
+        db.close()
+    return {"driver_id": driver_id, "rides_released": result.rows, **result.to_dict()}
+
+
+def load_deleted_accounts(router=shards):
+    """Refuse the tokens of accounts deleted recently, including by other processes."""
+    since = datetime.utcnow() - timedelta(minutes=security.ACCESS_TOKEN_EXPIRE_MINUTES)
+    db = router.shards[0].SessionLocal()
+    try:
+        rows = db.execute(
+            select(models.DeletedAccount.user_type, models.DeletedAccount.account_id, models.DeletedAccount.deleted_at)
+            .where(models.DeletedAccount.deleted_at > since)
+        ).all()
+    finally:
+        db.close()
+    for row in rows:
+        security.revoke_account(row.user_type, row.account_id, row.deleted_at.replace(tzinfo=timezone.utc).timestamp())
+
+
+async def deleted_accounts_loop(router=shards, interval: float = DELETED_ACCOUNTS_POLL_SECONDS):
+    # Background task: accounts deleted from maintain_rides.py or another worker
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, load_deleted_accounts, router)
+        except Exception as e:
+            print(f"Error loading deleted accounts: {str(e)}")
+
+
+class MaintenanceJobs:
+    """Runs maintenance operations one at a time on a background thread and keeps their outcome."""
+
+    def __init__(self, max_finished: int = MAX_FINISHED_JOBS):
+        self.max_finished = max_finished
+        self._jobs: "OrderedDict[int, dict]" = OrderedDict()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def submit(self, operation: str, fn, *args, **kwargs) -> dict:
+        job = {"id": next(self._ids), "operation": operation, "status": "queued", "result": None, "error": None,
+               "queued_at": datetime.utcnow(), "finished_at": None}
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._forget_finished()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance")
+            self._executor.submit(self._run, job, fn, args, kwargs)
+        return dict(job)
+
+    def get(self, job_id: int) -> Optional[dict]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def _run(self, job: dict, fn, args, kwargs):
+        job["status"] = "running"
+        try:
+            job["result"] = fn(*args, **kwargs)
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+        job["finished_at"] = datetime.utcnow()
+
+    def _forget_finished(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job_id]
+
+
+jobs = MaintenanceJobs()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Float
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Boolean, Float, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -16,6 +16,11 @@ class User(Base):
     # Relationships
     rides = relationship("RideRequest", back_populates="creator")
 
+    __table_args__ = (
+        # Never reuse the id of a deleted account; tokens and rides refer to it
+        {"sqlite_autoincrement": True},
+    )
+
 class Driver(Base):
     __tablename__ = "drivers"
 
@@ -26,18 +31,36 @@ class Driver(Base):
     license_number = Column(String, unique=True)
     vehicle_type = Column(String)
     vehicle_number = Column(String, unique=True)
-    is_available = Column(Boolean, default=True)
+    is_available = Column(Boolean, default=True)  # The driver's own switch; an accepted ride also makes them busy
+    # The ride whose accept holds the driver; serializes accepts across shards (routes/driver.py)
+    busy_ride_id = Column(Integer, nullable=True)
+    busy_since = Column(DateTime, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
     rides = relationship("RideRequest", back_populates="driver")
 
+    __table_args__ = (
+        # Never reuse the id of a deleted account; tokens and rides refer to it
+        {"sqlite_autoincrement": True},
+    )
+
+class DeletedAccount(Base):
+    # Accounts being or already deleted (maintenance.delete_user_account); every process
+    # refuses their tokens (security.deleted_accounts) until the last access token expires
+    __tablename__ = "deleted_accounts"
+
+    id = Column(Integer, primary_key=True)
+    user_type = Column(String, nullable=False)  # "user" or "driver"
+    account_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
 class RideRequest(Base):
     __tablename__ = "ride_requests"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
-    driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    driver_id = Column(Integer, ForeignKey("drivers.id"), nullable=True, index=True)
     pickup = Column(String)
     destination = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -46,12 +69,28 @@ class RideRequest(Base):
     status = Column(String, default="pending", nullable=False)  # Ensure status has a default value and cannot be null
     distance = Column(Float, nullable=True)  # Distance in kilometers
     fare = Column(Float, nullable=True)  # Manual fare amount
+    # Optional coordinates, used by the pooling optimizer
+    pickup_lat = Column(Float, nullable=True)
+    pickup_lng = Column(Float, nullable=True)
+    destination_lat = Column(Float, nullable=True)
+    destination_lng = Column(Float, nullable=True)
+    # Set when the pooling optimizer merges rides into a shared trip
+    seat_fare = Column(Float, nullable=True)  # Per-seat fare of the shared trip
+    merged_into_id = Column(Integer, ForeignKey("ride_requests.id"), nullable=True)
+    # Delta sync: set from the sync clock on every insert/update (see sync.py)
+    version = Column(Integer, nullable=True, index=True)
+    updated_at = Column(DateTime, nullable=True)
     
     # Relationships
     creator = relationship("User", back_populates="rides")
     driver = relationship("Driver", back_populates="rides")
     participants = relationship("RideParticipant", back_populates="ride")
 
+    __table_args__ = (
+        # Never reuse the id of a deleted ride; the event log refers to it
+        {"sqlite_autoincrement": True},
+    )
+
     def __init__(self, **kwargs):
         super(RideRequest, self).__init__(**kwargs)
         if self.status is None:
@@ -61,10 +100,165 @@ class RideParticipant(Base):
     __tablename__ = "ride_participants"
 
     id = Column(Integer, primary_key=True, index=True)
-    ride_id = Column(Integer, ForeignKey("ride_requests.id"))
-    user_id = Column(Integer, ForeignKey("users.id"))
+    ride_id = Column(Integer, ForeignKey("ride_requests.id"), index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    # Delta sync: set from the sync clock on every insert/update (see sync.py)
+    version = Column(Integer, nullable=True, index=True)
+    updated_at = Column(DateTime, nullable=True)
     
     # Relationships
     ride = relationship("RideRequest", back_populates="participants")
-    user = relationship("User")
\ No newline at end of file
+    user = relationship("User")
+
+    __table_args__ = (
+        # Serves "has this user joined this ride" lookups
+        Index("ix_ride_participants_ride_user", "ride_id", "user_id"),
+    )
+
+class RideEvent(Base):
+    # Append-only log of ride lifecycle transitions; never updated or deleted
+    __tablename__ = "ride_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ride_id = Column(Integer, index=True, nullable=False)  # No FK: events outlive deleted rides
+    event = Column(String, nullable=False)
+    from_status = Column(String, nullable=True)
+    to_status = Column(String, nullable=False)
+    actor_type = Column(String, nullable=True)  # "user", "driver" or "system"
+    actor_id = Column(Integer, nullable=True)
+    driver_id = Column(Integer, nullable=True)
+    region = Column(String, nullable=True)  # Pickup region (sharding.region_for); NULL on events logged before it existed
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+class IdSequence(Base):
+    # Last id handed out per table on a ride shard (sharding.py); like sqlite_sequence, it only goes up
+    __tablename__ = "id_sequences"
+
+    name = Column(String, primary_key=True)
+    last_id = Column(Integer, nullable=False)
+
+# Read models rebuilt from ride_events
+
+class DriverStats(Base):
+    __tablename__ = "driver_stats"
+
+    driver_id = Column(Integer, primary_key=True)
+    accepted_count = Column(Integer, default=0, nullable=False)
+    completed_count = Column(Integer, default=0, nullable=False)
+    released_count = Column(Integer, default=0, nullable=False)  # Accepted then cancelled by the driver
+    last_event_at = Column(DateTime, nullable=True)
+
+class RideTimeline(Base):
+    __tablename__ = "ride_timelines"
+
+    ride_id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False)
+    driver_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, nullable=True)
+    accepted_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+    deleted_at = Column(DateTime, nullable=True)
+    release_count = Column(Integer, default=0, nullable=False)
+    event_count = Column(Integer, default=0, nullable=False)
+
+class ProjectionCheckpoint(Base):
+    # Last ride_events.id applied to the read models
+    __tablename__ = "projection_checkpoints"
+
+    name = Column(String, primary_key=True)
+    last_event_id = Column(Integer, default=0, nullable=False)
+
+# Supply/demand rollups, also folded from ride_events (analytics.py)
+
+class DemandRollup(Base):
+    # Counters for one region and 5-minute bucket; the gauges are as of the bucket's last event
+    __tablename__ = "demand_rollups"
+
+    region = Column(String, primary_key=True)
+    bucket = Column(Integer, primary_key=True)  # Seconds since the epoch // analytics.BUCKET_SECONDS
+    requested = Column(Integer, default=0, nullable=False)
+    accepted = Column(Integer, default=0, nullable=False)
+    released = Column(Integer, default=0, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    cancelled = Column(Integer, default=0, nullable=False)  # Deleted before completion
+    pending_rides = Column(Integer, default=0, nullable=False)
+    idle_drivers = Column(Integer, default=0, nullable=False)
+    wait_histogram = Column(String, nullable=False)  # JSON counts of time-to-accept per analytics.WAIT_BIN_EDGES bin
+
+    __table_args__ = (
+        Index("ix_demand_rollups_bucket", "bucket"),
+    )
+
+class DemandRegion(Base):
+    # Current gauges per region
+    __tablename__ = "demand_regions"
+
+    region = Column(String, primary_key=True)
+    pending_rides = Column(Integer, default=0, nullable=False)
+    idle_drivers = Column(Integer, default=0, nullable=False)  # Drivers whose last ride ended here and who have not accepted another
+    updated_at = Column(DateTime, nullable=True)
+
+class DemandRide(Base):
+    # Region and request time of rides still in play; dropped once completed, merged or deleted
+    __tablename__ = "demand_rides"
+
+    ride_id = Column(Integer, primary_key=True)
+    region = Column(String, nullable=False)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=True)
+
+class DemandDriver(Base):
+    # Where each driver last was, and whether they are on a ride
+    __tablename__ = "demand_drivers"
+
+    driver_id = Column(Integer, primary_key=True)
+    region = Column(String, nullable=False)
+    busy = Column(Boolean, default=False, nullable=False)
+
+# Delta sync
+
+class SyncClock(Base):
+    # Single-row counter handing out row versions, one per write transaction
+    __tablename__ = "sync_clock"
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, default=0, nullable=False)
+    pruned_version = Column(Integer, default=0, nullable=False)  # Tombstones up to here are gone
+
+class SyncTombstone(Base):
+    # A ride that left someone's list: deleted, unassigned from a driver, or left by a participant
+    __tablename__ = "sync_tombstones"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, index=True)
+    kind = Column(String, nullable=False)  # "ride", "unassigned" or "participant"
+    ride_id = Column(Integer, nullable=False)
+    user_id = Column(Integer, nullable=True, index=True)
+    driver_id = Column(Integer, nullable=True, index=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+# Transactional outbox
+
+class OutboxMessage(Base):
+    # Side effect (a notification) stored in the same transaction as the change causing it;
+    # deleted once delivered
+    __tablename__ = "outbox_messages"
+
+    id = Column(Integer, primary_key=True, index=True)
+    topic = Column(String, nullable=False)  # e.g. "ride_accepted", "rider_joined"
+    recipient_type = Column(String, nullable=False)  # "user" or "driver"
+    recipient_id = Column(Integer, nullable=False)
+    payload = Column(String, nullable=False)  # JSON
+    status = Column(String, default="pending", nullable=False)  # "pending" or "dead"
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    claimed_by = Column(String, nullable=True)  # Worker holding the message until next_attempt_at
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        Index("ix_outbox_messages_due", "status", "next_attempt_at"),
+        # Delivered rows are deleted; never hand their ids out again, sinks dedupe on them
+        {"sqlite_autoincrement": True},
+    )
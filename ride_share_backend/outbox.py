@@ -0,0 +1,447 @@
+# outbox.py
+# Transactional outbox for the side effects of ride changes (notifications).
+#
+# Endpoints call enqueue() (or one of the notify_* helpers) before they
+# commit, so a message is stored if and only if the change that caused it
+# commits, and no network call happens on the request path. OutboxWorker
+# drains due messages in batches off the event loop and hands them to a
+# sink. Failed deliveries are retried with exponential backoff and
+# dead-lettered (status "dead") after MAX_ATTEMPTS; delivered messages are
+# deleted. Delivery is at-least-once: a worker that dies mid-batch leaves
+# its claim to expire, so sinks should treat the shard and message id as
+# an idempotency key. Each ride shard (sharding.py) has its own outbox table
+# and worker; a message id is unique within its shard, and never reused
+# after the message is delivered and deleted (AUTOINCREMENT).
+import asyncio
+import json
+import random
+import threading
+import time
+import urllib.request
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import bindparam, delete, event, func, select, update
+from sqlalchemy.orm import Session
+
+from sharding import shard_of
+import models
+
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 300.0
+CLAIM_LEASE_SECONDS = 60.0  # A claimed batch not finished by then is picked up again
+POLL_INTERVAL_SECONDS = 1.0  # Commits wake the worker; this only catches retries and other processes
+MAX_BUSY_SHARE = 0.2  # While draining a backlog, the worker's own work takes at most this share of the time
+
+PENDING = "pending"
+DEAD = "dead"
+
+# Topics
+RIDE_ACCEPTED = "ride_accepted"
+RIDER_JOINED = "rider_joined"
+
+_WAKE_KEY = "outbox_wake"
+_workers = set()
+
+
+class Message:
+    __slots__ = ("id", "topic", "recipient_type", "recipient_id", "payload", "attempts", "created_at", "shard")
+
+    def __init__(self, id, topic, recipient_type, recipient_id, payload, attempts, created_at, shard=0):
+        self.id = id
+        self.topic = topic
+        self.recipient_type = recipient_type
+        self.recipient_id = recipient_id
+        self.payload = payload
+        self.attempts = attempts
+        self.created_at = created_at
+        self.shard = shard  # Ids are unique per shard; (shard, id) identifies a message
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "shard": self.shard,
+            "topic": self.topic,
+            "recipient_type": self.recipient_type,
+            "recipient_id": self.recipient_id,
+            "payload": self.payload,
+            "created_at": self.created_at
+        }
+
+
+# Writing messages
+
+def enqueue(db: Session, topic: str, recipient_type: str, recipient_id: int, payload: dict):
+    """Add a message to the outbox; it is stored only if ``db`` commits."""
+    db.add(models.OutboxMessage(
+        topic=topic,
+        recipient_type=recipient_type,
+        recipient_id=recipient_id,
+        payload=json.dumps(payload, default=str)
+    ))
+    db.info[_WAKE_KEY] = True
+
+
+def notify_ride_accepted(db: Session, ride: models.RideRequest, driver: models.Driver):
+    # The creator and everyone who joined hear about their driver
+    payload = {
+        "ride_id": ride.id,
+        "pickup": ride.pickup,
+        "destination": ride.destination,
+        "driver": {
+            "id": driver.id,
+            "name": driver.name,
+            "vehicle_type": driver.vehicle_type,
+            "vehicle_number": driver.vehicle_number
+        }
+    }
+    enqueue(db, RIDE_ACCEPTED, "user", ride.user_id, payload)
+    for (user_id,) in db.query(models.RideParticipant.user_id).filter(models.RideParticipant.ride_id == ride.id):
+        enqueue(db, RIDE_ACCEPTED, "user", user_id, payload)
+
+
+def notify_rider_joined(db: Session, ride: models.RideRequest, rider):
+    enqueue(db, RIDER_JOINED, "user", ride.user_id, {
+        "ride_id": ride.id,
+        "rider": {"id": rider.id, "email": rider.email},
+        "participant_count": ride.participant_count
+    })
+
+
+def outbox_depth(db: Session) -> dict:
+    # Messages waiting and dead-lettered
+    counts = dict(db.query(models.OutboxMessage.status, func.count()).group_by(models.OutboxMessage.status))
+    return {"pending": counts.get(PENDING, 0), "dead": counts.get(DEAD, 0)}
+
+
+def requeue_dead_letters(db: Session) -> int:
+    """Give every dead-lettered message a fresh set of attempts and commit."""
+    result = db.execute(
+        update(models.OutboxMessage)
+        .where(models.OutboxMessage.status == DEAD)
+        .values(status=PENDING, attempts=0, next_attempt_at=datetime.utcnow(), claimed_by=None)
+    )
+    db.commit()
+    return result.rowcount
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_after_commit(session: Session):
+    if session.info.pop(_WAKE_KEY, None):
+        shard = shard_of(session)
+        for worker in list(_workers):
+            if worker.shard == shard:
+                worker.wake()
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_wake(session: Session, transaction):
+    if transaction.parent is None:
+        session.info.pop(_WAKE_KEY, None)
+
+
+# Sinks
+#
+# A sink's deliver(messages) returns {message id: error} for the messages
+# that failed; raising fails the whole batch.
+
+class LogSink:
+    """Prints a line per message. The default until a push provider is configured.
+
+    Payloads carry riders' and drivers' personal details (names, emails),
+    so only the message id, topic and recipient are printed.
+    """
+
+    def deliver(self, messages: List[Message]) -> Dict[int, str]:
+        for message in messages:
+            print(f"Notify {message.recipient_type} {message.recipient_id}: {message.topic} (message {message.shard}:{message.id})")
+        return {}
+
+
+class FileSink:
+    """Appends messages to a local file, one JSON object per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def deliver(self, messages: List[Message]) -> Dict[int, str]:
+        lines = "".join(json.dumps(message.to_dict(), default=str) + "\n" for message in messages)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+        return {}
+
+
+class LoopbackSink:
+    """Keeps delivered messages in memory, for tests and benchmarks.
+
+    ``fail(message)`` returning True fails that message; ``latency`` seconds
+    are slept per batch to stand in for a network round trip.
+    """
+
+    def __init__(self, fail=None, latency: float = 0.0):
+        self.fail = fail
+        self.latency = latency
+        self.delivered: List[Message] = []
+        self._lock = threading.Lock()
+
+    def deliver(self, messages: List[Message]) -> Dict[int, str]:
+        if self.latency:
+            time.sleep(self.latency)
+        failed = {}
+        with self._lock:
+            for message in messages:
+                if self.fail is not None and self.fail(message):
+                    failed[message.id] = "loopback failure"
+                else:
+                    self.delivered.append(message)
+        return failed
+
+
+class WebhookSink:
+    """POSTs each batch as a JSON array to ``url``; any error fails the batch."""
+
+    def __init__(self, url: str, timeout: float = 5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def deliver(self, messages: List[Message]) -> Dict[int, str]:
+        body = json.dumps([message.to_dict() for message in messages], default=str).encode("utf-8")
+        request = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass  # urlopen raises for non-2xx responses
+        return {}
+
+
+# Worker
+
+class OutboxMetrics:
+    def __init__(self, lag_samples: int = 1000):
+        self._lock = threading.Lock()
+        self.started = time.monotonic()
+        self.batches = 0
+        self.delivered = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self.sink_seconds = 0.0
+        self._lag = deque(maxlen=lag_samples)  # Seconds from enqueue to delivery
+
+    def record(self, delivered: int, retried: int, dead_lettered: int, sink_seconds: float, lags):
+        with self._lock:
+            self.batches += 1
+            self.delivered += delivered
+            self.retried += retried
+            self.dead_lettered += dead_lettered
+            self.sink_seconds += sink_seconds
+            self._lag.extend(lags)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            lag = sorted(self._lag)
+
+            def lag_at(pct):
+                if not lag:
+                    return None
+                return round(lag[min(len(lag) - 1, int(pct / 100.0 * len(lag)))], 3)
+
+            return {
+                "batches": self.batches,
+                "delivered": self.delivered,
+                "retried": self.retried,
+                "dead_lettered": self.dead_lettered,
+                "delivered_per_second": round(self.delivered / elapsed, 2),
+                "sink_seconds": round(self.sink_seconds, 3),
+                "lag_p50_seconds": lag_at(50),
+                "lag_p95_seconds": lag_at(95)
+            }
+
+
+def backoff_seconds(attempts: int) -> float:
+    # Exponential in the number of failed attempts, capped, with jitter so retries spread out
+    delay = min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxWorker:
+    def __init__(
+        self,
+        SessionLocal,
+        sink=None,
+        batch_size: int = BATCH_SIZE,
+        max_attempts: int = MAX_ATTEMPTS,
+        lease_seconds: float = CLAIM_LEASE_SECONDS,
+        max_busy_share: float = MAX_BUSY_SHARE,
+        shard: int = 0,
+    ):
+        self.SessionLocal = SessionLocal
+        self.shard = shard
+        self.sink = sink if sink is not None else LogSink()
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.max_busy_share = max_busy_share
+        self.metrics = OutboxMetrics()
+        self._busy_seconds = 0.0  # Database and bookkeeping time of the last batch, sink excluded
+        self._loop = None
+        self._wakeup = None
+
+    def drain_once(self) -> int:
+        """Claim one batch of due messages, deliver it and record the outcome.
+
+        Returns the number of messages claimed.
+        """
+        started = time.perf_counter()
+        db = self.SessionLocal()
+        try:
+            token, messages = self._claim(db)
+            if not messages:
+                return 0
+            start = time.perf_counter()
+            try:
+                failed = self.sink.deliver(messages) or {}
+            except Exception as e:
+                failed = {message.id: str(e) or type(e).__name__ for message in messages}
+            sink_seconds = time.perf_counter() - start
+            self._finish(db, token, messages, failed, sink_seconds)
+            self._busy_seconds = time.perf_counter() - started - sink_seconds
+            return len(messages)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _claim(self, db: Session):
+        # Returns the claim's token and the messages it took
+        # Stamp the due messages with this claim's token and push their deadline out by
+        # the lease, so other workers skip them. The UPDATE re-checks that each one is
+        # still due, so a message another worker claimed first is left out.
+        now = datetime.utcnow()
+        token = uuid.uuid4().hex
+        due_ids = db.execute(
+            select(models.OutboxMessage.id)
+            .where(models.OutboxMessage.status == PENDING, models.OutboxMessage.next_attempt_at <= now)
+            .order_by(models.OutboxMessage.next_attempt_at, models.OutboxMessage.id)
+            .limit(self.batch_size)
+        ).scalars().all()
+        if not due_ids:
+            db.rollback()
+            return token, []
+        db.execute(
+            update(models.OutboxMessage)
+            .where(
+                models.OutboxMessage.id.in_(due_ids),
+                models.OutboxMessage.status == PENDING,
+                models.OutboxMessage.next_attempt_at <= now
+            )
+            .values(claimed_by=token, next_attempt_at=now + timedelta(seconds=self.lease_seconds))
+            .execution_options(synchronize_session=False)
+        )
+        db.commit()
+
+        rows = db.execute(
+            select(
+                models.OutboxMessage.id, models.OutboxMessage.topic, models.OutboxMessage.recipient_type,
+                models.OutboxMessage.recipient_id, models.OutboxMessage.payload, models.OutboxMessage.attempts,
+                models.OutboxMessage.created_at
+            )
+            .where(models.OutboxMessage.id.in_(due_ids), models.OutboxMessage.claimed_by == token)
+            .order_by(models.OutboxMessage.id)
+        )
+        messages = [
+            Message(row.id, row.topic, row.recipient_type, row.recipient_id, json.loads(row.payload), row.attempts, row.created_at, self.shard)
+            for row in rows
+        ]
+        # Release the read transaction before the sink's network call; an open
+        # reader would hold up every writer's commit on SQLite
+        db.rollback()
+        return token, messages
+
+    def _finish(self, db: Session, token: str, messages: List[Message], failed: Dict[int, str], sink_seconds: float):
+        # Every write matches the claim's token: if the lease ran out and another
+        # worker claimed a message since, that worker's outcome is the one kept
+        now = datetime.utcnow()
+        delivered = [message for message in messages if message.id not in failed]
+        retries = []
+        dead = 0
+        for message in messages:
+            error = failed.get(message.id)
+            if error is None:
+                continue
+            attempts = message.attempts + 1
+            values = {"b_id": message.id, "b_attempts": attempts, "b_error": error[:500], "b_status": PENDING,
+                      "b_next": now + timedelta(seconds=backoff_seconds(attempts))}
+            if attempts >= self.max_attempts:
+                values["b_status"], values["b_next"] = DEAD, now
+                dead += 1
+            retries.append(values)
+
+        if delivered:
+            db.execute(
+                delete(models.OutboxMessage)
+                .where(
+                    models.OutboxMessage.id.in_([message.id for message in delivered]),
+                    models.OutboxMessage.claimed_by == token
+                )
+                .execution_options(synchronize_session=False)
+            )
+        if retries:
+            outbox = models.OutboxMessage.__table__
+            db.execute(
+                update(outbox)
+                .where(outbox.c.id == bindparam("b_id"), outbox.c.claimed_by == token)
+                .values(
+                    attempts=bindparam("b_attempts"), last_error=bindparam("b_error"), status=bindparam("b_status"),
+                    next_attempt_at=bindparam("b_next"), claimed_by=None
+                ),
+                retries
+            )
+        db.commit()
+
+        self.metrics.record(
+            delivered=len(delivered),
+            retried=len(retries) - dead,
+            dead_lettered=dead,
+            sink_seconds=sink_seconds,
+            lags=[(now - message.created_at).total_seconds() for message in delivered]
+        )
+
+    def wake(self):
+        # Called from any thread after a commit that enqueued messages
+        loop, wakeup = self._loop, self._wakeup
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass  # Loop already closed
+
+    async def run(self, interval: float = POLL_INTERVAL_SECONDS):
+        # Background task: drain until the outbox is empty, then wait for a commit or the interval
+        loop = asyncio.get_running_loop()
+        self._loop, self._wakeup = loop, asyncio.Event()
+        _workers.add(self)
+        try:
+            while True:
+                self._wakeup.clear()
+                try:
+                    claimed = await loop.run_in_executor(None, self.drain_once)
+                except Exception as e:
+                    print(f"Error draining outbox: {str(e)}")
+                    claimed = 0
+                if claimed >= self.batch_size:
+                    # More are waiting; pause so requests keep most of the CPU and the database
+                    await asyncio.sleep(self._busy_seconds * (1.0 - self.max_busy_share) / self.max_busy_share)
+                    continue
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), interval)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            _workers.discard(self)
+            self._loop = self._wakeup = None
@@ -0,0 +1,520 @@
+# pooling.py
+# Carpool pooling optimizer.
+#
+# Periodically takes the open ride requests (pending, no driver) and merges
+# compatible ones into shared trips. Two requests are compatible when their
+# pickups and destinations are close, their departure times fall inside the
+# same window, every rider's detour stays within budget, the seats fit in
+# one car and no rider is on both (as creator or participant). Requests without coordinates only pool with requests for the
+# exact same pickup/destination names.
+#
+# The solver is greedy-then-local-search: seeds are taken in departure
+# order and grow by adding the candidate that saves the most vehicle-km,
+# then a relocate pass moves riders between the new trips while that
+# shortens the total route. Requests are kept in a grid index between
+# cycles, and only newly arrived requests are used as seeds, since pairs of
+# older requests were already found incompatible.
+import asyncio
+import math
+import time
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+import models
+import sync
+from ride_state import PENDING, transition
+
+MAX_SEATS = 4  # Also the most riders join_ride lets onto a ride
+DEPARTURE_WINDOW_SECONDS = 15 * 60
+PICKUP_RADIUS_KM = 1.5
+DROPOFF_RADIUS_KM = 2.0
+DETOUR_BUDGET = 0.3  # Each rider may travel at most 30% further than riding alone
+DETOUR_SLACK_KM = 0.5  # Absolute allowance so very short trips can still pool
+POOL_DISCOUNT = 0.15  # Shared trips cost 15% less than the sum of the solo fares
+LOCAL_SEARCH_PASSES = 2
+CANDIDATES_PER_BUCKET = 4  # Requests taken per grid bucket around the seed's departure
+MAX_CANDIDATES = 12  # Candidates evaluated per seed or per relocation
+POOLING_INTERVAL_SECONDS = 30
+
+# Grid cells are twice the search radius, so every point within the radius
+# lies in the request's own cell or the neighbour on the side it is closest
+# to: 2 cells per axis, 16 buckets per lookup instead of 81
+PICKUP_CELL_KM = 2 * PICKUP_RADIUS_KM
+DROPOFF_CELL_KM = 2 * DROPOFF_RADIUS_KM
+
+KM_PER_DEGREE_LAT = 110.574
+KM_PER_DEGREE_LNG = 111.320
+
+
+class OpenRequest:
+    __slots__ = (
+        "id", "user_id", "riders", "seats", "fare", "departure", "place_key",
+        "px", "py", "dx", "dy", "direct_km", "pickup_cell", "dropoff_cell", "trip",
+    )
+
+    def __init__(self, id, user_id, seats, fare, departure, pickup, destination,
+                 pickup_lat=None, pickup_lng=None, destination_lat=None, destination_lng=None, participants=()):
+        self.id = id
+        self.user_id = user_id
+        # Everyone riding: the creator and those who joined; a rider takes one seat in a trip
+        self.riders = frozenset(participants) | {user_id}
+        self.seats = seats or 1
+        self.fare = fare or 0.0
+        self.departure = departure  # Epoch seconds
+        self.trip = None
+        if None in (pickup_lat, pickup_lng, destination_lat, destination_lng):
+            # No coordinates: only exact place matches are possible
+            self.place_key = (pickup.strip().lower(), destination.strip().lower())
+            self.px = self.py = self.dx = self.dy = 0.0
+            self.direct_km = 0.0
+            self.pickup_cell = self.dropoff_cell = None
+        else:
+            self.place_key = None
+            # Local equirectangular projection to km; accurate at city scale
+            self.px, self.py = _project(pickup_lat, pickup_lng)
+            self.dx, self.dy = _project(destination_lat, destination_lng)
+            self.direct_km = math.hypot(self.dx - self.px, self.dy - self.py)
+            self.pickup_cell = (int(self.px // PICKUP_CELL_KM), int(self.py // PICKUP_CELL_KM))
+            self.dropoff_cell = (int(self.dx // DROPOFF_CELL_KM), int(self.dy // DROPOFF_CELL_KM))
+
+
+def _project(lat, lng):
+    return lng * KM_PER_DEGREE_LNG * math.cos(math.radians(lat)), lat * KM_PER_DEGREE_LAT
+
+
+class Trip:
+    __slots__ = ("members", "seats", "route_km")
+
+    def __init__(self, seed: OpenRequest):
+        self.members = [seed]
+        self.seats = seed.seats
+        self.route_km = seed.direct_km
+        seed.trip = self
+
+
+def route_length(members: List[OpenRequest]) -> Optional[float]:
+    """Route length of a shared trip, or None if a rider's detour is over budget.
+
+    Pickups are visited in departure order, then drop-offs nearest first
+    from the last pickup.
+    """
+    if len(members) == 1:
+        return members[0].direct_km
+    if members[0].place_key is not None:
+        return 0.0  # Exact place match, no geometry to check
+
+    hypot = math.hypot
+    total = 0.0
+    x, y = members[0].px, members[0].py
+    remaining = []
+    for member in members:
+        total += hypot(member.px - x, member.py - y)
+        x, y = member.px, member.py
+        remaining.append((member, total))  # Odometer reading at pickup
+
+    while remaining:
+        best_index, best_distance = 0, math.inf
+        for index, (member, _) in enumerate(remaining):
+            distance = hypot(member.dx - x, member.dy - y)
+            if distance < best_distance:
+                best_index, best_distance = index, distance
+        member, picked_up_at = remaining.pop(best_index)
+        total += best_distance
+        x, y = member.dx, member.dy
+        if total - picked_up_at > member.direct_km * (1.0 + DETOUR_BUDGET) + DETOUR_SLACK_KM:
+            return None
+    return total
+
+
+class PoolingOptimizer:
+    """Keeps the open requests indexed between cycles and solves incrementally."""
+
+    def __init__(self):
+        self.requests: Dict[int, OpenRequest] = {}
+        # (pickup cell, dropoff cell) or place key -> bucket sorted by departure
+        self._buckets: Dict[tuple, _Bucket] = {}
+        self._new_ids: List[int] = []
+
+    # Index maintenance
+
+    def sync(self, open_requests: List[OpenRequest]):
+        # Replace the indexed set with the current open requests, touching only the differences
+        current = {request.id: request for request in open_requests}
+        for ride_id in [ride_id for ride_id in self.requests if ride_id not in current]:
+            self._remove(self.requests.pop(ride_id))
+        for ride_id, request in current.items():
+            known = self.requests.get(ride_id)
+            if known is not None and (known.riders != request.riders or known.seats != request.seats):
+                # Riders joined or left: pairs found incompatible before may not be any more
+                self._remove(self.requests.pop(ride_id))
+                known = None
+            if known is None:
+                self.add(request)
+
+    def add(self, request: OpenRequest):
+        self.requests[request.id] = request
+        key = self._bucket_key(request)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        bucket.add(request)
+        self._new_ids.append(request.id)
+
+    def remove(self, ride_id: int):
+        request = self.requests.pop(ride_id, None)
+        if request is not None:
+            self._remove(request)
+
+    def _remove(self, request: OpenRequest):
+        key = self._bucket_key(request)
+        bucket = self._buckets.get(key)
+        if bucket is not None and bucket.remove(request) and not bucket.items:
+            del self._buckets[key]
+
+    @staticmethod
+    def _bucket_key(request: OpenRequest):
+        if request.place_key is not None:
+            return request.place_key
+        return request.pickup_cell + request.dropoff_cell
+
+    @staticmethod
+    def _neighbour_keys(request: OpenRequest):
+        pcx, pcy = request.pickup_cell
+        dcx, dcy = request.dropoff_cell
+        return [
+            (i, j, k, l)
+            for i in (pcx, pcx + _side(request.px, PICKUP_CELL_KM))
+            for j in (pcy, pcy + _side(request.py, PICKUP_CELL_KM))
+            for k in (dcx, dcx + _side(request.dx, DROPOFF_CELL_KM))
+            for l in (dcy, dcy + _side(request.dy, DROPOFF_CELL_KM))
+        ]
+
+    def _candidates(self, seed: OpenRequest) -> List[OpenRequest]:
+        """Unassigned compatible requests near the seed, closest departures first.
+
+        At most CANDIDATES_PER_BUCKET requests are taken from each bucket
+        around the seed's departure and at most MAX_CANDIDATES are kept, so
+        the cost per seed stays flat as the city gets denser.
+        """
+        if seed.place_key is not None:
+            keys = [seed.place_key]
+        else:
+            keys = self._neighbour_keys(seed)
+        position = (seed.departure, seed.id)
+        low = (seed.departure - DEPARTURE_WINDOW_SECONDS,)
+        high = (seed.departure + DEPARTURE_WINDOW_SECONDS, math.inf)
+        half = CANDIDATES_PER_BUCKET // 2
+        compatible = self._compatible
+        found = []
+        for key in keys:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                continue
+            order = bucket.order
+            middle = bisect_left(order, position)
+            start = max(bisect_left(order, low), middle - half)
+            end = min(bisect_right(order, high), middle + half + 1)
+            for request in bucket.items[start:end]:
+                if request.trip is None and request is not seed and compatible(seed, request):
+                    found.append(request)
+        if len(found) > MAX_CANDIDATES:
+            found.sort(key=lambda r: abs(r.departure - seed.departure))
+            del found[MAX_CANDIDATES:]
+        return found
+
+    # Solving
+
+    def solve(self) -> List[Trip]:
+        """Form shared trips seeded from requests added since the last solve.
+
+        Returns only trips with two or more members; their requests are
+        removed from the index since they leave the open pool once merged.
+        """
+        seeds = sorted(
+            (self.requests[ride_id] for ride_id in self._new_ids if ride_id in self.requests),
+            key=lambda r: (r.departure, r.id),
+        )
+        self._new_ids = []
+        trips = []
+        for seed in seeds:
+            if seed.trip is not None:
+                continue
+            trip = Trip(seed)
+            self._grow(trip)
+            if len(trip.members) > 1:
+                trips.append(trip)
+            else:
+                seed.trip = None
+
+        self._local_search(trips)
+
+        pooled = []
+        for trip in trips:
+            if len(trip.members) > 1:
+                pooled.append(trip)
+            else:
+                # Emptied out by local search; the rider stays in the open pool
+                for member in trip.members:
+                    member.trip = None
+        for trip in pooled:
+            for member in trip.members:
+                self.remove(member.id)
+        return pooled
+
+    def _grow(self, trip: Trip):
+        candidates = self._candidates(trip.members[0])
+        while candidates and trip.seats < MAX_SEATS:
+            best, best_route, best_saving = None, None, 0.0
+            for candidate in candidates:
+                if candidate.trip is not None or trip.seats + candidate.seats > MAX_SEATS:
+                    continue
+                if any(not candidate.riders.isdisjoint(member.riders) for member in trip.members):
+                    continue
+                members = sorted(trip.members + [candidate], key=lambda r: (r.departure, r.id))
+                if members[-1].departure - members[0].departure > DEPARTURE_WINDOW_SECONDS:
+                    continue
+                route = route_length(members)
+                if route is None:
+                    continue
+                # Vehicle-km saved by serving the candidate in this trip instead of alone
+                saving = trip.route_km + candidate.direct_km - route
+                if best is None or saving > best_saving:
+                    best, best_route, best_saving = candidate, route, saving
+            if best is None:
+                break
+            trip.members = sorted(trip.members + [best], key=lambda r: (r.departure, r.id))
+            trip.seats += best.seats
+            trip.route_km = best_route
+            best.trip = trip
+            candidates.remove(best)
+
+    @staticmethod
+    def _compatible(a: OpenRequest, b: OpenRequest) -> bool:
+        if not a.riders.isdisjoint(b.riders) or a.seats + b.seats > MAX_SEATS:
+            return False
+        if a.place_key is not None or b.place_key is not None:
+            return a.place_key == b.place_key
+        return (
+            (a.px - b.px) ** 2 + (a.py - b.py) ** 2 <= PICKUP_RADIUS_KM ** 2
+            and (a.dx - b.dx) ** 2 + (a.dy - b.dy) ** 2 <= DROPOFF_RADIUS_KM ** 2
+        )
+
+    def _local_search(self, trips: List[Trip]):
+        """Relocate riders between nearby trips while that shortens the total route.
+
+        Only the rider that adds the most distance to each trip is
+        considered for a move, which keeps a pass linear in the number of
+        trips.
+        """
+        by_bucket = {}
+        for trip in trips:
+            if trip.members[0].place_key is None:
+                by_bucket.setdefault(self._bucket_key(trip.members[0]), []).append(trip)
+
+        for _ in range(LOCAL_SEARCH_PASSES):
+            improved = False
+            for trip in trips:
+                if len(trip.members) < 2 or trip.members[0].place_key is not None:
+                    continue
+                member, remaining, remaining_route = self._costliest_member(trip)
+                if member is None:
+                    continue
+                targets = [
+                    other
+                    for key in self._neighbour_keys(member)
+                    for other in by_bucket.get(key, ())
+                    if other is not trip and other.seats + member.seats <= MAX_SEATS
+                ][:MAX_CANDIDATES]
+                if targets and self._relocate(member, trip, remaining, remaining_route, targets):
+                    improved = True
+            if not improved:
+                break
+
+    @staticmethod
+    def _costliest_member(trip: Trip):
+        # The rider whose removal shortens the trip the most, with the trip without them
+        best = (None, None, None)
+        best_saving = -math.inf
+        for member in trip.members:
+            remaining = [m for m in trip.members if m is not member]
+            route = route_length(remaining)
+            if route is not None and trip.route_km - route > best_saving:
+                best, best_saving = (member, remaining, route), trip.route_km - route
+        return best
+
+    def _relocate(self, member: OpenRequest, source: Trip, remaining, source_route, targets: List[Trip]) -> bool:
+        for target in targets:
+            if target.seats + member.seats > MAX_SEATS:
+                continue
+            if not self._compatible(member, target.members[0]):
+                continue
+            if any(not m.riders.isdisjoint(member.riders) for m in target.members):
+                continue
+            members = sorted(target.members + [member], key=lambda r: (r.departure, r.id))
+            if members[-1].departure - members[0].departure > DEPARTURE_WINDOW_SECONDS:
+                continue
+            target_route = route_length(members)
+            if target_route is None:
+                continue
+            if source_route + target_route < source.route_km + target.route_km - 1e-9:
+                source.members, source.route_km = remaining, source_route
+                source.seats -= member.seats
+                target.members, target.route_km = members, target_route
+                target.seats += member.seats
+                member.trip = target
+                return True
+        return False
+
+
+def _side(value, cell_km):
+    # -1 if the value sits in the lower half of its cell, +1 otherwise
+    return -1 if (value % cell_km) < cell_km / 2 else 1
+
+
+class _Bucket:
+    # Requests sharing a grid key, with a parallel (departure, id) list for bisecting
+    __slots__ = ("order", "items")
+
+    def __init__(self):
+        self.order = []
+        self.items = []
+
+    def add(self, request: OpenRequest):
+        index = bisect_left(self.order, (request.departure, request.id))
+        self.order.insert(index, (request.departure, request.id))
+        self.items.insert(index, request)
+
+    def remove(self, request: OpenRequest) -> bool:
+        index = bisect_left(self.order, (request.departure, request.id))
+        if index < len(self.items) and self.items[index] is request:
+            del self.order[index]
+            del self.items[index]
+            return True
+        return False
+
+
+def load_open_requests(db: Session) -> List[OpenRequest]:
+    # Only the columns the solver needs; no ORM objects
+    rows = db.query(
+        models.RideRequest.id,
+        models.RideRequest.user_id,
+        models.RideRequest.participant_count,
+        models.RideRequest.fare,
+        models.RideRequest.departure_time,
+        models.RideRequest.created_at,
+        models.RideRequest.pickup,
+        models.RideRequest.destination,
+        models.RideRequest.pickup_lat,
+        models.RideRequest.pickup_lng,
+        models.RideRequest.destination_lat,
+        models.RideRequest.destination_lng,
+    ).filter(
+        models.RideRequest.status == PENDING,
+        models.RideRequest.driver_id.is_(None),
+    ).all()
+    participants = _participants(db, [row.id for row in rows])
+
+    return [
+        OpenRequest(
+            row.id, row.user_id, row.participant_count, row.fare,
+            (row.departure_time or row.created_at).timestamp(),
+            row.pickup, row.destination,
+            row.pickup_lat, row.pickup_lng, row.destination_lat, row.destination_lng,
+            participants.get(row.id, ()),
+        )
+        for row in rows
+    ]
+
+
+def _participants(db: Session, ride_ids) -> Dict[int, set]:
+    # Riders who joined each ride, in chunks below SQLite's variable limit
+    ride_ids = list(ride_ids)
+    joined: Dict[int, set] = {}
+    for start in range(0, len(ride_ids), 500):
+        for ride_id, user_id in db.query(models.RideParticipant.ride_id, models.RideParticipant.user_id).filter(
+            models.RideParticipant.ride_id.in_(ride_ids[start:start + 500])
+        ):
+            joined.setdefault(ride_id, set()).add(user_id)
+    return joined
+
+
+def apply_trips(db: Session, trips: List[Trip]) -> int:
+    """Merge each trip's rides into its oldest ride and commit.
+
+    The other rides move to "merged", their creators and participants join
+    the anchor ride, and the anchor gets the pooled fare and per-seat fare.
+    Trips whose rides changed since they were loaded are skipped. Returns
+    the number of rides merged away.
+    """
+    merged = 0
+    for trip in trips:
+        # Taking the version locks the database for writing, so the rides read
+        # below cannot change (a rider joining, say) before the commit
+        sync.transaction_version(db)
+        ids = sorted(member.id for member in trip.members)
+        rides = db.query(models.RideRequest).filter(
+            models.RideRequest.id.in_(ids),
+            models.RideRequest.status == PENDING,
+            models.RideRequest.driver_id.is_(None),
+        ).order_by(models.RideRequest.id).all()
+        seats = sum(ride.participant_count or 1 for ride in rides)
+        joined = _participants(db, ids)
+        riders = [joined.get(ride.id, set()) | {ride.user_id} for ride in rides]
+        if len(rides) != len(ids) or seats > MAX_SEATS or sum(map(len, riders)) != len(set().union(*riders)):
+            # Accepted, deleted or merged meanwhile, riders joined and the trip no longer
+            # fits, or a rider is on two of the rides and would be seated twice
+            db.rollback()
+            continue
+
+        anchor, others = rides[0], rides[1:]
+        total_fare = sum(ride.fare or 0.0 for ride in rides)
+        seated = set(riders[0])
+        for ride in others:
+            transition(db, ride, "merge", actor_type="system")
+            ride.merged_into_id = anchor.id
+            # Move through the ORM so the rows get a new sync version; never seat anyone twice
+            for participant in db.query(models.RideParticipant).filter(models.RideParticipant.ride_id == ride.id):
+                if participant.user_id in seated:
+                    db.delete(participant)
+                else:
+                    participant.ride_id = anchor.id
+                    seated.add(participant.user_id)
+            if ride.user_id not in seated:
+                db.add(models.RideParticipant(ride_id=anchor.id, user_id=ride.user_id))
+                seated.add(ride.user_id)
+
+        anchor.participant_count = seats
+        anchor.fare = round(total_fare * (1.0 - POOL_DISCOUNT), 2)
+        anchor.seat_fare = round(anchor.fare / seats, 2)
+        db.commit()
+        merged += len(others)
+    return merged
+
+
+def run_pooling_cycle(SessionLocal, optimizer: PoolingOptimizer) -> int:
+    db = SessionLocal()
+    try:
+        optimizer.sync(load_open_requests(db))
+        return apply_trips(db, optimizer.solve())
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def pooling_loop(SessionLocal, optimizer: Optional[PoolingOptimizer] = None, interval: float = POOLING_INTERVAL_SECONDS):
+    # Background task: one pooling cycle every `interval` seconds, off the event loop
+    optimizer = optimizer or PoolingOptimizer()
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            start = time.perf_counter()
+            merged = await loop.run_in_executor(None, run_pooling_cycle, SessionLocal, optimizer)
+            if merged:
+                print(f"Pooling cycle merged {merged} rides in {time.perf_counter() - start:.2f}s")
+        except Exception as e:
+            print(f"Error in pooling cycle: {str(e)}")
+        await asyncio.sleep(interval)
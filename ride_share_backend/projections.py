@@ -0,0 +1,218 @@
+# projections.py
+# Read models (driver_stats, ride_timelines) derived from the ride_events
+# log. catch_up() applies only the events added since the last checkpoint,
+# so reads never rescan ride_requests. Each ride shard (sharding.py) has
+# its own event log and checkpoint; all of them feed the same read models.
+# projections_loop() folds them in the background, so the endpoints that
+# serve the read models only read; they lag the log by up to
+# PROJECTIONS_INTERVAL_SECONDS.
+# fold_events() is the checkpointed batch loop, shared with analytics.py.
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from sharding import shard_of, shards
+import models
+
+CHECKPOINT_NAME = "ride_read_models"
+PROJECTIONS_INTERVAL_SECONDS = 2.0
+
+EVENT_COLUMNS = (
+    models.RideEvent.id,
+    models.RideEvent.ride_id,
+    models.RideEvent.event,
+    models.RideEvent.to_status,
+    models.RideEvent.driver_id,
+    models.RideEvent.created_at,
+)
+
+
+class ReadModelDelta:
+    """Accumulates the effect of a batch of events before it is written."""
+
+    def __init__(self):
+        self.drivers = defaultdict(lambda: {"accepted_count": 0, "completed_count": 0, "released_count": 0, "last_event_at": None})
+        self.timelines = {}
+
+    def apply(self, ride_id, event_name, to_status, driver_id, created_at):
+        timeline = self.timelines.get(ride_id)
+        if timeline is None or event_name == "create":
+            # Databases from before ride ids stopped being reused may repeat one, so a create starts a fresh timeline
+            timeline = self.timelines[ride_id] = {"event_count": 0, "release_count": 0, "reset": event_name == "create"}
+        timeline["status"] = to_status
+        timeline["event_count"] += 1
+
+        if event_name == "create":
+            timeline["created_at"] = created_at
+        elif event_name == "accept":
+            timeline["accepted_at"] = created_at
+            timeline["driver_id"] = driver_id
+        elif event_name == "release":
+            timeline["release_count"] += 1
+            timeline["driver_id"] = None
+        elif event_name == "complete":
+            timeline["completed_at"] = created_at
+        elif event_name == "delete":
+            timeline["deleted_at"] = created_at
+
+        if driver_id is not None and event_name in ("accept", "release", "complete"):
+            stats = self.drivers[driver_id]
+            if event_name == "accept":
+                stats["accepted_count"] += 1
+            elif event_name == "release":
+                stats["released_count"] += 1
+            else:
+                stats["completed_count"] += 1
+            stats["last_event_at"] = created_at
+
+    def write(self, db: Session):
+        # Merge with the existing rows and write everything back in bulk
+        _merge_rows(db, models.DriverStats, "driver_id", self.drivers, _merge_driver_stats)
+        _merge_rows(db, models.RideTimeline, "ride_id", self.timelines, _merge_timeline)
+
+
+def _merge_driver_stats(existing, delta):
+    merged = dict(existing) if existing else {"accepted_count": 0, "completed_count": 0, "released_count": 0, "last_event_at": None}
+    for key in ("accepted_count", "completed_count", "released_count"):
+        merged[key] += delta[key]
+    # Shards catch up independently, so keep the latest rather than the last applied
+    if delta["last_event_at"] is not None and (merged["last_event_at"] is None or delta["last_event_at"] > merged["last_event_at"]):
+        merged["last_event_at"] = delta["last_event_at"]
+    return merged
+
+
+def _merge_timeline(existing, delta):
+    merged = dict(existing) if existing and not delta["reset"] else {"event_count": 0, "release_count": 0}
+    for key, value in delta.items():
+        if key == "reset":
+            continue
+        if key in ("event_count", "release_count"):
+            merged[key] = merged.get(key, 0) + value
+        else:
+            merged[key] = value
+    return merged
+
+
+def _merge_rows(db: Session, model, key_name, deltas, merge, chunk_size=500):
+    if not deltas:
+        return
+    key_column = getattr(model, key_name)
+    columns = [c.name for c in model.__table__.columns]
+    keys = list(deltas)
+    inserts, updates = [], []
+    for start in range(0, len(keys), chunk_size):
+        chunk = keys[start:start + chunk_size]
+        existing = {
+            row[key_name]: row
+            for row in db.execute(select(model.__table__).where(key_column.in_(chunk))).mappings()
+        }
+        for key in chunk:
+            merged = merge(existing.get(key), deltas[key])
+            merged[key_name] = key
+            row = {name: merged.get(name) for name in columns}
+            (updates if key in existing else inserts).append(row)
+    if inserts:
+        db.bulk_insert_mappings(model, inserts)
+    if updates:
+        db.bulk_update_mappings(model, updates)
+
+
+def checkpoint_name(shard: int, name: str = CHECKPOINT_NAME) -> str:
+    return name if shard == 0 else f"{name}@{shard}"
+
+
+def get_checkpoint(db: Session, name: str = CHECKPOINT_NAME) -> int:
+    checkpoint = db.get(models.ProjectionCheckpoint, checkpoint_name(shard_of(db), name))
+    return checkpoint.last_event_id if checkpoint else 0
+
+
+def catch_up(db: Session, batch_size: int = 5000) -> int:
+    """Apply events newer than the checkpoint to the read models.
+
+    Returns the number of events applied.
+    """
+    return fold_events(db, CHECKPOINT_NAME, EVENT_COLUMNS, _read_model_delta, batch_size)
+
+
+def update_read_models(router=shards) -> int:
+    # Shards one after another: they share the read model rows
+    applied = 0
+    for shard in router:
+        db = shard.SessionLocal()
+        try:
+            applied += catch_up(db)
+        finally:
+            db.close()
+    return applied
+
+
+async def projections_loop(router=shards, interval: float = PROJECTIONS_INTERVAL_SECONDS):
+    # Background task: fold new ride events into the read models every `interval` seconds, off the event loop
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, update_read_models, router)
+        except Exception as e:
+            print(f"Error updating ride read models: {str(e)}")
+        await asyncio.sleep(interval)
+
+
+def _read_model_delta(db: Session, events) -> ReadModelDelta:
+    delta = ReadModelDelta()
+    for event_id, ride_id, event_name, to_status, driver_id, created_at in events:
+        delta.apply(ride_id, event_name, to_status, driver_id, created_at)
+    return delta
+
+
+def fold_events(db: Session, name: str, columns, build_delta, batch_size: int = 5000) -> int:
+    """Fold events newer than checkpoint ``name`` into a projection, batch by batch.
+
+    ``columns`` are selected from ride_events (the id first) and
+    ``build_delta(db, events)`` returns an object whose ``write(db)``
+    applies the batch. Each batch and its checkpoint move commit together.
+    The checkpoint is advanced with a compare-and-swap, so a concurrent
+    fold that got there first makes this one roll back instead of applying
+    events twice. Returns the number of events applied.
+    """
+    applied = 0
+    while True:
+        last_event_id = get_checkpoint(db, name)
+        events = db.execute(
+            select(*columns)
+            .where(models.RideEvent.id > last_event_id)
+            .order_by(models.RideEvent.id)
+            .limit(batch_size)
+        ).all()
+        if not events:
+            db.rollback()
+            return applied
+
+        delta = build_delta(db, events)
+
+        if not _advance_checkpoint(db, name, last_event_id, events[-1][0]):
+            db.rollback()
+            return applied
+        delta.write(db)
+        db.commit()
+        applied += len(events)
+        if len(events) < batch_size:
+            return applied
+
+
+def _advance_checkpoint(db: Session, name: str, expected: int, new_value: int) -> bool:
+    name = checkpoint_name(shard_of(db), name)
+    if expected == 0 and db.get(models.ProjectionCheckpoint, name) is None:
+        db.add(models.ProjectionCheckpoint(name=name, last_event_id=new_value))
+        db.flush()
+        return True
+    result = db.execute(
+        update(models.ProjectionCheckpoint)
+        .where(
+            models.ProjectionCheckpoint.name == name,
+            models.ProjectionCheckpoint.last_event_id == expected,
+        )
+        .values(last_event_id=new_value)
+    )
+    return result.rowcount == 1
@@ -0,0 +1,341 @@
+# rate_limit.py
+# Token-bucket rate limiting and adaptive load shedding for the API.
+#
+# Driver apps poll /available-rides and /driver/availability in tight loops.
+# Every request is checked against two buckets (one per principal, taken
+# from the verified JWT, and one per client IP) with a budget chosen by
+# route. Ride ids in the path are collapsed, so a route shares one bucket
+# whatever ride it names, and paths the app has no route for share a single
+# bucket, so made-up paths cannot mint new buckets or cached budgets.
+# Independently, the load shedder rejects work before it starts when too
+# many requests are in flight or the event loop is lagging.
+import asyncio
+import json
+import math
+import random
+import re
+import time
+from typing import Dict, Optional
+
+from security import decode_token
+
+
+class RouteBudget:
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate    # tokens refilled per second
+        self.burst = burst  # bucket capacity
+
+
+# Polling endpoints get a small steady budget; everything else a roomier one
+DEFAULT_BUDGET = RouteBudget(rate=10.0, burst=30.0)
+ROUTE_BUDGETS: Dict[str, RouteBudget] = {
+    "/available-rides": RouteBudget(rate=1.0, burst=5.0),
+    "/driver/availability": RouteBudget(rate=1.0, burst=5.0),
+    "/match-rides": RouteBudget(rate=2.0, burst=10.0),
+    "/analytics/heatmap": RouteBudget(rate=0.5, burst=5.0),  # The rollups change every few seconds at most
+    "/driver/rides/export": RouteBudget(rate=0.1, burst=3.0),  # Reads the driver's whole history
+    "/rides/search": RouteBudget(rate=1.0, burst=10.0),  # Search-as-you-type comes in bursts
+}
+# Routes that are shed first when the server is under pressure
+POLLING_ROUTES = frozenset({"/available-rides", "/driver/availability", "/match-rides", "/analytics/heatmap"})
+
+# Per-IP buckets are shared by everyone behind the same NAT, so they scale
+# the route budget up instead of using it as is
+IP_BUDGET_MULTIPLIER = 5.0
+
+# Numeric path segments (ride ids): /ride/7 and /ride/8 share a bucket, so
+# buckets are per route rather than per ride and a new id is no fresh burst
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+_PATH_PARAM = re.compile(r"\{[^}]*\}")
+UNKNOWN_PATH = "*"  # Bucket key of every path the app has no route for
+
+
+class InMemoryBucketStore:
+    """Token buckets kept in a single dict of ``key -> [tokens, stamp]``.
+
+    A bucket left idle for ``idle_seconds`` has refilled completely and
+    carries no information, so idle buckets are swept once the dict grows
+    past ``max_keys``.
+    """
+
+    def __init__(self, max_keys: int = 100_000, idle_seconds: float = 60.0):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self._buckets: Dict[str, list] = {}
+
+    def take(self, key: str, budget: RouteBudget, now: float) -> float:
+        # Returns 0 if a token was taken, otherwise seconds until one is available
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            if len(self._buckets) >= self.max_keys:
+                self._sweep(now)
+            self._buckets[key] = [budget.burst - 1.0, now]
+            return 0.0
+
+        tokens = min(budget.burst, bucket[0] + (now - bucket[1]) * budget.rate)
+        bucket[1] = now
+        if tokens >= 1.0:
+            bucket[0] = tokens - 1.0
+            return 0.0
+        bucket[0] = tokens
+        return (1.0 - tokens) / budget.rate
+
+    def _sweep(self, now: float):
+        stale = [key for key, (_, stamp) in self._buckets.items() if now - stamp > self.idle_seconds]
+        for key in stale:
+            del self._buckets[key]
+        if len(self._buckets) >= self.max_keys:
+            # Still full: everything is hot, forget the least recently used half
+            by_age = sorted(self._buckets.items(), key=lambda item: item[1][1])
+            for key, _ in by_age[: len(by_age) // 2]:
+                del self._buckets[key]
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class RedisBucketStore:
+    """Shared token buckets in Redis, for running several workers.
+
+    The refill-and-take step runs as a Lua script so it is atomic across
+    workers, and it reads the time from the Redis server: the workers'
+    monotonic clocks have unrelated origins. Requires the optional
+    ``redis`` package and Redis 5 or later.
+    """
+
+    _SCRIPT = """
+    local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'stamp')
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local time = redis.call('TIME')
+    local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+    local tokens = tonumber(bucket[1])
+    local stamp = tonumber(bucket[2])
+    if tokens == nil then
+        tokens = burst
+        stamp = now
+    end
+    tokens = math.min(burst, tokens + (now - stamp) * rate)
+    local wait = 0
+    if tokens >= 1 then
+        tokens = tokens - 1
+    else
+        wait = (1 - tokens) / rate
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'stamp', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+    return tostring(wait)
+    """
+
+    def __init__(self, url: str = "redis://localhost:6379/0", prefix: str = "ratelimit:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("RedisBucketStore requires the 'redis' package (pip install redis)")
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._take = self._client.register_script(self._SCRIPT)
+
+    def take(self, key: str, budget: RouteBudget, now: float) -> float:
+        # ``now`` is this process's clock; the script uses the server's instead
+        return float(self._take(keys=[self.prefix + key], args=[budget.rate, budget.burst]))
+
+
+class RateLimiter:
+    def __init__(self, store=None, route_budgets=None, default_budget=DEFAULT_BUDGET):
+        self.store = store if store is not None else InMemoryBucketStore()
+        self.route_budgets = route_budgets if route_budgets is not None else ROUTE_BUDGETS
+        self.default_budget = default_budget
+        # One per budget object, so a handful whatever paths are requested
+        self._ip_budgets: Dict[RouteBudget, RouteBudget] = {}
+
+    def budget_for(self, path: str) -> RouteBudget:
+        return self.route_budgets.get(path, self.default_budget)
+
+    def _ip_budget(self, budget: RouteBudget) -> RouteBudget:
+        ip_budget = self._ip_budgets.get(budget)
+        if ip_budget is None:
+            ip_budget = RouteBudget(budget.rate * IP_BUDGET_MULTIPLIER, budget.burst * IP_BUDGET_MULTIPLIER)
+            self._ip_budgets[budget] = ip_budget
+        return ip_budget
+
+    def check(self, path: str, principal: Optional[str], client_ip: Optional[str], now: Optional[float] = None) -> float:
+        # Returns 0 if the request may proceed, otherwise the Retry-After in seconds
+        if now is None:
+            now = time.monotonic()
+        path = _ID_SEGMENT.sub("/{id}", path)
+        budget = self.budget_for(path)
+        wait = 0.0
+        if principal is not None:
+            wait = self.store.take(f"p:{principal}:{path}", budget, now)
+        if client_ip is not None:
+            wait = max(wait, self.store.take(f"ip:{client_ip}:{path}", self._ip_budget(budget), now))
+        return wait
+
+
+class LoadShedder:
+    """Rejects requests up front when the worker is saturated.
+
+    Two signals are used: the number of requests currently in flight and
+    the event loop lag measured by a background sampler. Polling routes are
+    shed at a lower threshold than everything else, and past the threshold
+    the rejection probability grows with the overload instead of flipping
+    from nothing to everything.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        polling_in_flight_ratio: float = 0.5,
+        max_loop_lag: float = 0.1,
+        sample_interval: float = 0.05,
+    ):
+        self.max_in_flight = max_in_flight
+        self.polling_in_flight_ratio = polling_in_flight_ratio
+        self.max_loop_lag = max_loop_lag
+        self.sample_interval = sample_interval
+        self.in_flight = 0
+        self.loop_lag = 0.0
+        self.shed_count = 0
+        self._sampler: Optional[asyncio.Task] = None
+        self._loop = None
+
+    def start(self):
+        # Start the event loop lag sampler on the running loop (idempotent)
+        loop = asyncio.get_running_loop()
+        if self._sampler is None or self._sampler.done() or self._loop is not loop:
+            self._loop = loop
+            self._sampler = loop.create_task(self._sample_loop_lag())
+
+    async def stop(self):
+        if self._sampler is not None:
+            self._sampler.cancel()
+            try:
+                await self._sampler
+            except asyncio.CancelledError:
+                pass
+            self._sampler = None
+
+    async def _sample_loop_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.sample_interval
+            await asyncio.sleep(self.sample_interval)
+            lag = max(0.0, loop.time() - expected)
+            # Exponential moving average so one slow tick does not trip shedding
+            self.loop_lag = 0.7 * self.loop_lag + 0.3 * lag
+
+    def should_shed(self, path: str) -> float:
+        # Returns 0 to admit the request, otherwise the Retry-After in seconds
+        limit = self.max_in_flight
+        if path in POLLING_ROUTES:
+            limit = max(1, int(limit * self.polling_in_flight_ratio))
+        pressure = max(self.in_flight / limit, self.loop_lag / self.max_loop_lag)
+        if pressure < 1.0:
+            return 0.0
+        # Shed with probability proportional to how far past the limit we are
+        if pressure < 2.0 and random.random() > pressure - 1.0:
+            return 0.0
+        self.shed_count += 1
+        return max(1.0, self.loop_lag * 10)
+
+
+def principal_from_headers(headers) -> Optional[str]:
+    # The token is verified (cached, see security.decode_token) so a forged
+    # subject cannot drain someone else's bucket; requests without a valid
+    # token are limited by the per-IP bucket alone
+    auth = headers.get(b"authorization")
+    if not auth or not auth.lower().startswith(b"bearer "):
+        return None
+    try:
+        token = auth[7:].decode("latin-1")
+    except ValueError:
+        return None
+    principal = decode_token(token)
+    return f"{principal.user_type}:{principal.email}" if principal is not None else None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the load shedder, then the rate limiter."""
+
+    def __init__(self, app, limiter: Optional[RateLimiter] = None, shedder: Optional[LoadShedder] = None):
+        self.app = app
+        self.limiter = limiter if limiter is not None else RateLimiter()
+        self.shedder = shedder if shedder is not None else LoadShedder()
+        self._routes = None  # (static paths, [(pattern, key)]), read from the app on the first request
+
+    def _route_key(self, scope) -> str:
+        # The route template the path falls under, with parameters as {id}, or
+        # UNKNOWN_PATH, so the bucket keys are bounded by the app's routes
+        app = scope.get("app")  # Set by the application before its middleware runs
+        if app is None:
+            return scope["path"]
+        if self._routes is None:
+            self._routes = _route_templates(app)
+        static, dynamic = self._routes
+        path = scope["path"]
+        if path in static:
+            return path
+        for pattern, key in dynamic:
+            if pattern.fullmatch(path):
+                return key
+        return UNKNOWN_PATH
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        path = scope["path"]
+        self.shedder.start()
+
+        # Shed before doing any other work, including token parsing
+        retry_after = self.shedder.should_shed(path)
+        if retry_after:
+            await _reject(send, 503, "Server is overloaded, retry later", retry_after)
+            return
+
+        headers = dict(scope["headers"])
+        client = scope.get("client")
+        retry_after = self.limiter.check(
+            self._route_key(scope), principal_from_headers(headers), client[0] if client else None
+        )
+        if retry_after:
+            await _reject(send, 429, "Too many requests", retry_after)
+            return
+
+        self.shedder.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.shedder.in_flight -= 1
+
+
+def _route_templates(app):
+    templates = {route.path for route in app.routes if getattr(route, "path", None)}
+    if hasattr(app, "openapi"):
+        # Routes of included routers are listed here whatever the router nesting
+        templates.update(app.openapi()["paths"])
+    static = {template for template in templates if "{" not in template}
+    dynamic = [
+        (re.compile("[^/]+".join(re.escape(part) for part in _PATH_PARAM.split(template))),
+         _PATH_PARAM.sub("{id}", template))
+        for template in sorted(templates - static)
+    ]
+    return static, dynamic
+
+
+async def _reject(send, status_code: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status_code,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(int(math.ceil(retry_after))).encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,86 @@
+# replay_events.py
+# Rebuild the read models (driver_stats, ride_timelines) from scratch by
+# replaying the ride_events log of the main database and every ride shard.
+#
+#   python replay_events.py [--batch-size 50000]
+import argparse
+import time
+
+from sqlalchemy import delete, insert, select
+
+from database import engine
+from projections import ReadModelDelta, EVENT_COLUMNS, checkpoint_name
+from sharding import shards
+import models
+
+
+def replay(bind=engine, batch_size: int = 50000, shard_binds=()):
+    """Replay the whole log and replace the read models in one transaction.
+
+    Events are streamed in id order and folded into one in-memory delta
+    (one entry per ride and per driver), which is then written with bulk
+    INSERTs. ``shard_binds`` are (shard index, engine) pairs of the other
+    ride shards; their logs are folded in too. Returns (events replayed,
+    seconds taken).
+    """
+    start = time.perf_counter()
+    delta = ReadModelDelta()
+    replayed = 0
+    checkpoints = []
+
+    with bind.begin() as conn:
+        for shard, shard_bind in [(0, bind), *shard_binds]:
+            # Rides never move between shards, so each log can be folded on its own
+            shard_conn = conn if shard == 0 else shard_bind.connect()
+            try:
+                result = shard_conn.execution_options(stream_results=True, yield_per=batch_size).execute(
+                    select(*EVENT_COLUMNS).order_by(models.RideEvent.id)
+                )
+                last_event_id = 0
+                for batch in result.partitions():
+                    for event_id, ride_id, event_name, to_status, driver_id, created_at in batch:
+                        delta.apply(ride_id, event_name, to_status, driver_id, created_at)
+                    replayed += len(batch)
+                    last_event_id = batch[-1][0]
+            finally:
+                if shard_conn is not conn:
+                    shard_conn.close()
+            checkpoints.append({"name": checkpoint_name(shard), "last_event_id": last_event_id})
+
+        conn.execute(delete(models.DriverStats))
+        conn.execute(delete(models.RideTimeline))
+        conn.execute(delete(models.ProjectionCheckpoint).where(
+            models.ProjectionCheckpoint.name.in_([checkpoint["name"] for checkpoint in checkpoints])
+        ))
+
+        _bulk_insert(conn, models.DriverStats, "driver_id", delta.drivers, batch_size)
+        _bulk_insert(conn, models.RideTimeline, "ride_id", delta.timelines, batch_size)
+        conn.execute(insert(models.ProjectionCheckpoint), checkpoints)
+
+    return replayed, time.perf_counter() - start
+
+
+def _bulk_insert(conn, model, key_name, rows_by_key, batch_size):
+    columns = [c.name for c in model.__table__.columns]
+    defaults = {"accepted_count": 0, "completed_count": 0, "released_count": 0, "release_count": 0, "event_count": 0}
+    batch = []
+    for key, values in rows_by_key.items():
+        row = {name: values.get(name, defaults.get(name)) for name in columns}
+        row[key_name] = key
+        batch.append(row)
+        if len(batch) >= batch_size:
+            conn.execute(insert(model), batch)
+            batch = []
+    if batch:
+        conn.execute(insert(model), batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild read models from the ride_events log")
+    parser.add_argument("--batch-size", type=int, default=50000)
+    args = parser.parse_args()
+
+    print("Replaying ride events...")
+    count, elapsed = replay(batch_size=args.batch_size, shard_binds=[(shard.index, shard.engine) for shard in list(shards)[1:]])
+    rate = count / elapsed if elapsed else 0
+    print(f"Replayed {count} events in {elapsed:.2f}s ({rate:,.0f} events/s)")
@@ -0,0 +1,282 @@
+# ride_export.py
+# Columnar export of ride history for reports and driver earnings.
+#
+# Rides are read from ride_requests in id order, a chunk at a time, with
+# the date range, driver and status filters pushed into the SQL. Each
+# chunk comes back as one Arrow record batch (the driver's name joined in,
+# the participants' user ids as a list column) and is written as a Parquet
+# row group or an Arrow IPC batch before the next one is read, so memory
+# stays bounded by the chunk size however large the export. Earnings are
+# grouped aggregations over the batches with pyarrow.compute rather than
+# Python loops over rides. Every ride shard (sharding.py) is exported, one
+# after another.
+from datetime import datetime
+from typing import Iterable, Iterator, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import String, func, select, type_coerce
+from sqlalchemy.orm import Session
+
+from database import READ_ONLY_KEY
+from sharding import shards
+import models
+
+EXPORT_CHUNK_ROWS = 50_000
+PARQUET_COMPRESSION = "zstd"
+
+# format -> media type
+FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+
+PARTICIPANT_IDS = pa.list_(pa.int64())
+
+SCHEMA = pa.schema([
+    ("ride_id", pa.int64()),
+    ("created_at", pa.timestamp("us")),
+    ("departure_time", pa.timestamp("us")),
+    ("status", pa.string()),
+    ("user_id", pa.int64()),
+    ("driver_id", pa.int64()),
+    ("driver_name", pa.string()),
+    ("pickup", pa.string()),
+    ("destination", pa.string()),
+    ("pickup_lat", pa.float64()),
+    ("pickup_lng", pa.float64()),
+    ("distance", pa.float64()),
+    ("fare", pa.float64()),
+    ("seat_fare", pa.float64()),
+    ("participant_count", pa.int64()),
+    ("participant_ids", PARTICIPANT_IDS),
+])
+
+_TIMESTAMPS = {"created_at", "departure_time"}
+
+# What earnings_summary() reads
+EARNINGS_COLUMNS = ["ride_id", "created_at", "status", "driver_id", "fare", "distance"]
+
+
+def ride_filters(since: Optional[datetime] = None, until: Optional[datetime] = None,
+                 driver_id: Optional[int] = None, status: Optional[str] = None) -> list:
+    # WHERE clauses for an export; the date range covers [since, until)
+    filters = []
+    if since is not None:
+        filters.append(models.RideRequest.created_at >= since)
+    if until is not None:
+        filters.append(models.RideRequest.created_at < until)
+    if driver_id is not None:
+        filters.append(models.RideRequest.driver_id == driver_id)
+    if status is not None:
+        filters.append(models.RideRequest.status == status)
+    return filters
+
+
+def _column_expressions():
+    # Export column -> SQL expression, in SCHEMA order
+    ride = models.RideRequest
+    return {
+        "ride_id": ride.id,
+        # Timestamps come back as the stored text and are parsed by Arrow, a column at a time
+        "created_at": type_coerce(ride.created_at, String),
+        "departure_time": type_coerce(ride.departure_time, String),
+        "status": ride.status,
+        "user_id": ride.user_id,
+        "driver_id": ride.driver_id,
+        "driver_name": models.Driver.name,
+        "pickup": ride.pickup,
+        "destination": ride.destination,
+        "pickup_lat": ride.pickup_lat,
+        "pickup_lng": ride.pickup_lng,
+        "distance": ride.distance,
+        "fare": ride.fare,
+        "seat_fare": ride.seat_fare,
+        "participant_count": ride.participant_count,
+        # One index lookup per ride, and no GROUP BY over the joined rows
+        "participant_ids": (
+            select(func.group_concat(models.RideParticipant.user_id))
+            .where(models.RideParticipant.ride_id == ride.id)
+            .scalar_subquery()
+        ),
+    }
+
+
+def _chunk_query(columns, filters, after_id: int, limit: int):
+    ride = models.RideRequest
+    expressions = _column_expressions()
+    query = select(*(expressions[name] for name in columns))
+    if "driver_name" in columns:
+        query = query.outerjoin(models.Driver, models.Driver.id == ride.driver_id)
+    return query.where(ride.id > after_id, *filters).order_by(ride.id).limit(limit)
+
+
+def _record_batch(schema: pa.Schema, rows) -> pa.RecordBatch:
+    arrays = []
+    for field, values in zip(schema, zip(*rows)):
+        if field.name in _TIMESTAMPS:
+            arrays.append(pa.array(values, pa.string()).cast(field.type))
+        elif field.name == "participant_ids":
+            # group_concat gives "3,8,21", or NULL for a ride nobody joined
+            ids = pc.split_pattern(pa.array(values, pa.string()), ",").cast(PARTICIPANT_IDS)
+            arrays.append(ids.fill_null(pa.scalar([], type=PARTICIPANT_IDS)))
+        else:
+            arrays.append(pa.array(values, field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def iter_ride_batches(db: Session, since: Optional[datetime] = None, until: Optional[datetime] = None,
+                      driver_id: Optional[int] = None, status: Optional[str] = None,
+                      chunk_rows: int = EXPORT_CHUNK_ROWS, columns: Optional[List[str]] = None,
+                      router=shards) -> Iterator[pa.RecordBatch]:
+    """Yield the matching rides as record batches of up to ``chunk_rows``, shard by shard in id order.
+
+    ``columns`` picks some of the SCHEMA columns (ride_id first); the
+    default is all of them. Shard 0 is read with ``db``; the other shards
+    with sessions of their own, read-only if ``db`` is.
+    """
+    columns = SCHEMA.names if columns is None else columns
+    schema = pa.schema([SCHEMA.field(name) for name in columns])
+    filters = ride_filters(since, until, driver_id, status)
+    read_only = db.info.get(READ_ONLY_KEY, False)
+    for index in range(len(router)):
+        shard_db = db if index == 0 else router.session(index, read_only)
+        try:
+            after_id = 0
+            while True:
+                # Plain rows from the connection; the ORM would build a row object per ride
+                rows = shard_db.connection().execute(_chunk_query(columns, filters, after_id, chunk_rows)).all()
+                if not rows:
+                    break
+                yield _record_batch(schema, rows)
+                after_id = rows[-1][0]
+                if len(rows) < chunk_rows:
+                    break
+        finally:
+            if shard_db is not db:
+                shard_db.close()
+
+
+def _open_writer(sink, format: str):
+    if format == "parquet":
+        # One row group per batch
+        return pq.ParquetWriter(sink, SCHEMA, compression=PARQUET_COMPRESSION)
+    if format == "arrow":
+        return pa.ipc.new_stream(sink, SCHEMA)
+    raise ValueError(f"Unknown export format: {format}")
+
+
+def write_rides(sink, batches: Iterable[pa.RecordBatch], format: str = "parquet") -> int:
+    """Write batches to ``sink`` (a path or a writable file) as they arrive; returns the rows written."""
+    rows = 0
+    writer = _open_writer(sink, format)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+
+class _ChunkSink:
+    # Write-only file that hands out what was written since the last drain
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_rides(batches: Iterable[pa.RecordBatch], format: str = "parquet") -> Iterator[bytes]:
+    # The export as response body chunks, one per batch written
+    sink = _ChunkSink()
+    writer = _open_writer(pa.PythonFile(sink, mode="w"), format)
+    try:
+        for batch in batches:
+            writer.write_batch(batch)
+            data = sink.drain()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+EARNINGS_MERGE_PARTIALS = 32  # Per-batch partial sums held before they are merged into one
+
+
+class EarningsSummary:
+    """Completed rides, fare and distance per driver (and day, if ``by_day``), fed a batch at a time.
+
+    Each batch is grouped on its own and dropped; the partial sums are
+    merged whenever EARNINGS_MERGE_PARTIALS of them pile up, so memory
+    follows the number of drivers (and days), not the number of rides.
+    """
+
+    _PARTIAL_SUMS = [("ride_id_count", "sum"), ("fare_sum", "sum"), ("distance_sum", "sum")]
+
+    def __init__(self, by_day: bool = False):
+        self.by_day = by_day
+        self.keys = ["driver_id", "day"] if by_day else ["driver_id"]
+        self._partials: List[pa.Table] = []
+
+    def add(self, batch: pa.RecordBatch):
+        table = pa.Table.from_batches([batch])
+        table = table.filter(pc.and_(pc.equal(table["status"], "completed"), pc.is_valid(table["driver_id"])))
+        if self.by_day:
+            table = table.append_column("day", table["created_at"].cast(pa.date32()))
+        partial = table.group_by(self.keys).aggregate([("ride_id", "count"), ("fare", "sum"), ("distance", "sum")])
+        self._partials.append(partial.select(self._partial_columns))
+        if len(self._partials) >= EARNINGS_MERGE_PARTIALS:
+            merged = self._merged().rename_columns(
+                {"ride_id_count_sum": "ride_id_count", "fare_sum_sum": "fare_sum", "distance_sum_sum": "distance_sum"}
+            )
+            self._partials = [merged.select(self._partial_columns)]
+
+    @property
+    def _partial_columns(self) -> List[str]:
+        return [*self.keys, "ride_id_count", "fare_sum", "distance_sum"]
+
+    def _merged(self) -> pa.Table:
+        return pa.concat_tables(self._partials).group_by(self.keys).aggregate(self._PARTIAL_SUMS)
+
+    def table(self) -> pa.Table:
+        keys = self.keys
+        if not self._partials:
+            return pa.table({
+                **{key: pa.array([], pa.int64() if key == "driver_id" else pa.date32()) for key in keys},
+                "rides": pa.array([], pa.int64()),
+                "total_fare": pa.array([], pa.float64()),
+                "total_distance": pa.array([], pa.float64()),
+            })
+        summary = self._merged().rename_columns({"ride_id_count_sum": "rides", "fare_sum_sum": "total_fare", "distance_sum_sum": "total_distance"})
+        return summary.select([*keys, "rides", "total_fare", "total_distance"]).sort_by([(key, "ascending") for key in keys])
+
+
+def earnings_summary(batches: Iterable[pa.RecordBatch], by_day: bool = False) -> pa.Table:
+    """Completed rides, fare and distance per driver (and day, if ``by_day``); see EarningsSummary."""
+    summary = EarningsSummary(by_day)
+    for batch in batches:
+        summary.add(batch)
+    return summary.table()
@@ -0,0 +1,133 @@
+# ride_history.py
+import heapq
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import case, func, select, union
+from sqlalchemy.orm import Session, aliased
+
+import models
+
+ROLE_CREATOR = "creator"
+ROLE_PARTICIPANT = "participant"
+
+
+def get_user_ride_history(
+    db: Session,
+    user_id: int,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    role: Optional[str] = None,
+    changed_since: Optional[int] = None,
+):
+    """Return every ride a user created or joined in a single query.
+
+    Each entry carries the user's role on the ride, the time they joined
+    (None for the creator), creator/driver details and the participant
+    count. Rides are ordered newest first with the id as a tie breaker so
+    repeated calls always return the same order. ``since``/``until`` limit
+    the history window on the ride creation time. ``changed_since`` keeps
+    only rides whose row, or the user's participation row, has a sync
+    version newer than the given one.
+    """
+    # Ids of every ride the user is involved in; both branches are served
+    # by the user_id indexes instead of scanning ride_requests
+    created_ids = select(models.RideRequest.id.label("ride_id")).where(
+        models.RideRequest.user_id == user_id
+    )
+    joined_ids = select(models.RideParticipant.ride_id.label("ride_id")).where(
+        models.RideParticipant.user_id == user_id
+    )
+    if role == ROLE_CREATOR:
+        ride_ids = created_ids
+    elif role == ROLE_PARTICIPANT:
+        ride_ids = joined_ids
+    else:
+        ride_ids = union(created_ids, joined_ids)
+    ride_ids = ride_ids.subquery()
+
+    # The user's own participation row, if any, gives us joined_at
+    own_participation = aliased(models.RideParticipant)
+    creator = aliased(models.User)
+
+    participants_count = (
+        select(func.count(models.RideParticipant.id))
+        .where(models.RideParticipant.ride_id == models.RideRequest.id)
+        .correlate(models.RideRequest)
+        .scalar_subquery()
+    )
+    role_column = case(
+        (models.RideRequest.user_id == user_id, ROLE_CREATOR),
+        else_=ROLE_PARTICIPANT,
+    )
+
+    query = (
+        db.query(
+            models.RideRequest,
+            role_column.label("role"),
+            own_participation.created_at.label("joined_at"),
+            participants_count.label("participants_count"),
+            creator.id.label("creator_id"),
+            creator.name.label("creator_name"),
+            creator.email.label("creator_email"),
+            models.Driver.id.label("driver_id"),
+            models.Driver.name.label("driver_name"),
+            models.Driver.vehicle_type.label("vehicle_type"),
+            models.Driver.vehicle_number.label("vehicle_number"),
+        )
+        .join(ride_ids, ride_ids.c.ride_id == models.RideRequest.id)
+        .outerjoin(creator, creator.id == models.RideRequest.user_id)
+        .outerjoin(models.Driver, models.Driver.id == models.RideRequest.driver_id)
+        .outerjoin(
+            own_participation,
+            (own_participation.ride_id == models.RideRequest.id)
+            & (own_participation.user_id == user_id),
+        )
+    )
+
+    # Apply the history window if provided
+    if since is not None:
+        query = query.filter(models.RideRequest.created_at >= since)
+    if until is not None:
+        query = query.filter(models.RideRequest.created_at < until)
+    if changed_since is not None:
+        query = query.filter(
+            (models.RideRequest.version > changed_since)
+            | (own_participation.version > changed_since)
+        )
+
+    query = query.order_by(
+        models.RideRequest.created_at.desc(), models.RideRequest.id.desc()
+    )
+
+    history = []
+    for row in query:
+        ride = row.RideRequest
+        history.append({
+            "ride": ride,
+            "role": row.role,
+            "joined_at": row.joined_at,
+            "participants_count": row.participants_count,
+            "creator": {
+                "id": row.creator_id,
+                "name": row.creator_name,
+                "email": row.creator_email
+            } if row.creator_id is not None else None,
+            "driver": {
+                "id": row.driver_id,
+                "name": row.driver_name,
+                "vehicle_type": row.vehicle_type,
+                "vehicle_number": row.vehicle_number
+            } if row.driver_id is not None else None,
+        })
+
+    return history
+
+
+def merge_histories(histories):
+    """Merge histories read from several shards, keeping the newest-first order."""
+    if len(histories) == 1:
+        return histories[0]
+    return list(heapq.merge(
+        *histories, key=lambda entry: (entry["ride"].created_at, entry["ride"].id), reverse=True
+    ))
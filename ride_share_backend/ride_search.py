@@ -0,0 +1,257 @@
+# ride_search.py
+# Full-text search over ride history.
+#
+# Every database holding ride_requests (the main one and each ride shard)
+# has an FTS5 table, ride_search, with one document per ride: its pickup
+# and destination, the creator's name, the driver's name and vehicle
+# number, and a "people" column of tokens for everyone on the ride (u<id>
+# for the creator and the participants, d<id> for the driver). A search
+# puts the caller's token in the MATCH, so narrowing it to the caller's
+# own rides is an intersection in the index rather than a filter over
+# every ride that matches the words.
+#
+# Documents are rewritten in the write path: after each flush, rides whose
+# text, driver or participants changed are indexed again with one
+# INSERT ... SELECT, and deleted rides are removed, in the same
+# transaction as the change. (Triggers cannot do this on ride shards, whose
+# users and drivers live in the attached main database.) Databases without
+# the table are left alone; ensure_search_index() creates it and indexes
+# the rides already there.
+#
+# Each write adds a small segment to the index. FTS5 would merge segments
+# as part of the committing transaction; here that is switched off and
+# merge_loop() does the merging in the background instead, so ride writes
+# don't pay for it.
+import asyncio
+import re
+import weakref
+from typing import List, Optional
+
+from sqlalchemy import DateTime, bindparam, event, inspect, text
+from sqlalchemy.orm import Session
+
+from sharding import shards
+import models
+
+SEARCH_TABLE = "ride_search"
+MAX_QUERY_TERMS = 8
+REBUILD_CHUNK_ROWS = 50_000
+MERGE_INTERVAL_SECONDS = 5.0
+MERGE_PAGES = 1000  # Index pages merged per shard per pass
+
+# bm25 weights: pickup, destination, creator_name, driver_name, vehicle_number, people
+RANK_WEIGHTS = (4.0, 4.0, 2.0, 2.0, 1.0, 0.0)
+TEXT_COLUMNS = "{pickup destination creator_name driver_name vehicle_number}"
+
+# Ride attributes that appear in its document
+_INDEXED_ATTRS = ("pickup", "destination", "user_id", "driver_id")
+
+# Engine -> whether its database has the search table; checked once per engine
+_has_index = weakref.WeakKeyDictionary()
+
+_DOCUMENTS = f"""
+    INSERT INTO {SEARCH_TABLE} (rowid, pickup, destination, creator_name, driver_name, vehicle_number, people)
+    SELECT r.id, r.pickup, r.destination, u.name, d.name, d.vehicle_number,
+           'u' || r.user_id || COALESCE(' d' || r.driver_id, '') || COALESCE(
+               (SELECT ' ' || group_concat('u' || p.user_id, ' ') FROM ride_participants p WHERE p.ride_id = r.id), ''
+           )
+    FROM ride_requests r
+    LEFT JOIN users u ON u.id = r.user_id
+    LEFT JOIN drivers d ON d.id = r.driver_id
+"""
+
+
+def search_index_exists(bind) -> bool:
+    engine = getattr(bind, "engine", bind)
+    exists = _has_index.get(engine)
+    if exists is None:
+        exists = SEARCH_TABLE in inspect(engine).get_table_names()
+        _has_index[engine] = exists
+    return exists
+
+
+def ensure_search_index(bind):
+    """Create the search table if missing and index the rides already in the database."""
+    engine = getattr(bind, "engine", bind)
+    _has_index.pop(engine, None)
+    if search_index_exists(engine):
+        return
+    with engine.begin() as conn:
+        # Prefix indexes make the "term"* queries below index lookups
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+            "pickup, destination, creator_name, driver_name, vehicle_number, people, "
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        ))
+        conn.execute(
+            text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('rank', :rank)"),
+            {"rank": f"bm25({', '.join(str(weight) for weight in RANK_WEIGHTS)})"}
+        )
+        # Segments are merged by merge_loop(); FTS5 still merges on its own past 16 per level
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('automerge', 0)"))
+    _has_index[engine] = True
+    rebuild(engine)
+
+
+def drop_search_index(bind):
+    engine = getattr(bind, "engine", bind)
+    with engine.begin() as conn:
+        conn.execute(text(f"DROP TABLE IF EXISTS {SEARCH_TABLE}"))
+    _has_index[engine] = False
+
+
+def rebuild(bind, chunk_rows: int = REBUILD_CHUNK_ROWS) -> int:
+    """Index every ride again, a chunk of ids per transaction; returns the rides indexed."""
+    engine = getattr(bind, "engine", bind)
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {SEARCH_TABLE}"))
+    indexed = 0
+    after_id = 0
+    while True:
+        with engine.begin() as conn:
+            ids = conn.execute(
+                text("SELECT id FROM ride_requests WHERE id > :after ORDER BY id LIMIT :limit"),
+                {"after": after_id, "limit": chunk_rows}
+            ).scalars().all()
+            if not ids:
+                break
+            conn.execute(text(_DOCUMENTS + " WHERE r.id BETWEEN :first AND :last"), {"first": ids[0], "last": ids[-1]})
+        indexed += len(ids)
+        after_id = ids[-1]
+    with engine.begin() as conn:
+        # One segment per chunk so far; queries would have to look in every one
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"))
+    return indexed
+
+
+def merge_segments(bind, pages: int = MERGE_PAGES):
+    engine = getattr(bind, "engine", bind)
+    if not search_index_exists(engine):
+        return
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}, rank) VALUES ('merge', :pages)"), {"pages": pages})
+
+
+async def merge_loop(router=shards, interval: float = MERGE_INTERVAL_SECONDS):
+    # Background task: merge index segments written since the last pass, off the event loop
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        for shard in router:
+            try:
+                await loop.run_in_executor(None, merge_segments, shard.engine)
+            except Exception as e:
+                print(f"Error merging the search index: {str(e)}")
+
+
+def match_query(query: str, people_token: Optional[str] = None) -> Optional[str]:
+    """FTS5 query for the words in ``query``, each matched as a prefix; None if there are none.
+
+    Only the text columns are searched; ``people_token`` (e.g. "u12")
+    further limits the matches to that person's rides.
+    """
+    terms = re.findall(r"\w+", query.lower())[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    words = " ".join(f'"{term}"*' for term in terms)
+    match = f"{TEXT_COLUMNS} : ({words})"
+    if people_token is not None:
+        match = f'people : "{people_token}" AND {match}'
+    return match
+
+
+def people_token(user_type: str, id: int) -> str:
+    return f"d{id}" if user_type == "driver" else f"u{id}"
+
+
+def search(db: Session, query: str, people: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """The best ``limit`` rides on this database matching ``query``, best first.
+
+    ``people`` is a token from people_token(); without it every ride is
+    searched.
+    """
+    match = match_query(query, people)
+    if match is None or not search_index_exists(db.connection()):
+        return []
+    rows = db.execute(
+        text(f"""
+            SELECT r.id, r.pickup, r.destination, r.status, r.created_at, r.departure_time,
+                   s.creator_name, s.driver_name, s.vehicle_number, s.rank
+            FROM {SEARCH_TABLE} s
+            JOIN ride_requests r ON r.id = s.rowid
+            WHERE {SEARCH_TABLE} MATCH :match
+            ORDER BY s.rank, r.id DESC
+            LIMIT :limit
+        """).columns(created_at=DateTime, departure_time=DateTime),
+        {"match": match, "limit": limit}
+    ).mappings().all()
+    return [
+        {
+            "id": row["id"],
+            "pickup": row["pickup"],
+            "destination": row["destination"],
+            "status": row["status"],
+            "created_at": row["created_at"],
+            "departure_time": row["departure_time"],
+            "creator_name": row["creator_name"],
+            "driver_name": row["driver_name"],
+            "vehicle_number": row["vehicle_number"],
+            # bm25 is lower for better matches; scores are higher-is-better
+            "score": -row["rank"]
+        }
+        for row in rows
+    ]
+
+
+def update_documents(db: Session, changed=(), removed=()):
+    """Re-index ``changed`` rides and drop ``removed`` ones, for rides written with bulk SQL."""
+    changed, removed = set(changed), set(removed)
+    changed -= removed
+    if changed or removed:
+        _index_rides(db, changed, removed)
+
+
+def _index_rides(session: Session, changed, removed):
+    conn = session.connection()
+    if not search_index_exists(conn):
+        return
+    ids = list(changed | removed)
+    if ids:
+        conn.execute(
+            text(f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": ids}
+        )
+    if changed:
+        conn.execute(
+            text(_DOCUMENTS + " WHERE r.id IN :ids").bindparams(bindparam("ids", expanding=True)),
+            {"ids": list(changed)}
+        )
+
+
+@event.listens_for(Session, "after_flush")
+def _index_flushed(session: Session, flush_context):
+    changed, removed = set(), set()
+    for obj in session.new:
+        if isinstance(obj, models.RideRequest):
+            changed.add(obj.id)
+        elif isinstance(obj, models.RideParticipant):
+            changed.add(obj.ride_id)
+    for obj in session.dirty:
+        if isinstance(obj, models.RideRequest):
+            state = inspect(obj)
+            if any(state.attrs[attr].history.has_changes() for attr in _INDEXED_ATTRS):
+                changed.add(obj.id)
+        elif isinstance(obj, models.RideParticipant):
+            # A participant moved to another ride (pooling merges) leaves the old one too
+            moved_from = inspect(obj).attrs.ride_id.history.deleted
+            if moved_from:
+                changed.update([*moved_from, obj.ride_id])
+    for obj in session.deleted:
+        if isinstance(obj, models.RideRequest):
+            removed.add(obj.id)
+        elif isinstance(obj, models.RideParticipant):
+            changed.add(obj.ride_id)
+    changed.discard(None)
+    changed -= removed
+    if changed or removed:
+        _index_rides(session, changed, removed)
@@ -0,0 +1,134 @@
+# ride_state.py
+# Central state machine for RideRequest.status.
+#
+# Every status change goes through transition(), which validates it against
+# TRANSITIONS and queues a RideEvent on the session. The queued events are
+# written with one batched INSERT just before the session commits, so the
+# log entry lands in the same transaction as the state change. The status
+# write is a compare-and-swap on the status the ride was read with, so of
+# two requests racing on the same ride (an accept and a pooling merge, say)
+# only one moves it and logs an event.
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import event, insert, inspect, select, update
+from sqlalchemy.orm import Session
+
+from sharding import region_for
+import models
+
+PENDING = "pending"
+ACCEPTED = "accepted"
+COMPLETED = "completed"
+MERGED = "merged"  # Folded into another ride's shared trip by the pooling optimizer
+DELETED = "deleted"  # Only ever seen in the event log; the row is removed
+
+# event name -> (statuses it may start from, status it moves to)
+# None as a start status means the ride is being created
+TRANSITIONS = {
+    "create": ({None}, PENDING),
+    "accept": ({PENDING}, ACCEPTED),
+    "release": ({ACCEPTED}, PENDING),  # Driver cancels; the ride goes back to the pool
+    "complete": ({ACCEPTED}, COMPLETED),
+    "merge": ({PENDING}, MERGED),
+    "delete": ({PENDING, ACCEPTED, COMPLETED, MERGED}, DELETED),
+}
+
+_PENDING_EVENTS_KEY = "pending_ride_events"
+
+
+class InvalidTransition(Exception):
+    def __init__(self, ride_id, event_name, from_status):
+        self.ride_id = ride_id
+        self.event_name = event_name
+        self.from_status = from_status
+        super().__init__(f"Cannot {event_name} ride {ride_id} while it is {from_status}")
+
+
+def can_transition(ride: models.RideRequest, event_name: str) -> bool:
+    allowed_from, _ = TRANSITIONS[event_name]
+    return _current_status(ride) in allowed_from
+
+
+def transition(
+    db: Session,
+    ride: models.RideRequest,
+    event_name: str,
+    actor_type: Optional[str] = None,
+    actor_id: Optional[int] = None,
+    driver_id: Optional[int] = None,
+):
+    """Move a ride through ``event_name`` and queue the event for the log.
+
+    Raises InvalidTransition if the ride's current status does not allow
+    the event, or if the ride's row no longer has the status it was read
+    with. ``driver_id`` records the driver involved, if any.
+    """
+    if event_name not in TRANSITIONS:
+        raise ValueError(f"Unknown ride event: {event_name}")
+
+    allowed_from, to_status = TRANSITIONS[event_name]
+    from_status = _current_status(ride)
+    if from_status not in allowed_from:
+        raise InvalidTransition(ride.id, event_name, from_status)
+
+    if from_status is not None:
+        # Takes the write lock; a delete keeps the status, the row goes with the commit
+        swapped = db.execute(
+            update(models.RideRequest)
+            .where(models.RideRequest.id == ride.id, models.RideRequest.status == from_status)
+            .values(status=from_status if to_status == DELETED else to_status)
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+        if not swapped:
+            # Changed (or deleted) by another transaction since it was read
+            current = db.execute(select(models.RideRequest.status).where(models.RideRequest.id == ride.id)).scalar()
+            raise InvalidTransition(ride.id, event_name, current or DELETED)
+
+    if to_status != DELETED:
+        ride.status = to_status
+
+    db.info.setdefault(_PENDING_EVENTS_KEY, []).append({
+        "ride": ride,
+        "ride_id": ride.id,  # None until a new ride is flushed
+        "event": event_name,
+        "from_status": from_status,
+        "to_status": to_status,
+        "actor_type": actor_type,
+        "actor_id": actor_id,
+        "driver_id": driver_id if driver_id is not None else ride.driver_id,
+        "region": region_for(ride.pickup_lat, ride.pickup_lng),
+        "created_at": datetime.utcnow(),
+    })
+
+
+def _current_status(ride: models.RideRequest):
+    # A ride that has never been flushed is being created, whatever its default status
+    state = inspect(ride)
+    if state.transient or state.pending:
+        return None
+    return ride.status
+
+
+@event.listens_for(Session, "before_commit")
+def _write_pending_events(session: Session):
+    pending = session.info.pop(_PENDING_EVENTS_KEY, None)
+    if not pending:
+        return
+
+    # Assign ids to rides created in this transaction
+    session.flush()
+    rows = []
+    for entry in pending:
+        ride = entry.pop("ride")
+        if entry["ride_id"] is None:
+            entry["ride_id"] = ride.id
+        rows.append(entry)
+    session.execute(insert(models.RideEvent), rows)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_pending_events(session: Session, transaction):
+    # Rolled back, or closed without committing
+    if transaction.parent is None:
+        session.info.pop(_PENDING_EVENTS_KEY, None)
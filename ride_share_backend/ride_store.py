@@ -0,0 +1,515 @@
+# ride_store.py
+# In-process store of open rides (pending or accepted, not merged) for the
+# hot read paths, /available-rides and /match-rides.
+#
+# Scalar fields live in parallel arrays (one row per ride, removed by
+# swapping the last row into the hole); places are interned to integer
+# ids and creators are kept as __slots__ records, so a ride costs a few
+# hundred bytes instead of a full ORM object. The store is
+# hydrated from the database at startup and kept current write-through:
+# a flush listener records what each transaction changed and the changes
+# are applied once it commits. A background catch-up using the sync
+# versions (sync.py) picks up writes made by other processes. Each ride
+# shard (sharding.py) has a store of its own.
+#
+# Write-through only covers this process, so the catch-up keeps its own
+# watermark, synced_version: every row committed up to it, by any process,
+# has been loaded. Catch-up reads from there, and it is the sync token
+# handed out with store reads (stable_version).
+import asyncio
+import sys
+import threading
+from array import array
+from contextlib import contextmanager
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from sharding import shard_of
+import models
+import sync
+
+OPEN_STATUSES = ("pending", "accepted")
+REFRESH_INTERVAL_SECONDS = 5.0
+
+_STATUS_CODES = {"pending": 0, "accepted": 1}
+_STATUS_NAMES = ("pending", "accepted")
+_NO_TIME = -(2 ** 63)
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NAN = float("nan")
+
+_OPS_KEY = "open_ride_ops"
+_RIDE_FIELDS = (
+    "id", "user_id", "driver_id", "pickup", "destination", "created_at", "departure_time",
+    "participant_count", "status", "distance", "fare", "seat_fare", "pickup_lat", "pickup_lng",
+    "merged_into_id", "version",
+)
+_RIDE_COLUMNS = [getattr(models.RideRequest, name) for name in _RIDE_FIELDS]
+
+
+def _to_micros(value: Optional[datetime]) -> int:
+    if value is None:
+        return _NO_TIME
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_micros(value: int) -> Optional[datetime]:
+    if value == _NO_TIME:
+        return None
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _or_nan(value: Optional[float]) -> float:
+    return _NAN if value is None else value
+
+
+def _is_open(ride) -> bool:
+    return ride.status in OPEN_STATUSES and ride.merged_into_id is None
+
+
+class RideSnapshot:
+    """The ride columns the store needs, copied from an ORM object at flush time."""
+
+    __slots__ = _RIDE_FIELDS
+
+    def __init__(self, ride: models.RideRequest):
+        for name in _RIDE_FIELDS:
+            setattr(self, name, getattr(ride, name))
+
+
+class UserInfo:
+    __slots__ = ("name", "email")
+
+    def __init__(self, name, email):
+        self.name = name
+        self.email = email
+
+
+class OpenRideStore:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self._reset()
+
+    def _reset(self):
+        # Columns, one entry per row
+        self._ids = array("q")
+        self._user_ids = array("q")
+        self._driver_ids = array("q")   # 0 when unassigned
+        self._created = array("q")      # microseconds since the epoch
+        self._departure = array("q")    # _NO_TIME when not set
+        self._seats = array("l")        # ride.participant_count
+        self._pickup = array("l")       # interned place ids
+        self._destination = array("l")
+        self._pickup_lat = array("d")   # NaN when not set
+        self._pickup_lng = array("d")
+        self._fare = array("d")
+        self._seat_fare = array("d")
+        self._distance = array("d")
+        self._status = array("b")
+        self._versions = array("q")     # Sync version of the row, to drop stale updates
+        self._participants: List[tuple] = []  # Participant user ids, excluding the creator
+
+        self._row: Dict[int, int] = {}
+        self._available = array("q")    # Sorted ids of pending, unassigned rides
+        self._routes: Dict[tuple, list] = {}  # (pickup id, destination id) -> ride ids
+        self._place_ids: Dict[str, int] = {}
+        self._places: List[str] = []
+        self._users: Dict[int, UserInfo] = {}
+
+        self.version = 0  # Newest version applied, by write-through or catch-up
+        self.synced_version = 0  # Every row committed up to here was loaded from the database
+
+    def _columns(self):
+        return (
+            self._ids, self._user_ids, self._driver_ids, self._created, self._departure, self._seats,
+            self._pickup, self._destination, self._pickup_lat, self._pickup_lng, self._fare,
+            self._seat_fare, self._distance, self._status, self._versions, self._participants,
+        )
+
+    def __len__(self):
+        return len(self._ids)
+
+    # Loading
+
+    def hydrate(self, db: Session, chunk_size: int = 50000):
+        """Replace the contents with the open rides in the database."""
+        version = sync.current_version(db)
+        conn = db.connection()
+        open_filter = (models.RideRequest.status.in_(OPEN_STATUSES), models.RideRequest.merged_into_id.is_(None))
+
+        participants = {}
+        for ride_id, user_id in conn.execute(
+            select(models.RideParticipant.ride_id, models.RideParticipant.user_id)
+            .join(models.RideRequest, models.RideRequest.id == models.RideParticipant.ride_id)
+            .where(*open_filter)
+        ):
+            participants.setdefault(ride_id, []).append(user_id)
+
+        rides = conn.execution_options(yield_per=chunk_size).execute(
+            select(*_RIDE_COLUMNS).where(*open_filter).order_by(models.RideRequest.id)
+        )
+        with self._lock:
+            self._reset()
+            for batch in rides.partitions():
+                for ride in batch:
+                    self._append(ride, tuple(participants.get(ride.id, ())))
+            self._load_users(conn, set(self._user_ids))
+            self.version = self.synced_version = version
+            self.ready = True
+        db.rollback()
+
+    def catch_up(self, db: Session):
+        """Apply rows changed since the last hydrate or catch-up, and their tombstones.
+
+        Write-through versions are not a starting point: rows other
+        processes committed below them would be skipped.
+        """
+        if not self.ready:
+            return self.hydrate(db)
+        version = sync.current_version(db)
+        since = self.synced_version
+        if version <= since:
+            db.rollback()
+            return
+        conn = db.connection()
+        changed = conn.execute(select(*_RIDE_COLUMNS).where(models.RideRequest.version > since)).all()
+        ride_ids = [ride.id for ride in changed if _is_open(ride)]
+        participants = {}
+        for start in range(0, len(ride_ids), 500):
+            for ride_id, user_id in conn.execute(
+                select(models.RideParticipant.ride_id, models.RideParticipant.user_id)
+                .where(models.RideParticipant.ride_id.in_(ride_ids[start:start + 500]))
+            ):
+                participants.setdefault(ride_id, []).append(user_id)
+        deleted = sync.tombstones_since(db, since, models.SyncTombstone.kind == sync.TOMBSTONE_RIDE)
+
+        with self._lock:
+            # Write-through may have applied newer versions of these rows meanwhile
+            for ride in changed:
+                if _is_open(ride):
+                    self._upsert(ride, tuple(participants.get(ride.id, ())))
+                elif not self._is_stale(ride):
+                    self._remove(ride.id)
+            for ride_id in deleted:
+                self._remove(ride_id)
+            self._load_users(conn, {ride.user_id for ride in changed})
+            self.version = max(self.version, version)
+            self.synced_version = version
+        db.rollback()
+
+    def _load_users(self, conn, user_ids):
+        missing = [user_id for user_id in user_ids if user_id not in self._users]
+        for start in range(0, len(missing), 500):
+            for user_id, name, email in conn.execute(
+                select(models.User.id, models.User.name, models.User.email)
+                .where(models.User.id.in_(missing[start:start + 500]))
+            ):
+                self._users[user_id] = UserInfo(name, email)
+
+    def _intern(self, place: Optional[str]) -> int:
+        place = place or ""
+        place_id = self._place_ids.get(place)
+        if place_id is None:
+            place_id = self._place_ids[place] = len(self._places)
+            self._places.append(place)
+        return place_id
+
+    # Row maintenance; callers hold the lock
+
+    def _is_stale(self, ride) -> bool:
+        row = self._row.get(ride.id)
+        return row is not None and (ride.version or 0) < self._versions[row]
+
+    def _upsert(self, ride, participant_ids=None):
+        row = self._row.get(ride.id)
+        if row is not None:
+            if (ride.version or 0) < self._versions[row]:
+                return
+            if participant_ids is None:
+                participant_ids = self._participants[row]
+            self._remove(ride.id)
+        self._append(ride, participant_ids or ())
+
+    def _append(self, ride, participant_ids):
+        ride_id = ride.id
+        self._row[ride_id] = len(self._ids)
+        self._ids.append(ride_id)
+        self._user_ids.append(ride.user_id)
+        self._driver_ids.append(ride.driver_id or 0)
+        self._created.append(_to_micros(ride.created_at))
+        self._departure.append(_to_micros(ride.departure_time))
+        self._seats.append(ride.participant_count or 1)
+        pickup, destination = self._intern(ride.pickup), self._intern(ride.destination)
+        self._pickup.append(pickup)
+        self._destination.append(destination)
+        self._pickup_lat.append(_or_nan(ride.pickup_lat))
+        self._pickup_lng.append(_or_nan(ride.pickup_lng))
+        self._fare.append(_or_nan(ride.fare))
+        self._seat_fare.append(_or_nan(ride.seat_fare))
+        self._distance.append(_or_nan(ride.distance))
+        self._status.append(_STATUS_CODES[ride.status])
+        self._versions.append(ride.version or 0)
+        self._participants.append(participant_ids)
+
+        self._routes.setdefault((pickup, destination), []).append(ride_id)
+        if ride.status == "pending" and not ride.driver_id:
+            available = self._available
+            # Hydration appends in id order; only write-through needs the search
+            if not available or available[-1] < ride_id:
+                available.append(ride_id)
+            else:
+                available.insert(bisect_left(available, ride_id), ride_id)
+
+    def _remove(self, ride_id):
+        row = self._row.pop(ride_id, None)
+        if row is None:
+            return
+        route = self._routes.get((self._pickup[row], self._destination[row]))
+        if route is not None:
+            route.remove(ride_id)
+            if not route:
+                del self._routes[(self._pickup[row], self._destination[row])]
+        index = bisect_left(self._available, ride_id)
+        if index < len(self._available) and self._available[index] == ride_id:
+            del self._available[index]
+
+        # Move the last row into the hole
+        last = len(self._ids) - 1
+        columns = self._columns()
+        if row != last:
+            for column in columns:
+                column[row] = column[last]
+            self._row[self._ids[row]] = row
+        for column in columns:
+            column.pop()
+
+    # Write-through
+
+    def apply(self, ops, bind):
+        """Apply the changes recorded for one committed transaction."""
+        with self._lock:
+            new_creators = set()
+            for op in ops:
+                kind = op[0]
+                if kind == "ride":
+                    ride = op[1]
+                    if _is_open(ride):
+                        self._upsert(ride)
+                        new_creators.add(ride.user_id)
+                    elif not self._is_stale(ride):
+                        self._remove(ride.id)
+                    self.version = max(self.version, ride.version or 0)
+                elif kind == "delete":
+                    self._remove(op[1])
+                elif kind == "version":
+                    self.version = max(self.version, op[1] or 0)
+                else:
+                    row = self._row.get(op[1])
+                    if row is not None:
+                        ids = self._participants[row]
+                        if kind == "join":
+                            self._participants[row] = ids + (op[2],)
+                        elif op[2] in ids:
+                            ids = list(ids)
+                            ids.remove(op[2])
+                            self._participants[row] = tuple(ids)
+            if any(user_id not in self._users for user_id in new_creators):
+                with bind.connect() as conn:
+                    self._load_users(conn, new_creators)
+
+    # Reads
+
+    def available_rides(self, limit: Optional[int] = None) -> list:
+        # Same shape as the database-backed /available-rides
+        with self._lock:
+            ids = self._available if limit is None else self._available[:limit]
+            return [self._available_entry(self._row[ride_id]) for ride_id in ids]
+
+    def _available_entry(self, row):
+        creator = self._users.get(self._user_ids[row])
+        return {
+            "id": self._ids[row],
+            "pickup": self._places[self._pickup[row]],
+            "destination": self._places[self._destination[row]],
+            "departure_time": _from_micros(self._departure[row]),
+            "created_at": _from_micros(self._created[row]),
+            "creator_name": creator.name if creator else "Unknown",
+            "creator_email": creator.email if creator else "Unknown",
+            "participant_count": len(self._participants[row]) + 1,  # +1 for the creator
+            "status": _STATUS_NAMES[self._status[row]]
+        }
+
+    def match_rides(self, pickup: str, destination: str, user_id: int) -> list:
+        # Same shape as the database-backed /match-rides
+        with self._lock:
+            key = (self._place_ids.get(pickup), self._place_ids.get(destination))
+            result = []
+            for ride_id in sorted(self._routes.get(key, ())):
+                row = self._row[ride_id]
+                if self._user_ids[row] == user_id:
+                    continue  # Exclude current user's rides
+                creator = self._users.get(self._user_ids[row])
+                result.append({
+                    "id": ride_id,
+                    "user_name": creator.name if creator else "Unknown",
+                    "pickup": pickup,
+                    "destination": destination,
+                    "departure_time": _from_micros(self._departure[row]),
+                    "participant_count": self._seats[row],
+                    "has_joined": user_id in self._participants[row]
+                })
+            return result
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by the store: containers and their contents."""
+        with self._lock:
+            int_size = sys.getsizeof(2 ** 40)
+            size = sum(sys.getsizeof(column) for column in self._columns())
+            size += sum(sys.getsizeof(ids) + int_size * len(ids) for ids in self._participants if ids)
+            size += sys.getsizeof(self._row) + 2 * int_size * len(self._row)
+            size += sys.getsizeof(self._available)
+            size += sys.getsizeof(self._routes)
+            size += sum(sys.getsizeof(key) + sys.getsizeof(ids) for key, ids in self._routes.items())
+            size += sys.getsizeof(self._place_ids) + sys.getsizeof(self._places)
+            size += sum(sys.getsizeof(place) for place in self._places)
+            size += sys.getsizeof(self._users)
+            size += sum(
+                sys.getsizeof(user) + sys.getsizeof(user.name) + sys.getsizeof(user.email)
+                for user in self._users.values()
+            )
+            return size
+
+
+open_rides = OpenRideStore()  # The main database's rides
+_stores: Dict[int, OpenRideStore] = {0: open_rides}
+
+
+def store_for(shard: int) -> OpenRideStore:
+    store = _stores.get(shard)
+    if store is None:
+        store = _stores.setdefault(shard, OpenRideStore())
+    return store
+
+
+def stores_ready(indexes) -> bool:
+    return all(store_for(index).ready for index in indexes)
+
+
+def stable_version(indexes) -> int:
+    # A token valid for every store read: the oldest of their database watermarks
+    return min(store_for(index).synced_version for index in indexes)
+
+
+def available_rides(indexes, limit: Optional[int] = None) -> list:
+    # Shard k's ride ids are all below shard k+1's, so shard order is id order
+    result = []
+    for index in sorted(indexes):
+        remaining = None if limit is None else limit - len(result)
+        if remaining == 0:
+            break
+        result.extend(store_for(index).available_rides(remaining))
+    return result
+
+
+def match_rides(indexes, pickup: str, destination: str, user_id: int) -> list:
+    result = []
+    for index in sorted(indexes):
+        result.extend(store_for(index).match_rides(pickup, destination, user_id))
+    return result
+
+
+def ride_rows(conn, ride_ids) -> list:
+    # The columns the store keeps, for rides written with bulk SQL
+    return conn.execute(select(*_RIDE_COLUMNS).where(models.RideRequest.id.in_(list(ride_ids)))).all()
+
+
+@contextmanager
+def bulk_write(shard: int, bind):
+    """Keep a shard's store current through writes made with bulk SQL.
+
+    The flush listener below never sees those. Yields a list: append the
+    ops the listener would have recorded, commit inside the block, and
+    they are applied when it exits without an error.
+    """
+    store = store_for(shard)
+    ops = []
+    yield ops
+    if ops and store.ready:
+        store.apply(ops, bind)
+
+
+@event.listens_for(Session, "after_flush")
+def _record_changes(session: Session, flush_context):
+    store = store_for(shard_of(session))
+    if not store.ready:
+        return
+    ops = []
+    for obj in session.new:
+        if isinstance(obj, models.RideRequest):
+            ops.append(("ride", RideSnapshot(obj)))
+        elif isinstance(obj, models.RideParticipant):
+            ops.append(("join", obj.ride_id, obj.user_id))
+    for obj in session.dirty:
+        if isinstance(obj, models.RideRequest):
+            ops.append(("ride", RideSnapshot(obj)))
+        elif isinstance(obj, models.RideParticipant):
+            old_ride = inspect(obj).attrs.ride_id.history.deleted
+            if old_ride and old_ride[0] is not None and old_ride[0] != obj.ride_id:
+                ops.append(("leave", old_ride[0], obj.user_id))
+                ops.append(("join", obj.ride_id, obj.user_id))
+    for obj in session.deleted:
+        if isinstance(obj, models.RideRequest):
+            ops.append(("delete", obj.id))
+        elif isinstance(obj, models.RideParticipant):
+            ops.append(("leave", obj.ride_id, obj.user_id))
+    if not ops:
+        return
+    ops.append(("version", sync.pending_version(session)))
+    session.info.setdefault(_OPS_KEY, []).extend(ops)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session: Session):
+    ops = session.info.pop(_OPS_KEY, None)
+    if ops is None:
+        return
+    store_for(shard_of(session)).apply(ops, session.get_bind())
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_changes(session: Session, transaction):
+    # Rolled back, or closed without committing
+    if transaction.parent is None:
+        session.info.pop(_OPS_KEY, None)
+
+
+async def refresh_loop(SessionLocal, store: OpenRideStore = open_rides, interval: float = REFRESH_INTERVAL_SECONDS):
+    # Background task: pick up writes this process did not make
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, _catch_up, SessionLocal, store)
+        except Exception as e:
+            print(f"Error refreshing open ride store: {str(e)}")
+
+
+def hydrate_open_rides(SessionLocal, store: OpenRideStore = open_rides):
+    db = SessionLocal()
+    try:
+        store.hydrate(db)
+    finally:
+        db.close()
+
+
+def _catch_up(SessionLocal, store):
+    db = SessionLocal()
+    try:
+        store.catch_up(db)
+    finally:
+        db.close()
@@ -0,0 +1,72 @@
+# routes/admin.py
+# Bulk maintenance (maintenance.py) for the accounts in security.ADMIN_EMAILS:
+# purging abandoned rides, deleting a rider's account and releasing a
+# driver's accepted rides. Each runs in chunked transactions on every shard,
+# which on a large table takes minutes, so the endpoints queue a background
+# job and answer 202 with it; GET /admin/jobs/{job_id} reports its outcome.
+from datetime import timedelta
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.orm import Session
+
+from database import get_db
+from dependencies import get_current_principal
+from security import Principal
+import maintenance
+import models
+
+router = APIRouter(tags=["admin"])
+
+def _require_admin(principal: Principal):
+    if not principal.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only administrators can run maintenance operations"
+        )
+
+@router.post("/admin/rides/purge-stale", status_code=status.HTTP_202_ACCEPTED)
+def purge_stale_rides(
+    older_than_hours: float = Query(maintenance.STALE_PENDING_HOURS, gt=0, description="Delete pending rides requested longer ago than this"),
+    chunk_rows: int = Query(maintenance.BULK_CHUNK_ROWS, ge=1, le=10000, description="Rows per transaction"),
+    current_user: Principal = Depends(get_current_principal)
+):
+    _require_admin(current_user)
+    return maintenance.jobs.submit(
+        "purge-stale", maintenance.purge_stale_rides, timedelta(hours=older_than_hours), chunk_rows=chunk_rows
+    )
+
+@router.delete("/admin/users/{user_id}", status_code=status.HTTP_202_ACCEPTED)
+def delete_user_account(
+    user_id: int,
+    chunk_rows: int = Query(maintenance.BULK_CHUNK_ROWS, ge=1, le=10000, description="Rows per transaction"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    _require_admin(current_user)
+    if db.get(models.User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return maintenance.jobs.submit("delete-user", maintenance.delete_user_account, user_id, chunk_rows=chunk_rows)
+
+@router.post("/admin/drivers/{driver_id}/release-rides", status_code=status.HTTP_202_ACCEPTED)
+def release_driver_rides(
+    driver_id: int,
+    deactivate: bool = Query(True, description="Mark the driver unavailable first"),
+    chunk_rows: int = Query(maintenance.BULK_CHUNK_ROWS, ge=1, le=10000, description="Rows per transaction"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_db)
+):
+    _require_admin(current_user)
+    if db.get(models.Driver, driver_id) is None:
+        raise HTTPException(status_code=404, detail="Driver not found")
+    return maintenance.jobs.submit(
+        "release-driver", maintenance.release_driver_rides, driver_id, deactivate, chunk_rows=chunk_rows
+    )
+
+@router.get("/admin/jobs/{job_id}")
+def get_job(job_id: int, current_user: Principal = Depends(get_current_principal)):
+    # "queued", "running", "done" (with the operation's result) or "failed" (with the error)
+    _require_admin(current_user)
+    job = maintenance.jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
@@ -0,0 +1,39 @@
+# routes/analytics.py
+# Where demand exceeds supply: the heatmap and surge signal, answered from
+# the rollups in analytics.py rather than by scanning the ride tables.
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy.orm import Session
+
+from dependencies import get_current_principal, get_read_db
+from security import Principal
+import analytics
+
+router = APIRouter(tags=["analytics"])
+
+@router.get("/analytics/heatmap")
+def get_heatmap(
+    minutes: int = Query(60, ge=5, le=analytics.MAX_WINDOW_MINUTES, description="Length of the window ending now"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Per-region requests, accepts, open rides, idle drivers and surge over the window
+    result = analytics.heatmap(db, minutes)
+    return {
+        "window_minutes": minutes,
+        "bucket_seconds": analytics.BUCKET_SECONDS,
+        "from": result["from"],
+        "to": result["to"],
+        "regions": result["regions"],
+    }
+
+@router.get("/analytics/surge")
+def get_surge(
+    lat: Optional[float] = Query(None, description="Pickup latitude"),
+    lng: Optional[float] = Query(None, description="Pickup longitude"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # The surge multiplier for a pickup point's region
+    return analytics.surge_for(db, lat, lng)
@@ -0,0 +1,140 @@
+# routes/auth.py
+# Registration, login and token endpoints
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.security import OAuth2PasswordRequestForm
+from sqlalchemy.orm import Session
+
+from database import get_db
+from dependencies import get_current_principal
+from schemas import UserCreate, DriverCreate, Token, RefreshRequest
+from security import Principal, decode_token, issue_tokens, revoke, verify_password, get_password_hash, REFRESH_TOKEN
+import models
+
+router = APIRouter(tags=["auth"])
+
+# Helper functions
+def authenticate_user(db, email: str, password: str):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        return False
+    if not verify_password(password, user.password):
+        return False
+    return user
+
+def authenticate_driver(db, email: str, password: str):
+    driver = db.query(models.Driver).filter(models.Driver.email == email).first()
+    if not driver:
+        return False
+    if not verify_password(password, driver.password):
+        return False
+    return driver
+
+@router.post("/register", response_model=dict)
+def register_user(user: UserCreate, db: Session = Depends(get_db)):
+    # Check if email already exists
+    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Create new user
+    hashed_password = get_password_hash(user.password)
+    db_user = models.User(
+        name=user.name,
+        email=user.email,
+        password=hashed_password
+    )
+    db.add(db_user)
+    db.commit()
+    db.refresh(db_user)
+    
+    return {"message": "User registered successfully"}
+
+@router.post("/register/driver", response_model=dict)
+def register_driver(driver: DriverCreate, db: Session = Depends(get_db)):
+    # Check if email already exists
+    db_driver = db.query(models.Driver).filter(models.Driver.email == driver.email).first()
+    if db_driver:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    # Check if license number already exists
+    db_driver = db.query(models.Driver).filter(models.Driver.license_number == driver.license_number).first()
+    if db_driver:
+        raise HTTPException(status_code=400, detail="License number already registered")
+    
+    # Check if vehicle number already exists
+    db_driver = db.query(models.Driver).filter(models.Driver.vehicle_number == driver.vehicle_number).first()
+    if db_driver:
+        raise HTTPException(status_code=400, detail="Vehicle number already registered")
+    
+    # Create new driver
+    hashed_password = get_password_hash(driver.password)
+    db_driver = models.Driver(
+        name=driver.name,
+        email=driver.email,
+        password=hashed_password,
+        license_number=driver.license_number,
+        vehicle_type=driver.vehicle_type,
+        vehicle_number=driver.vehicle_number
+    )
+    db.add(db_driver)
+    db.commit()
+    db.refresh(db_driver)
+    
+    return {"message": "Driver registered successfully"}
+
+@router.post("/login/user", response_model=Token)
+def login_user(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    user = authenticate_user(db, form_data.username, form_data.password)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return issue_tokens(user.id, user.email, "user")
+
+@router.post("/login/driver", response_model=Token)
+def login_driver(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+    driver = authenticate_driver(db, form_data.username, form_data.password)
+    if not driver:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Incorrect email or password",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    return issue_tokens(driver.id, driver.email, "driver")
+
+@router.post("/token/refresh", response_model=Token)
+def refresh_access_token(request: RefreshRequest, db: Session = Depends(get_db)):
+    # Exchange a refresh token for a new token pair without re-entering the password
+    principal = decode_token(request.refresh_token, expected_type=REFRESH_TOKEN)
+    account = None
+    if principal is not None and principal.id is not None:
+        # Refresh tokens outlive the deleted-account list; the account must still exist
+        model = models.Driver if principal.is_driver else models.User
+        account = db.query(model.id).filter(model.id == principal.id, model.email == principal.email).first()
+    if account is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid or expired refresh token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # Refresh tokens are single use: rotate it
+    revoke(principal)
+    return issue_tokens(principal.id, principal.email, principal.user_type)
+
+@router.post("/logout")
+def logout(
+    request: Optional[RefreshRequest] = None,
+    principal: Principal = Depends(get_current_principal)
+):
+    # Revoke the access token used for this call and, if given, the refresh token
+    revoke(principal)
+    if request is not None:
+        refresh_principal = decode_token(request.refresh_token, expected_type=REFRESH_TOKEN)
+        if refresh_principal is not None and refresh_principal.email == principal.email:
+            revoke(refresh_principal)
+    return {"message": "Logged out successfully"}
@@ -0,0 +1,568 @@
+# routes/driver.py
+# Driver endpoints: finding, accepting and finishing rides, availability
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy import func, or_, update
+from sqlalchemy.orm import Session
+from starlette import status as starlette_status
+
+from database import get_db
+from dependencies import get_current_principal, get_current_user, get_read_db, get_ride_db
+from outbox import notify_ride_accepted
+from ride_state import transition
+from security import Principal
+from sharding import shards, sync_state
+import models
+import ride_store
+import sync
+
+router = APIRouter(tags=["driver"])
+
+# A driver is busy while they have an accepted ride, on whichever shard it is.
+# drivers.is_available is only the driver's own switch. Ride writes happen on
+# the ride's shard, and a commit spanning the shard file and the attached main
+# database is not atomic across the two files under WAL, so an accept first
+# claims the driver on the main database (busy_ride_id, set only if unset) and
+# commits, then accepts the ride on its shard. Two accepts by one driver on
+# different shards cannot both claim. Completing or releasing the ride clears
+# the claim; a claim left behind by a crash between the two commits, or by a
+# ride released or deleted by maintenance, is cleared once its ride no longer
+# holds the driver and CLAIM_GRACE_SECONDS have passed.
+
+CLAIM_GRACE_SECONDS = 60  # Longer than any accept takes between its two commits
+
+def _active_ride_count(db: Session, driver_id: int) -> int:
+    # ``db`` is a main database session; every shard is counted
+    return sum(shards.fan_out(db, lambda shard_db: shard_db.query(models.RideRequest).filter(
+        models.RideRequest.driver_id == driver_id,
+        models.RideRequest.status == "accepted"
+    ).count()))
+
+def _ride_holds_driver(ride_id: int, driver_id: int) -> bool:
+    shard_db = shards.session(shards.shard_for_ride(ride_id))
+    try:
+        return shard_db.query(models.RideRequest.id).filter(
+            models.RideRequest.id == ride_id,
+            models.RideRequest.driver_id == driver_id,
+            models.RideRequest.status == "accepted"
+        ).first() is not None
+    finally:
+        shard_db.close()
+
+def _clear_stale_claim(db: Session, driver_id: int):
+    ride_id, since = db.query(models.Driver.busy_ride_id, models.Driver.busy_since).filter(
+        models.Driver.id == driver_id
+    ).one()
+    if ride_id is None or (since is not None and since > datetime.utcnow() - timedelta(seconds=CLAIM_GRACE_SECONDS)):
+        return
+    if _ride_holds_driver(ride_id, driver_id):
+        return
+    _release_claim(db, driver_id, ride_id)
+
+def _claim_driver(db: Session, driver_id: int, ride_id: int) -> bool:
+    # ``db`` is a main database session; the claim is committed before the ride is touched
+    _clear_stale_claim(db, driver_id)
+    claimed = db.execute(
+        update(models.Driver)
+        .where(
+            models.Driver.id == driver_id,
+            models.Driver.is_available.is_(True),
+            models.Driver.busy_ride_id.is_(None)
+        )
+        .values(busy_ride_id=ride_id, busy_since=datetime.utcnow())
+    ).rowcount == 1
+    db.commit()
+    return claimed
+
+def _release_claim(db: Session, driver_id: int, ride_id: int):
+    db.execute(
+        update(models.Driver)
+        .where(models.Driver.id == driver_id, models.Driver.busy_ride_id == ride_id)
+        .values(busy_ride_id=None, busy_since=None)
+    )
+    db.commit()
+
+@router.get("/available-rides")
+async def get_available_rides(
+    since_version: Optional[int] = Query(None, description="sync_version from a previous response; only changes after it are returned"),
+    limit: Optional[int] = Query(None, ge=1, description="Return at most this many rides, oldest first"),
+    lat: Optional[float] = Query(None, description="Driver latitude; only rides on the shards around it are listed"),
+    lng: Optional[float] = Query(None, description="Driver longitude"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can view available rides"
+        )
+    
+    # Rides are sharded by region; without a position every shard is listed
+    indexes = shards.shards_near(lat, lng)
+    
+    # Full lists come from the in-memory open ride store without touching the database
+    if since_version is None and ride_store.stores_ready(indexes):
+        return {
+            "available_rides": ride_store.available_rides(indexes, limit),
+            "sync_version": ride_store.stable_version(indexes),
+            "delta": False
+        }
+    
+    # Read the clocks first so changes committed during the queries are picked up next time
+    sync_version, delta = sync_state(db, since_version, indexes)
+    
+    def shard_rides(shard_db):
+        # Get all pending rides that haven't been assigned to any driver
+        query = shard_db.query(models.RideRequest).filter(
+            models.RideRequest.status == "pending",
+            models.RideRequest.driver_id.is_(None)
+        )
+        if delta:
+            query = query.filter(models.RideRequest.version > since_version)
+        else:
+            query = query.order_by(models.RideRequest.id).limit(limit)
+        available_rides = query.all()
+        
+        result = []
+        for ride in available_rides:
+            # Get the creator's details
+            creator = shard_db.query(models.User).filter(models.User.id == ride.user_id).first()
+            
+            # Get current participants count
+            participants_count = shard_db.query(models.RideParticipant).filter(
+                models.RideParticipant.ride_id == ride.id
+            ).count()
+            
+            result.append({
+                "id": ride.id,
+                "pickup": ride.pickup,
+                "destination": ride.destination,
+                "departure_time": ride.departure_time,
+                "created_at": ride.created_at,
+                "creator_name": creator.name if creator else "Unknown",
+                "creator_email": creator.email if creator else "Unknown",
+                "participant_count": participants_count + 1,  # +1 for the creator
+                "status": ride.status
+            })
+        
+        removed = set()
+        if delta:
+            # Changed rides that are no longer open, plus deleted rides
+            taken = shard_db.query(models.RideRequest.id).filter(
+                models.RideRequest.version > since_version,
+                or_(models.RideRequest.status != "pending", models.RideRequest.driver_id.isnot(None))
+            )
+            removed = {ride_id for ride_id, in taken}
+            removed |= sync.tombstones_since(shard_db, since_version, models.SyncTombstone.kind == sync.TOMBSTONE_RIDE)
+        return result, removed
+    
+    # Shard k's ride ids are all below shard k+1's, so shard order keeps the id order
+    result, removed = [], set()
+    for shard_result, shard_removed in shards.fan_out(db, shard_rides, indexes):
+        result.extend(shard_result)
+        removed |= shard_removed
+    if not delta and limit is not None:
+        result = result[:limit]
+    
+    response = {"available_rides": result, "sync_version": sync_version, "delta": delta}
+    if delta:
+        response["removed"] = sorted(removed - {ride["id"] for ride in result})
+    return response
+
+@router.post("/accept-ride/{ride_id}")
+async def accept_ride(
+    ride_id: int,
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_ride_db),
+    home_db: Session = Depends(get_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can accept rides"
+        )
+    
+    # Check if ride exists and is available
+    ride = db.query(models.RideRequest).filter(
+        models.RideRequest.id == ride_id,
+        models.RideRequest.status == "pending",
+        models.RideRequest.driver_id.is_(None)
+    ).first()
+    
+    if not ride:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ride not found or not available"
+        )
+    
+    # Check if driver is available: switched on and not claimed by another ride
+    if not _claim_driver(home_db, current_user.id, ride_id):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Driver is not available"
+        )
+    
+    try:
+        # Rides accepted before claims existed hold no claim, so count them too
+        if _active_ride_count(home_db, current_user.id) > 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Driver is not available"
+            )
+        
+        # Assign ride to driver; the driver is busy until it is completed or cancelled
+        ride.driver_id = current_user.id
+        transition(db, ride, "accept", actor_type="driver", actor_id=current_user.id)
+        
+        # Tell the riders; delivered by the outbox worker after the commit
+        notify_ride_accepted(db, ride, current_user)
+        
+        db.commit()
+    except Exception:
+        db.rollback()
+        _release_claim(home_db, current_user.id, ride_id)
+        raise
+    
+    # Get creator details
+    creator = db.query(models.User).filter(models.User.id == ride.user_id).first()
+    
+    # Get participants count
+    participants_count = db.query(models.RideParticipant).filter(
+        models.RideParticipant.ride_id == ride.id
+    ).count()
+    
+    return {
+        "message": "Ride accepted successfully",
+        "ride": {
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "created_at": ride.created_at,
+            "departure_time": ride.departure_time,
+            "status": ride.status,
+            "creator": {
+                "id": creator.id,
+                "name": creator.name,
+                "email": creator.email
+            },
+            "participant_count": participants_count + 1,  # +1 for the creator
+            "driver": {
+                "id": current_user.id,
+                "name": current_user.name,
+                "vehicle_type": current_user.vehicle_type,
+                "vehicle_number": current_user.vehicle_number
+            }
+        }
+    }
+
+@router.post("/complete-ride/{ride_id}")
+async def complete_ride(
+    ride_id: int,
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_ride_db),
+    home_db: Session = Depends(get_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can complete rides"
+        )
+    
+    # Check if ride exists and is assigned to this driver
+    ride = db.query(models.RideRequest).filter(
+        models.RideRequest.id == ride_id,
+        models.RideRequest.driver_id == current_user.id,
+        models.RideRequest.status == "accepted"
+    ).first()
+    
+    if not ride:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ride not found or not assigned to you"
+        )
+    
+    # Mark ride as completed; without an accepted ride the driver is available again
+    transition(db, ride, "complete", actor_type="driver", actor_id=current_user.id)
+    
+    db.commit()
+    _release_claim(home_db, current_user.id, ride.id)
+    
+    return {
+        "message": "Ride marked as completed successfully",
+        "ride_id": ride.id,
+        "driver_id": current_user.id
+    }
+
+@router.post("/cancel-ride/{ride_id}")
+async def cancel_ride(
+    ride_id: int,
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_ride_db),
+    home_db: Session = Depends(get_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can cancel rides"
+        )
+    
+    # Check if ride exists and is assigned to this driver
+    ride = db.query(models.RideRequest).filter(
+        models.RideRequest.id == ride_id,
+        models.RideRequest.driver_id == current_user.id,
+        models.RideRequest.status == "accepted"
+    ).first()
+    
+    if not ride:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ride not found or not assigned to you"
+        )
+    
+    # Put the ride back to pending; without an accepted ride the driver is available again
+    transition(db, ride, "release", actor_type="driver", actor_id=current_user.id, driver_id=current_user.id)
+    ride.driver_id = None  # Remove driver assignment
+    
+    db.commit()
+    _release_claim(home_db, current_user.id, ride.id)
+    
+    return {
+        "message": "Ride cancelled successfully and made available for other drivers",
+        "ride_id": ride.id,
+        "driver_id": current_user.id
+    }
+
+@router.get("/driver/my-rides")
+async def get_driver_rides(
+    status: Optional[str] = Query(None, description="Filter by ride status (pending, accepted, completed)"),
+    since_version: Optional[int] = Query(None, description="sync_version from a previous response; only changes after it are returned"),
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=starlette_status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can view their rides"
+        )
+    
+    # Validate the status filter if provided
+    if status and status not in ["pending", "accepted", "completed"]:
+        raise HTTPException(
+            status_code=starlette_status.HTTP_400_BAD_REQUEST,
+            detail="Invalid status. Must be one of: pending, accepted, completed"
+        )
+    
+    # Read the clocks first so changes committed during the queries are picked up next time
+    sync_version, delta = sync_state(db, since_version)
+    
+    driver_info = {
+        "id": current_user.id,
+        "name": current_user.name,
+        "vehicle_type": current_user.vehicle_type,
+        "vehicle_number": current_user.vehicle_number
+    }
+    
+    def shard_rides(shard_db):
+        # Base query for driver's rides
+        query = shard_db.query(models.RideRequest).filter(
+            models.RideRequest.driver_id == current_user.id
+        )
+        changed_ids = set()
+        if delta:
+            changed_ids = {ride_id for ride_id, in query.with_entities(models.RideRequest.id).filter(models.RideRequest.version > since_version)}
+            query = query.filter(models.RideRequest.version > since_version)
+        
+        # Apply status filter if provided
+        if status:
+            query = query.filter(models.RideRequest.status == status)
+        
+        # Get all rides
+        rides = query.all()
+        
+        result = []
+        for ride in rides:
+            # Get the creator's details
+            creator = shard_db.query(models.User).filter(models.User.id == ride.user_id).first()
+            
+            # Get current participants count
+            participants_count = shard_db.query(models.RideParticipant).filter(
+                models.RideParticipant.ride_id == ride.id
+            ).count()
+            
+            # Get participants details
+            participants = []
+            participants_query = (
+                shard_db.query(models.RideParticipant, models.User)
+                .join(models.User, models.User.id == models.RideParticipant.user_id)
+                .filter(models.RideParticipant.ride_id == ride.id)
+            )
+            
+            for participant, user in participants_query:
+                participants.append({
+                    "id": user.id,
+                    "name": user.name,
+                    "email": user.email,
+                    "joined_at": participant.created_at
+                })
+            
+            ride_info = {
+                "id": ride.id,
+                "pickup": ride.pickup,
+                "destination": ride.destination,
+                "departure_time": ride.departure_time,
+                "created_at": ride.created_at,
+                "status": ride.status,
+                "distance": ride.distance,
+                "fare": {
+                    "amount": ride.fare,
+                    "per_seat": ride.seat_fare
+                },
+                "creator": {
+                    "id": creator.id,
+                    "name": creator.name,
+                    "email": creator.email
+                },
+                "participant_count": participants_count + 1,  # +1 for the creator
+                "participants": participants,
+                "driver": driver_info,
+                "can_complete": ride.status == "accepted",
+                "can_cancel": ride.status == "accepted"
+            }
+            result.append(ride_info)
+        
+        if not delta:
+            return result, None, None
+        
+        # Counts cover every ride of this driver, not just the changed ones
+        counts_query = shard_db.query(models.RideRequest.status, func.count(models.RideRequest.id)).filter(
+            models.RideRequest.driver_id == current_user.id
+        )
+        if status:
+            counts_query = counts_query.filter(models.RideRequest.status == status)
+        counts = dict(counts_query.group_by(models.RideRequest.status).all())
+        
+        # Released or deleted rides, and changed rides the status filter now excludes
+        removed = sync.tombstones_since(shard_db, since_version, models.SyncTombstone.driver_id == current_user.id)
+        removed |= changed_ids
+        return result, counts, removed
+    
+    # The driver's rides may be on any shard
+    result, counts, removed = [], defaultdict(int), set()
+    for shard_result, shard_counts, shard_removed in shards.fan_out(db, shard_rides):
+        result.extend(shard_result)
+        if delta:
+            for ride_status, count in shard_counts.items():
+                counts[ride_status] += count
+            removed |= shard_removed
+    
+    # Sort rides by status and creation time
+    status_order = {"pending": 0, "accepted": 1, "completed": 2}
+    result.sort(key=lambda x: (status_order.get(x["status"], 3), x["created_at"]))
+    
+    if not delta:
+        return {
+            "total_rides": len(result),
+            "active_rides": sum(1 for ride in result if ride["status"] == "accepted"),
+            "completed_rides": sum(1 for ride in result if ride["status"] == "completed"),
+            "rides": result,
+            "sync_version": sync_version,
+            "delta": False
+        }
+    
+    return {
+        "total_rides": sum(counts.values()),
+        "active_rides": counts.get("accepted", 0),
+        "completed_rides": counts.get("completed", 0),
+        "rides": result,
+        "removed": sorted(removed - {ride["id"] for ride in result}),
+        "sync_version": sync_version,
+        "delta": True
+    }
+
+@router.get("/driver/availability")
+async def check_driver_availability(
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can check availability"
+        )
+    
+    # Check if driver has any active rides, on any shard
+    active_rides = _active_ride_count(db, current_user.id)
+    
+    return {
+        "is_available": current_user.is_available and active_rides == 0,
+        "has_active_rides": active_rides > 0,
+        "active_rides_count": active_rides,
+        "can_toggle_availability": active_rides == 0  # Can only toggle if no active rides
+    }
+
+@router.post("/driver/toggle-availability")
+async def toggle_driver_availability(
+    current_user: models.Driver = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    # Verify that the current user is a driver
+    if not isinstance(current_user, models.Driver):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can toggle availability"
+        )
+    
+    # Check if driver has any active rides, on any shard
+    _clear_stale_claim(db, current_user.id)
+    active_rides = _active_ride_count(db, current_user.id)
+    
+    # Toggle availability, unless an accept has claimed the driver meanwhile
+    toggled = active_rides == 0 and db.execute(
+        update(models.Driver)
+        .where(models.Driver.id == current_user.id, models.Driver.busy_ride_id.is_(None))
+        .values(is_available=~models.Driver.is_available)
+    ).rowcount == 1
+    if not toggled:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot toggle availability while having active rides"
+        )
+    db.commit()
+    db.refresh(current_user)
+    
+    return {
+        "message": "Availability status updated successfully",
+        "is_available": current_user.is_available
+    }
+
+@router.get("/driver/stats")
+def get_driver_stats(
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can view their stats"
+        )
+    
+    # Kept up to date by projections.projections_loop
+    stats = db.get(models.DriverStats, current_user.id)
+    return {
+        "driver_id": current_user.id,
+        "accepted_rides": stats.accepted_count if stats else 0,
+        "completed_rides": stats.completed_count if stats else 0,
+        "released_rides": stats.released_count if stats else 0,
+        "last_activity_at": stats.last_event_at if stats else None
+    }
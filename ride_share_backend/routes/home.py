@@ -0,0 +1,266 @@
+# routes/home.py
+# One-request bootstrap endpoints for the driver and rider home screens.
+# Each gathers everything its screen shows with a handful of batched
+# queries on one session, instead of the app calling several endpoints
+# and then fetching details ride by ride. The ride queries run on every
+# ride shard (sharding.py) in parallel and are merged. The handlers are
+# plain functions, so FastAPI runs these blocking queries in its threadpool
+# rather than on the event loop.
+import math
+from collections import defaultdict
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from sqlalchemy.orm import Session
+
+from dependencies import get_current_principal, get_read_db
+from ride_history import get_user_ride_history, merge_histories, ROLE_CREATOR
+from security import Principal
+from sharding import KM_PER_DEGREE, NEARBY_RADIUS_KM, shard_of, shards, sync_state
+import models
+
+router = APIRouter(tags=["home"])
+
+
+def _participants_by_ride(db: Session, ride_ids):
+    # Participant details for many rides in one query
+    participants = defaultdict(list)
+    if not ride_ids:
+        return participants
+    rows = (
+        db.query(models.RideParticipant.ride_id, models.RideParticipant.created_at, models.User.id, models.User.name, models.User.email)
+        .join(models.User, models.User.id == models.RideParticipant.user_id)
+        .filter(models.RideParticipant.ride_id.in_(ride_ids))
+    )
+    for ride_id, joined_at, user_id, name, email in rows:
+        participants[ride_id].append({"id": user_id, "name": name, "email": email, "joined_at": joined_at})
+    return participants
+
+
+def _users_by_id(db: Session, user_ids):
+    if not user_ids:
+        return {}
+    return {user.id: user for user in db.query(models.User).filter(models.User.id.in_(user_ids))}
+
+
+@router.get("/driver/home")
+def get_driver_home(
+    lat: Optional[float] = Query(None, description="Driver latitude; nearby rides are sorted by pickup distance"),
+    lng: Optional[float] = Query(None, description="Driver longitude"),
+    nearby_limit: int = Query(20, ge=1, le=100),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can view the driver home screen"
+        )
+
+    # Read the clocks first so the client can continue with delta refreshes
+    sync_version, _ = sync_state(db, None)
+
+    driver = db.get(models.Driver, current_user.id)
+    if driver is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Driver not found")
+
+    # The driver's rides may be on any shard; nearby rides only on the shards around the driver
+    nearby_shards = set(shards.shards_near(lat, lng))
+    located = lat is not None and lng is not None
+    if located:
+        lat_span = NEARBY_RADIUS_KM / KM_PER_DEGREE
+        lng_scale = max(math.cos(math.radians(lat)), 0.01)
+        lng_span = lat_span / lng_scale
+
+    def shard_rides(shard_db):
+        # All of the driver's rides in one query
+        my_rides = shard_db.query(models.RideRequest).filter(
+            models.RideRequest.driver_id == current_user.id
+        ).all()
+
+        nearby_rides = []
+        if shard_of(shard_db) in nearby_shards:
+            # Open rides, nearest first when the driver's position is known
+            open_query = shard_db.query(models.RideRequest).filter(
+                models.RideRequest.status == "pending",
+                models.RideRequest.driver_id.is_(None)
+            )
+            if located:
+                dlat = models.RideRequest.pickup_lat - lat
+                dlng = (models.RideRequest.pickup_lng - lng) * lng_scale
+                open_query = open_query.filter(
+                    models.RideRequest.pickup_lat.between(lat - lat_span, lat + lat_span),
+                    models.RideRequest.pickup_lng.between(lng - lng_span, lng + lng_span)
+                ).order_by(dlat * dlat + dlng * dlng)
+            else:
+                open_query = open_query.order_by(models.RideRequest.created_at.desc())
+            nearby_rides = open_query.limit(nearby_limit).all()
+
+        # Creators and participants of every listed ride, two queries in total
+        rides = my_rides + nearby_rides
+        creators = _users_by_id(shard_db, {ride.user_id for ride in rides})
+        participants = _participants_by_ride(shard_db, [ride.id for ride in rides])
+        return my_rides, nearby_rides, creators, participants
+
+    my_rides, nearby_rides, creators, participants = [], [], {}, defaultdict(list)
+    for shard_mine, shard_nearby, shard_creators, shard_participants in shards.fan_out(db, shard_rides):
+        my_rides += shard_mine
+        nearby_rides += shard_nearby
+        creators.update(shard_creators)
+        participants.update(shard_participants)
+    if len(shards) > 1:
+        if located:
+            nearby_rides.sort(key=lambda ride: (ride.pickup_lat - lat) ** 2 + ((ride.pickup_lng - lng) * lng_scale) ** 2)
+        else:
+            nearby_rides.sort(key=lambda ride: ride.created_at, reverse=True)
+        nearby_rides = nearby_rides[:nearby_limit]
+
+    # The counts come from the same rows
+    counts = defaultdict(int)
+    for ride in my_rides:
+        counts[ride.status] += 1
+    active_count = counts["accepted"]
+
+    driver_info = {
+        "id": driver.id,
+        "name": driver.name,
+        "vehicle_type": driver.vehicle_type,
+        "vehicle_number": driver.vehicle_number
+    }
+
+    mine = []
+    for ride in my_rides:
+        creator = creators.get(ride.user_id)
+        mine.append({
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "departure_time": ride.departure_time,
+            "created_at": ride.created_at,
+            "status": ride.status,
+            "distance": ride.distance,
+            "fare": {
+                "amount": ride.fare,
+                "per_seat": ride.seat_fare
+            },
+            "creator": {
+                "id": creator.id,
+                "name": creator.name,
+                "email": creator.email
+            } if creator else None,
+            "participant_count": len(participants[ride.id]) + 1,  # +1 for the creator
+            "participants": participants[ride.id],
+            "driver": driver_info,
+            "can_complete": ride.status == "accepted",
+            "can_cancel": ride.status == "accepted"
+        })
+
+    # Same order as /driver/my-rides: active first, then by creation time
+    status_order = {"pending": 0, "accepted": 1, "completed": 2}
+    mine.sort(key=lambda x: (status_order.get(x["status"], 3), x["created_at"]))
+
+    nearby = []
+    for ride in nearby_rides:
+        creator = creators.get(ride.user_id)
+        ride_info = {
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "departure_time": ride.departure_time,
+            "created_at": ride.created_at,
+            "creator_name": creator.name if creator else "Unknown",
+            "creator_email": creator.email if creator else "Unknown",
+            "participant_count": len(participants[ride.id]) + 1,  # +1 for the creator
+            "status": ride.status,
+            "fare": {
+                "amount": ride.fare,
+                "per_seat": ride.seat_fare
+            }
+        }
+        if located:
+            ride_info["pickup_distance_km"] = round(math.hypot(
+                (ride.pickup_lat - lat) * KM_PER_DEGREE,
+                (ride.pickup_lng - lng) * KM_PER_DEGREE * math.cos(math.radians(lat))
+            ), 2)
+        nearby.append(ride_info)
+
+    return {
+        "availability": {
+            "is_available": driver.is_available and active_count == 0,  # Busy while on an accepted ride
+            "has_active_rides": active_count > 0,
+            "active_rides_count": active_count,
+            "can_toggle_availability": active_count == 0
+        },
+        "my_rides": mine,
+        "nearby_rides": nearby,
+        "dashboard": {
+            "total_rides": len(my_rides),
+            "active_rides": active_count,
+            "completed_rides": counts["completed"]
+        },
+        "sync_version": sync_version
+    }
+
+@router.get("/user/home")
+def get_user_home(
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    if current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Drivers should use /driver/home"
+        )
+
+    # Read the clocks first so the client can continue with delta refreshes
+    sync_version, _ = sync_state(db, None)
+
+    # Created and joined rides, with creator, driver and counts, in one query per shard
+    history = merge_histories(shards.fan_out(db, lambda shard_db: get_user_ride_history(shard_db, current_user.id)))
+
+    created, joined = [], []
+    counts = defaultdict(int)
+    active_ride = None
+    for entry in history:
+        ride = entry["ride"]
+        ride_info = {
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "created_at": ride.created_at,
+            "departure_time": ride.departure_time,
+            "status": ride.status,
+            "distance": ride.distance,
+            "fare": {
+                "amount": ride.fare,
+                "per_seat": ride.seat_fare
+            },
+            "is_creator": entry["role"] == ROLE_CREATOR,
+            "role": entry["role"],
+            "joined_at": entry["joined_at"],
+            "creator": entry["creator"],
+            "creator_name": entry["creator"]["name"] if entry["creator"] else "Unknown",
+            "participant_count": entry["participants_count"] + 1,  # +1 for the creator
+            "driver": entry["driver"]
+        }
+        (created if entry["role"] == ROLE_CREATOR else joined).append(ride_info)
+        counts[ride.status] += 1
+        # Newest ride still under way; history is ordered newest first
+        if active_ride is None and ride.status in ("pending", "accepted"):
+            active_ride = ride_info
+
+    return {
+        "created_rides": created,
+        "joined_rides": joined,
+        "active_ride": active_ride,
+        "dashboard": {
+            "total_rides": len(history),
+            "created_rides": len(created),
+            "joined_rides": len(joined),
+            "pending_rides": counts["pending"],
+            "accepted_rides": counts["accepted"],
+            "completed_rides": counts["completed"]
+        },
+        "sync_version": sync_version
+    }
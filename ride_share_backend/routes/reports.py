@@ -0,0 +1,95 @@
+# routes/reports.py
+# Driver earnings and ride history exports, computed from columnar batches
+# of the driver's rides (ride_export.py) instead of building every ride
+# with its participants the way /driver/my-rides does.
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session
+
+from dependencies import get_current_principal, get_read_db
+from security import Principal
+import ride_export
+
+router = APIRouter(tags=["reports"])
+
+@router.get("/driver/earnings")
+def get_driver_earnings(
+    since: Optional[datetime] = Query(None, description="Only include rides created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only include rides created before this time"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can view their earnings"
+        )
+
+    # Completed rides only; the driver and status filters run in the database
+    batches = ride_export.iter_ride_batches(
+        db, since=since, until=until, driver_id=current_user.id, status="completed", columns=ride_export.EARNINGS_COLUMNS
+    )
+    by_day = ride_export.earnings_summary(batches, by_day=True)
+
+    days = [
+        {
+            "day": row["day"],
+            "rides": row["rides"],
+            "total_fare": row["total_fare"] or 0.0,
+            "total_distance": row["total_distance"] or 0.0
+        }
+        for row in by_day.to_pylist()
+    ]
+    total_rides = sum(day["rides"] for day in days)
+    total_fare = sum(day["total_fare"] for day in days)
+    return {
+        "driver_id": current_user.id,
+        "since": since,
+        "until": until,
+        "completed_rides": total_rides,
+        "total_fare": total_fare,
+        "total_distance": sum(day["total_distance"] for day in days),
+        "average_fare": total_fare / total_rides if total_rides else None,
+        "by_day": days
+    }
+
+@router.get("/driver/rides/export")
+def export_driver_rides(
+    format: str = Query("parquet", description="parquet or arrow (Arrow IPC stream)"),
+    since: Optional[datetime] = Query(None, description="Only include rides created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only include rides created before this time"),
+    ride_status: Optional[str] = Query(None, alias="status", description="Filter by ride status (pending, accepted, completed)"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Verify that the current user is a driver
+    if not current_user.is_driver:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Only drivers can export their rides"
+        )
+
+    if format not in ride_export.FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid format. Must be one of: {', '.join(ride_export.FORMATS)}"
+        )
+
+    # Validate the status filter if provided
+    if ride_status and ride_status not in ["pending", "accepted", "completed"]:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid status. Must be one of: pending, accepted, completed"
+        )
+
+    # Streamed a batch at a time; the session stays open until the response is sent
+    batches = ride_export.iter_ride_batches(db, since=since, until=until, driver_id=current_user.id, status=ride_status)
+    return StreamingResponse(
+        ride_export.stream_rides(batches, format),
+        media_type=ride_export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="rides_driver_{current_user.id}.{format}"'}
+    )
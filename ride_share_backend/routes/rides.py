@@ -0,0 +1,531 @@
+# routes/rides.py
+# Rider-facing ride endpoints: creating, joining, browsing and deleting rides
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from dependencies import get_current_principal, get_pickup_db, get_read_db, get_ride_db, get_ride_read_db
+from outbox import notify_rider_joined
+from pooling import MAX_SEATS
+from ride_history import get_user_ride_history, merge_histories, ROLE_CREATOR, ROLE_PARTICIPANT
+from ride_state import PENDING, transition
+from schemas import RideCreate
+from security import Principal
+from sharding import shards, sync_state
+import models
+import ride_search
+import ride_store
+import sync
+
+router = APIRouter(tags=["rides"])
+
+@router.post("/join-ride/{ride_id}", response_model=dict)
+def join_ride(
+    ride_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_ride_db)
+):
+    try:
+        # Taking the version locks the database for writing, so the ride cannot be
+        # accepted, merged or filled by someone else between the checks and the commit
+        sync.transaction_version(db)
+        
+        # Check if ride exists
+        ride = db.query(models.RideRequest).filter(models.RideRequest.id == ride_id).first()
+        if not ride:
+            raise HTTPException(status_code=404, detail="Ride not found")
+        
+        # Only open rides take riders; merged, accepted and completed ones are closed
+        if ride.status != PENDING:
+            raise HTTPException(status_code=400, detail="Ride is no longer open to join")
+        
+        # Check if user is not already the creator
+        if ride.user_id == current_user.id:
+            raise HTTPException(status_code=400, detail="You cannot join your own ride")
+        
+        # Check if user has already joined this ride
+        existing_participant = db.query(models.RideParticipant).filter(
+            models.RideParticipant.ride_id == ride_id,
+            models.RideParticipant.user_id == current_user.id
+        ).first()
+        
+        if existing_participant:
+            raise HTTPException(status_code=400, detail="You have already joined this ride")
+        
+        # One car's worth of seats, the same limit pooling fills trips to
+        if ride.participant_count >= MAX_SEATS:
+            raise HTTPException(status_code=400, detail="Ride is already full")
+        
+        # Create new participant record
+        new_participant = models.RideParticipant(
+            ride_id=ride_id,
+            user_id=current_user.id
+        )
+        db.add(new_participant)
+        
+        # Increment participant count
+        ride.participant_count += 1
+        
+        # Tell the creator; delivered by the outbox worker after the commit
+        notify_rider_joined(db, ride, current_user)
+        
+        db.commit()
+        
+        return {
+            "message": "Successfully joined the ride",
+            "ride_id": ride_id,
+            "participant_count": ride.participant_count
+        }
+        
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        db.rollback()
+        print(f"Error joining ride: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to join ride: {str(e)}")
+    
+
+@router.post("/leave-ride/{ride_id}", response_model=dict)
+def leave_ride(
+    ride_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_ride_db)
+):
+    try:
+        # Check if ride exists
+        ride = db.query(models.RideRequest).filter(models.RideRequest.id == ride_id).first()
+        if not ride:
+            raise HTTPException(status_code=404, detail="Ride not found")
+        
+        # Check if user is the creator (creators can't leave their own ride)
+        if ride.user_id == current_user.id:
+            raise HTTPException(status_code=400, detail="Ride creators cannot leave their own ride")
+        
+        # Check if user has actually joined this ride
+        participant = db.query(models.RideParticipant).filter(
+            models.RideParticipant.ride_id == ride_id,
+            models.RideParticipant.user_id == current_user.id
+        ).first()
+        
+        if not participant:
+            raise HTTPException(status_code=400, detail="You haven't joined this ride")
+        
+        # Remove participant record
+        db.delete(participant)
+        
+        # Decrement participant count
+        if ride.participant_count > 1:  # Ensure we don't go below 1
+            ride.participant_count -= 1
+        
+        db.commit()
+        
+        return {
+            "message": "Successfully left the ride",
+            "ride_id": ride_id,
+            "participant_count": ride.participant_count
+        }
+        
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        db.rollback()
+        print(f"Error leaving ride: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to leave ride: {str(e)}")
+
+@router.get("/user/rides")
+async def get_user_rides(
+    since: Optional[datetime] = Query(None, description="Only include rides created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only include rides created before this time"),
+    since_version: Optional[int] = Query(None, description="sync_version from a previous response; only changes after it are returned"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Read the clocks first so changes committed during the queries are picked up next time
+    sync_version, delta = sync_state(db, since_version)
+    
+    # Created and joined rides come back from one query per shard, merged newest first
+    history = merge_histories(shards.fan_out(db, lambda shard_db: get_user_ride_history(
+        shard_db, current_user.id, since=since, until=until,
+        changed_since=since_version if delta else None
+    )))
+    
+    result = []
+    for entry in history:
+        ride = entry["ride"]
+        
+        ride_info = {
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "created_at": ride.created_at,
+            "departure_time": ride.departure_time,
+            "status": ride.status,
+            "distance": ride.distance,
+            "fare": {
+                "amount": ride.fare,
+                "per_seat": ride.seat_fare
+            },
+            "is_creator": entry["role"] == ROLE_CREATOR,
+            "role": entry["role"],
+            "joined_at": entry["joined_at"],
+            "creator": entry["creator"],
+            "participant_count": entry["participants_count"] + 1,  # +1 for the creator
+            "driver": entry["driver"]
+        }
+        result.append(ride_info)
+    
+    response = {"rides": result, "sync_version": sync_version, "delta": delta}
+    if delta:
+        # Rides deleted, left, or merged away from this user since the token
+        removed = set().union(*shards.fan_out(db, lambda shard_db: sync.tombstones_since(
+            shard_db, since_version, models.SyncTombstone.user_id == current_user.id
+        )))
+        response["removed"] = sorted(removed - {ride["id"] for ride in result})
+    return response
+
+@router.get("/user/joined-rides")
+async def get_user_joined_rides(
+    since: Optional[datetime] = Query(None, description="Only include rides created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only include rides created before this time"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    # Find all rides where the user is a participant, with joined_at from the same query, on every shard
+    history = merge_histories(shards.fan_out(db, lambda shard_db: get_user_ride_history(
+        shard_db, current_user.id, since=since, until=until, role=ROLE_PARTICIPANT
+    )))
+    
+    result = []
+    for entry in history:
+        ride = entry["ride"]
+        creator = entry["creator"]
+        
+        result.append({
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "created_at": ride.created_at,
+            "departure_time": ride.departure_time,  # Include departure time
+            "joined_at": entry["joined_at"],
+            "creator_name": creator["name"] if creator else "Unknown",
+            "participant_count": ride.participant_count,
+            "status": ride.status
+        })
+    
+    return {"rides": result}
+
+@router.get("/match-rides")
+def match_rides(
+    pickup: str,
+    destination: str,
+    lat: Optional[float] = Query(None, description="Caller latitude; only the shards around it are searched"),
+    lng: Optional[float] = Query(None, description="Caller longitude"),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    try:
+        # Rides are sharded by region; without a position every shard is searched
+        indexes = shards.shards_near(lat, lng)
+        
+        # Open rides are served from memory, without touching the database
+        if ride_store.stores_ready(indexes):
+            return {"matches": ride_store.match_rides(indexes, pickup, destination, current_user.id)}
+        
+        def shard_matches(shard_db):
+            # Find all ride requests with similar pickup and destination
+            matched_rides = shard_db.query(models.RideRequest).filter(
+                models.RideRequest.pickup == pickup,
+                models.RideRequest.destination == destination,
+                models.RideRequest.user_id != current_user.id,  # Exclude current user's rides
+                models.RideRequest.merged_into_id.is_(None)  # Merged rides live on in their shared trip
+            ).all()
+            
+            # Get user details and participation status for each ride
+            result = []
+            for ride in matched_rides:
+                user = shard_db.query(models.User).filter(models.User.id == ride.user_id).first()
+                
+                # Check if current user has joined this ride
+                has_joined = shard_db.query(models.RideParticipant).filter(
+                    models.RideParticipant.ride_id == ride.id,
+                    models.RideParticipant.user_id == current_user.id
+                ).first() is not None
+                
+                result.append({
+                    "id": ride.id,
+                    "user_name": user.name if user else "Unknown",
+                    "pickup": ride.pickup,
+                    "destination": ride.destination,
+                    "departure_time": ride.departure_time,  # Include departure time
+                    "participant_count": ride.participant_count,
+                    "has_joined": has_joined
+                })
+            return result
+        
+        return {"matches": [match for matches in shards.fan_out(db, shard_matches, indexes) for match in matches]}
+    except Exception as e:
+        print(f"Error in match_rides: {e}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to get matched rides: {str(e)}"
+        )
+
+@router.get("/rides/search")
+def search_rides(
+    q: str = Query(..., description="Words to look for in place names, creator and driver names and vehicle numbers"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_read_db)
+):
+    if ride_search.match_query(q) is None:
+        raise HTTPException(status_code=400, detail="Search query has no words")
+    
+    # Only rides the caller created, joined or drove
+    people = ride_search.people_token(current_user.user_type, current_user.id)
+    
+    # Each shard ranks its own matches; the best offset + limit of each are merged
+    wanted = offset + limit + 1
+    matches = [
+        match
+        for matches in shards.fan_out(db, lambda shard_db: ride_search.search(shard_db, q, people, wanted))
+        for match in matches
+    ]
+    matches.sort(key=lambda match: (-match["score"], -match["id"]))
+    
+    return {
+        "query": q,
+        "results": matches[offset:offset + limit],
+        "offset": offset,
+        "limit": limit,
+        "next_offset": offset + limit if len(matches) > offset + limit else None
+    }
+
+@router.post("/ride-request")
+def create_ride_request(
+    request: RideCreate,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_pickup_db)
+):
+    # Parse the departure time if provided
+    departure_time = request.departure_time
+    
+    # Make distance optional
+    distance = request.distance
+    
+    # Require manual fare input
+    if request.fare is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Fare amount is required"
+        )
+    
+    # Create new ride with default status
+    new_ride = models.RideRequest(
+        user_id=current_user.id,
+        pickup=request.pickup,
+        destination=request.destination,
+        departure_time=departure_time,
+        participant_count=1,
+        distance=distance,
+        fare=request.fare,
+        pickup_lat=request.pickup_lat,
+        pickup_lng=request.pickup_lng,
+        destination_lat=request.destination_lat,
+        destination_lng=request.destination_lng
+    )
+    db.add(new_ride)
+    transition(db, new_ride, "create", actor_type="user", actor_id=current_user.id)
+    db.commit()
+    db.refresh(new_ride)
+    
+    # Get creator details
+    creator = db.query(models.User).filter(models.User.id == current_user.id).first()
+    
+    # Get participants count
+    participants_count = db.query(models.RideParticipant).filter(
+        models.RideParticipant.ride_id == new_ride.id
+    ).count()
+    
+    # Get participants details
+    participants = []
+    participants_query = (
+        db.query(models.RideParticipant, models.User)
+        .join(models.User, models.User.id == models.RideParticipant.user_id)
+        .filter(models.RideParticipant.ride_id == new_ride.id)
+    )
+    
+    for participant, user in participants_query:
+        participants.append({
+            "id": user.id,
+            "name": user.name,
+            "email": user.email,
+            "joined_at": participant.created_at
+        })
+    
+    # Return full ride details
+    return {
+        "id": new_ride.id,
+        "pickup": new_ride.pickup,
+        "destination": new_ride.destination,
+        "departure_time": new_ride.departure_time,
+        "created_at": new_ride.created_at,
+        "status": new_ride.status,
+        "distance": new_ride.distance,
+        "fare": {
+            "amount": new_ride.fare
+        },
+        "creator": {
+            "id": creator.id,
+            "name": creator.name,
+            "email": creator.email
+        },
+        "participant_count": participants_count + 1,  # +1 for the creator
+        "participants": participants,
+        "driver": None,  # No driver assigned yet
+        "can_join": True,  # Others can join
+        "can_leave": False,  # Creator can't leave
+        "can_cancel": True  # Creator can cancel
+    }
+
+@router.get("/ride/{ride_id}")
+async def get_ride_details(
+    ride_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_ride_read_db)
+):
+    # Check if ride exists
+    ride = db.query(models.RideRequest).filter(models.RideRequest.id == ride_id).first()
+    if not ride:
+        raise HTTPException(status_code=404, detail="Ride not found")
+    
+    # Get creator details
+    creator = db.query(models.User).filter(models.User.id == ride.user_id).first()
+    
+    # Get participants
+    participants_query = (
+        db.query(models.RideParticipant, models.User)
+        .join(models.User, models.User.id == models.RideParticipant.user_id)
+        .filter(models.RideParticipant.ride_id == ride_id)
+    )
+    
+    participants = []
+    for participant, user in participants_query:
+        participants.append({
+            "id": user.id,
+            "name": user.name,
+            "joined_at": participant.created_at
+        })
+    
+    # Check if current user is the creator
+    is_creator = ride.user_id == current_user.id
+    
+    # Check if current user has joined this ride
+    has_joined = db.query(models.RideParticipant).filter(
+        models.RideParticipant.ride_id == ride_id,
+        models.RideParticipant.user_id == current_user.id
+    ).first() is not None
+    
+    return {
+        "ride": {
+            "id": ride.id,
+            "pickup": ride.pickup,
+            "destination": ride.destination,
+            "created_at": ride.created_at,
+            "departure_time": ride.departure_time,
+            "participant_count": ride.participant_count,
+            "creator_name": creator.name if creator else "Unknown",
+            "is_creator": is_creator,
+            "has_joined": has_joined
+        },
+        "participants": participants
+    }
+
+@router.delete("/ride/{ride_id}")
+async def delete_ride(
+    ride_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_ride_db)
+):
+    # Check if ride exists
+    ride = db.query(models.RideRequest).filter(models.RideRequest.id == ride_id).first()
+    if not ride:
+        raise HTTPException(status_code=404, detail="Ride not found")
+    
+    # Check if user is the creator of the ride
+    if ride.user_id != current_user.id:
+        raise HTTPException(status_code=403, detail="You can only delete rides you created")
+    
+    # Record the deletion in the event log before the row goes away
+    transition(db, ride, "delete", actor_type="user", actor_id=current_user.id)
+    
+    # Delete all participants first (to maintain referential integrity).
+    # Row by row, so each participant gets a sync tombstone
+    for participant in db.query(models.RideParticipant).filter(models.RideParticipant.ride_id == ride_id):
+        db.delete(participant)
+    db.flush()
+    
+    # Delete the ride
+    db.delete(ride)
+    db.commit()
+    
+    return {"message": "Ride deleted successfully"}
+
+@router.get("/ride/{ride_id}/timeline")
+def get_ride_timeline(
+    ride_id: int,
+    current_user: Principal = Depends(get_current_principal),
+    db: Session = Depends(get_ride_read_db)
+):
+    # Check if ride exists and the caller is involved in it
+    ride = db.query(models.RideRequest).filter(models.RideRequest.id == ride_id).first()
+    if not ride:
+        raise HTTPException(status_code=404, detail="Ride not found")
+    
+    if current_user.is_driver:
+        allowed = ride.driver_id == current_user.id
+    else:
+        allowed = ride.user_id == current_user.id or db.query(models.RideParticipant.id).filter(
+            models.RideParticipant.ride_id == ride_id,
+            models.RideParticipant.user_id == current_user.id
+        ).first() is not None
+    if not allowed:
+        raise HTTPException(status_code=403, detail="You are not part of this ride")
+    
+    # Kept up to date by projections.projections_loop; the events below are read live
+    timeline = db.get(models.RideTimeline, ride_id)
+    
+    # Databases from before ride ids stopped being reused may repeat one, so start from this ride's create event
+    created_event_id = db.query(func.max(models.RideEvent.id)).filter(
+        models.RideEvent.ride_id == ride_id,
+        models.RideEvent.event == "create"
+    ).scalar() or 0
+    events = (
+        db.query(models.RideEvent)
+        .filter(models.RideEvent.ride_id == ride_id, models.RideEvent.id >= created_event_id)
+        .order_by(models.RideEvent.id)
+        .all()
+    )
+    
+    return {
+        "ride_id": ride_id,
+        "status": ride.status,
+        "created_at": timeline.created_at if timeline else ride.created_at,
+        "accepted_at": timeline.accepted_at if timeline else None,
+        "completed_at": timeline.completed_at if timeline else None,
+        "release_count": timeline.release_count if timeline else 0,
+        "events": [
+            {
+                "event": event.event,
+                "from_status": event.from_status,
+                "to_status": event.to_status,
+                "actor_type": event.actor_type,
+                "actor_id": event.actor_id,
+                "at": event.created_at
+            }
+            for event in events
+        ]
+    }
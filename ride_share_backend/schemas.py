@@ -1,3 +1,6 @@
+from datetime import datetime
+from typing import Optional
+
 from pydantic import BaseModel
 
 class RideRequestBase(BaseModel):
@@ -12,4 +15,48 @@ class RideRequest(RideRequestBase):
     id: int
 
     class Config:
-        orm_mode = True
+        from_attributes = True
+
+# Request/response models used by the API routes
+class UserCreate(BaseModel):
+    name: str
+    email: str
+    password: str
+
+class DriverCreate(BaseModel):
+    name: str
+    email: str
+    password: str
+    license_number: str
+    vehicle_type: str
+    vehicle_number: str
+
+class UserLogin(BaseModel):
+    email: str
+    password: str
+
+class DriverLogin(BaseModel):
+    email: str
+    password: str
+
+class Token(BaseModel):
+    access_token: str
+    token_type: str
+    user_type: str
+    refresh_token: Optional[str] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+class RideCreate(BaseModel):
+    pickup: str
+    destination: str
+    departure_time: Optional[datetime] = None
+    max_participants: int = 4
+    distance: Optional[float] = None
+    fare: Optional[float] = None  # Optional manual fare
+    # Optional coordinates; rides with coordinates can be pooled with nearby rides
+    pickup_lat: Optional[float] = None
+    pickup_lng: Optional[float] = None
+    destination_lat: Optional[float] = None
+    destination_lng: Optional[float] = None
@@ -0,0 +1,241 @@
+# security.py
+# Token issuing and verification.
+#
+# Access tokens carry the principal id and role ("uid" and "user_type") so
+# most endpoints can authorize a request without loading the user row.
+# Verified tokens are cached by digest until they expire, so the HMAC check
+# and JSON parse run once per token instead of once per request. Since no
+# request looks the account up, tokens of a deleted account are refused by
+# id (deleted_accounts) until every access token issued for it has expired.
+import functools
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional
+
+from jose import JWTError, jwt
+
+SECRET_KEY = "YOUR_SECRET_KEY"  # Generate a secure random key in production
+ALGORITHM = "HS256"
+ACCESS_TOKEN_EXPIRE_MINUTES = 30
+REFRESH_TOKEN_EXPIRE_DAYS = 30
+# Rider accounts allowed to run the /admin maintenance endpoints, e.g. ADMIN_EMAILS=ops@example.com,lead@example.com
+ADMIN_EMAILS = {email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()}
+
+ACCESS_TOKEN = "access"
+REFRESH_TOKEN = "refresh"
+
+
+class Principal:
+    """The authenticated caller as described by its token."""
+
+    __slots__ = ("id", "email", "user_type", "jti", "expires_at")
+
+    def __init__(self, id: Optional[int], email: str, user_type: str, jti: Optional[str] = None, expires_at: float = 0.0):
+        self.id = id
+        self.email = email
+        self.user_type = user_type
+        self.jti = jti
+        self.expires_at = expires_at
+
+    @property
+    def is_driver(self) -> bool:
+        return self.user_type == "driver"
+
+    @property
+    def is_admin(self) -> bool:
+        return self.user_type == "user" and self.email in ADMIN_EMAILS
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of verified token digests, each held until the token expires."""
+
+    def __init__(self, max_entries: int = 10_000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, Principal]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, key: bytes, now: float) -> Optional[Principal]:
+        with self._lock:
+            principal = self._entries.get(key)
+            if principal is None:
+                self.misses += 1
+                return None
+            if principal.expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return principal
+
+    def put(self, key: bytes, principal: Principal):
+        with self._lock:
+            self._entries[key] = principal
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RevocationList:
+    """In-memory set of revoked token ids (or other keys), pruned as the tokens expire."""
+
+    def __init__(self):
+        self._revoked = {}  # jti -> expiry timestamp
+        self._lock = threading.Lock()
+        self._next_prune = 0.0
+
+    def revoke(self, jti: str, expires_at: float):
+        with self._lock:
+            self._revoked[jti] = expires_at
+
+    def is_revoked(self, jti, now: Optional[float] = None) -> bool:
+        if jti is None or not self._revoked:
+            return False
+        if now is None:
+            now = time.time()
+        if now >= self._next_prune:
+            self._prune(now)
+        return jti in self._revoked
+
+    def _prune(self, now: float):
+        # Expired tokens are rejected by their exp claim anyway
+        with self._lock:
+            for jti in [jti for jti, exp in self._revoked.items() if exp <= now]:
+                del self._revoked[jti]
+            self._next_prune = now + 60.0
+
+    def __len__(self):
+        return len(self._revoked)
+
+
+token_cache = VerifiedTokenCache()
+revoked_tokens = RevocationList()
+deleted_accounts = RevocationList()  # (user_type, id) of deleted accounts
+
+
+@functools.lru_cache(maxsize=None)
+def get_pwd_context():
+    # Built on first use; importing passlib and probing the bcrypt backend
+    # is kept off the startup path
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password, hashed_password):
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+def get_password_hash(password):
+    return get_pwd_context().hash(password)
+
+
+def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    if expires_delta:
+        expire = datetime.utcnow() + expires_delta
+    else:
+        expire = datetime.utcnow() + timedelta(minutes=15)
+    to_encode.update({"exp": expire, "type": ACCESS_TOKEN, "jti": uuid.uuid4().hex})
+    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    return encoded_jwt
+
+
+def create_refresh_token(data: dict, expires_delta: Optional[timedelta] = None):
+    to_encode = data.copy()
+    expire = datetime.utcnow() + (expires_delta or timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS))
+    to_encode.update({"exp": expire, "type": REFRESH_TOKEN, "jti": uuid.uuid4().hex})
+    return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def issue_tokens(principal_id: int, email: str, user_type: str):
+    # Access/refresh pair returned by the login and refresh endpoints
+    claims = {"sub": email, "uid": principal_id, "user_type": user_type}
+    return {
+        "access_token": create_access_token(claims, timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer",
+        "user_type": user_type,
+    }
+
+
+def decode_token(token: str, expected_type: str = ACCESS_TOKEN) -> Optional[Principal]:
+    """Verify a token and return its principal, or None if it is not valid.
+
+    Access tokens are served from the verified-token cache when possible.
+    Tokens issued before the "type" claim existed are treated as access
+    tokens.
+    """
+    now = time.time()
+    cacheable = expected_type == ACCESS_TOKEN
+    if cacheable:
+        key = token_cache.digest(token)
+        principal = token_cache.get(key, now)
+        if principal is not None:
+            if _is_revoked(principal, now):
+                return None
+            return principal
+
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+
+    email = payload.get("sub")
+    user_type = payload.get("user_type")
+    if email is None or user_type is None:
+        return None
+    if payload.get("type", ACCESS_TOKEN) != expected_type:
+        return None
+
+    principal = Principal(
+        id=payload.get("uid"),
+        email=email,
+        user_type=user_type,
+        jti=payload.get("jti"),
+        expires_at=float(payload["exp"]),
+    )
+    if _is_revoked(principal, now):
+        return None
+    # Legacy tokens without a uid still need a DB lookup, so only cache complete ones
+    if cacheable and principal.id is not None:
+        token_cache.put(key, principal)
+    return principal
+
+
+def _is_revoked(principal: Principal, now: float) -> bool:
+    return (revoked_tokens.is_revoked(principal.jti, now)
+            or deleted_accounts.is_revoked((principal.user_type, principal.id), now))
+
+
+def revoke(principal: Principal):
+    if principal.jti is not None:
+        revoked_tokens.revoke(principal.jti, principal.expires_at)
+
+
+def revoke_account(user_type: str, account_id: int, deleted_at: Optional[float] = None):
+    """Refuse every token of a deleted account, including ones issued later.
+
+    Access tokens issued up to ``deleted_at`` expire within
+    ACCESS_TOKEN_EXPIRE_MINUTES of it; refresh tokens outlive that, but
+    /token/refresh checks that the account still exists.
+    """
+    deleted_at = time.time() if deleted_at is None else deleted_at
+    deleted_accounts.revoke((user_type, account_id), deleted_at + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
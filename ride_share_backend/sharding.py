@@ -0,0 +1,276 @@
+# sharding.py
+# Regional sharding of ride data.
+#
+# Rides in different regions never interact, so each region's rides live
+# on one shard and cities stop contending for a single SQLite write lock.
+# Shard 0 is the main database; it keeps the global tables (users,
+# drivers, read models) as well as its own regions' rides. Every other
+# shard is a separate SQLite file holding only the ride-scoped tables
+# (SHARD_TABLES). Its connections ATTACH the main database, so the global
+# tables resolve there and queries that join users or drivers work
+# unchanged on any shard.
+#
+# A ride's region comes from its pickup coordinates (a grid cell, see
+# region_for); a region maps to a shard through REGION_SHARDS or a stable
+# hash. Ride ids are globally unique: shard k hands out ids above
+# k * SHARD_ID_SPAN, so the id alone says where a ride lives. Reads scoped
+# to a place go to that place's shards; reads about a user or driver fan
+# out to every shard in parallel and merge. Each shard also has a
+# read-only session factory; a fan-out started from a read-only session
+# reads every shard through those.
+import asyncio
+import math
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from sqlalchemy import create_engine, event, select, text, update
+from sqlalchemy.orm import Session, sessionmaker
+
+from database import engine, read_engine_for, use_wal, ReadSessionFactory, ReadSessionLocal, READ_ONLY_KEY, SessionLocal
+import models
+import sync
+
+# Extra shards beyond the main database, e.g. local_shard_urls(4)
+SHARD_DATABASE_URLS: List[str] = []
+
+REGION_CELL_DEGREES = 0.5  # About 55 km; a metro area spans one cell or a few
+DEFAULT_REGION = "default"  # Rides without pickup coordinates
+REGION_SHARDS: Dict[str, int] = {}  # Pin regions to shards; others are placed by hash
+SHARD_ID_SPAN = 2 ** 40  # Shard k's ride ids lie in [k * SHARD_ID_SPAN, (k + 1) * SHARD_ID_SPAN)
+NEARBY_RADIUS_KM = 10.0  # Reads scoped to a caller's position cover the shards this close
+KM_PER_DEGREE = 111.32
+CLOCK_HEARTBEAT_SECONDS = 2.0
+
+SHARD_KEY = "shard"  # Session.info key holding the shard a session is bound to
+
+# Tables that live on every shard; the rest exist only in the main database
+SHARD_TABLES = [
+    models.RideRequest.__table__,
+    models.RideParticipant.__table__,
+    models.RideEvent.__table__,
+    models.SyncClock.__table__,
+    models.SyncTombstone.__table__,
+    models.OutboxMessage.__table__,
+    models.IdSequence.__table__,
+]
+
+
+def region_for(lat: Optional[float], lng: Optional[float]) -> str:
+    if lat is None or lng is None:
+        return DEFAULT_REGION
+    return f"{math.floor(lat / REGION_CELL_DEGREES)}:{math.floor(lng / REGION_CELL_DEGREES)}"
+
+
+def local_shard_urls(count: int, directory: str = ".") -> List[str]:
+    # SQLite files for shards 1..count-1, for local runs and tests
+    return [f"sqlite:///{os.path.join(directory, f'rides_shard_{index}.db')}" for index in range(1, count)]
+
+
+def shard_of(db: Session) -> int:
+    return db.info.get(SHARD_KEY, 0)
+
+
+class Shard:
+    __slots__ = ("index", "engine", "SessionLocal", "ReadSessionLocal")
+
+    def __init__(self, index, engine, SessionLocal, ReadSessionLocal=None):
+        self.index = index
+        self.engine = engine
+        self.SessionLocal = SessionLocal
+        # Without a read-only factory, reads use the read-write sessions
+        self.ReadSessionLocal = ReadSessionLocal if ReadSessionLocal is not None else SessionLocal
+
+    def dispose(self):
+        self.engine.dispose()
+        if self.ReadSessionLocal is not self.SessionLocal:
+            self.ReadSessionLocal.dispose()
+
+
+class ShardRouter:
+    def __init__(self, home_engine, home_sessionmaker, urls=(), home_read_sessionmaker=None):
+        self.shards: List[Shard] = []
+        self._executor = None
+        self.configure(home_engine, home_sessionmaker, urls, home_read_sessionmaker)
+
+    def configure(self, home_engine, home_sessionmaker, urls=(), home_read_sessionmaker=None):
+        """Replace the shard set: the main database plus one shard per url.
+
+        Ride shards get read-only sessions only if the main database has them.
+        """
+        for shard in self.shards[1:]:
+            shard.dispose()
+        self.shards = [Shard(0, home_engine, home_sessionmaker, home_read_sessionmaker)]
+        home_path = home_engine.url.database
+        for index, url in enumerate(urls, start=1):
+            shard_engine = create_engine(url, connect_args={"check_same_thread": False})
+            use_wal(shard_engine)
+            event.listen(shard_engine, "connect", _attach_home(home_path))
+            read_sessions = None
+            if home_read_sessionmaker is not None:
+                read_engine = read_engine_for(url)
+                event.listen(read_engine, "connect", _attach_home(home_path, read_only=True))
+                read_sessions = ReadSessionFactory([read_engine], info={SHARD_KEY: index})
+            self.shards.append(Shard(index, shard_engine, sessionmaker(
+                autocommit=False, autoflush=False, bind=shard_engine, info={SHARD_KEY: index}
+            ), read_sessions))
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def __len__(self):
+        return len(self.shards)
+
+    def __iter__(self):
+        return iter(self.shards)
+
+    # Routing
+
+    def shard_for_region(self, region: str) -> int:
+        if len(self.shards) == 1:
+            return 0
+        pinned = REGION_SHARDS.get(region)
+        if pinned is not None and pinned < len(self.shards):
+            return pinned
+        return zlib.crc32(region.encode("utf-8")) % len(self.shards)
+
+    def shard_for_location(self, lat: Optional[float], lng: Optional[float]) -> int:
+        return self.shard_for_region(region_for(lat, lng))
+
+    def shards_near(self, lat: Optional[float], lng: Optional[float], radius_km: float = NEARBY_RADIUS_KM) -> List[int]:
+        """Shards holding rides within ``radius_km`` of a point; every shard if the point is unknown."""
+        if lat is None or lng is None:
+            return list(range(len(self.shards)))
+        lat_span = radius_km / KM_PER_DEGREE
+        lng_span = lat_span / max(math.cos(math.radians(lat)), 0.01)
+        found = set()
+        for corner_lat in (lat - lat_span, lat + lat_span):
+            for corner_lng in (lng - lng_span, lng + lng_span):
+                found.add(self.shard_for_location(corner_lat, corner_lng))
+        return sorted(found)
+
+    def shard_for_ride(self, ride_id: int) -> int:
+        index = ride_id // SHARD_ID_SPAN
+        # Ids outside every shard's range cannot exist; let the main database report them missing
+        return index if 0 < index < len(self.shards) else 0
+
+    # Sessions
+
+    def session(self, index: int, read_only: bool = False) -> Session:
+        shard = self.shards[index]
+        return shard.ReadSessionLocal() if read_only else shard.SessionLocal()
+
+    def fan_out(self, db: Session, fn, indexes=None, parallel: bool = True) -> list:
+        """Run ``fn(session)`` on every shard (or ``indexes``); results come back in shard order.
+
+        Shard 0 uses ``db`` in the calling thread; the other shards get a
+        session of their own, read-only if ``db`` is, in parallel on the
+        fan-out thread pool unless ``parallel`` is False.
+        """
+        indexes = list(range(len(self.shards))) if indexes is None else sorted(indexes)
+        if indexes == [0]:
+            return [fn(db)]
+        futures = {}
+        read_only = db.info.get(READ_ONLY_KEY, False)
+        if parallel and len(indexes) > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+            futures = {index: self._executor.submit(self._run, index, fn, read_only) for index in indexes if index != 0}
+        results = []
+        for index in indexes:
+            if index == 0:
+                results.append(fn(db))
+            elif index in futures:
+                results.append(futures[index].result())
+            else:
+                results.append(self._run(index, fn, read_only))
+        return results
+
+    def _run(self, index: int, fn, read_only: bool = False):
+        db = self.session(index, read_only)
+        try:
+            return fn(db)
+        finally:
+            db.close()
+
+
+def _attach_home(home_path, read_only: bool = False):
+    # Read-only connections are opened as URIs, so the main database can be attached read-only too
+    target = f"file:{home_path}?mode=ro" if read_only else home_path
+
+    def attach(dbapi_connection, connection_record):
+        # Global tables are missing from the shard file, so unqualified names fall through to these
+        dbapi_connection.execute("ATTACH DATABASE ? AS home", (target,))
+    return attach
+
+
+shards = ShardRouter(engine, SessionLocal, SHARD_DATABASE_URLS, ReadSessionLocal)
+
+
+def sync_state(db: Session, since_version: Optional[int], indexes=None, router: ShardRouter = shards):
+    """The sync token and delta flag for a read across shards.
+
+    Every shard is queried with the same token. The token handed out is
+    the lowest of the shard clocks, read before any rows, so nothing
+    committed later is missed; rows a shard already sent may be sent
+    again, which clients treat as an update. A delta is only possible if
+    no shard has pruned tombstones the client still needs.
+    """
+    clocks = router.fan_out(db, lambda shard_db: (sync.current_version(shard_db), sync.pruned_version(shard_db)), indexes)
+    sync_version = min(current for current, _ in clocks)
+    delta = since_version is not None and since_version >= max(pruned for _, pruned in clocks)
+    return sync_version, delta
+
+
+@event.listens_for(Session, "before_flush")
+def _allocate_ride_ids(session: Session, flush_context, instances):
+    # Rides on shard k take the next ids in shard k's range from the shard's
+    # id_sequences row, never from MAX(id): the id of a deleted ride stays in
+    # the event log, tombstones and search index, so it must not come back
+    index = shard_of(session)
+    if index == 0:
+        return  # ride_requests is AUTOINCREMENT there
+    new_rides = [obj for obj in session.new if isinstance(obj, models.RideRequest) and obj.id is None]
+    if not new_rides:
+        return
+    # Taking the transaction's version locks the shard for writing, so the sequence moves with this commit
+    sync.transaction_version(session)
+    sequence = models.IdSequence
+    name = models.RideRequest.__tablename__
+    result = session.execute(
+        update(sequence).where(sequence.name == name).values(last_id=sequence.last_id + len(new_rides))
+    )
+    if result.rowcount == 1:
+        last_id = session.execute(select(sequence.last_id).where(sequence.name == name)).scalar() - len(new_rides)
+    else:
+        # First ride since the shard got a sequence; sqlite_sequence remembers
+        # the highest id the shard ever held, deleted or not
+        last_id = max(session.execute(
+            text("SELECT seq FROM sqlite_sequence WHERE name = :name"), {"name": name}
+        ).scalar() or 0, index * SHARD_ID_SPAN)
+        session.execute(sequence.__table__.insert().values(name=name, last_id=last_id + len(new_rides)))
+    for ride in new_rides:
+        last_id += 1
+        ride.id = last_id
+
+
+def advance_clocks(router: ShardRouter = shards):
+    for shard in router:
+        db = shard.SessionLocal()
+        try:
+            sync.advance_clock(db)
+        finally:
+            db.close()
+
+
+async def clock_heartbeat_loop(router: ShardRouter = shards, interval: float = CLOCK_HEARTBEAT_SECONDS):
+    # Background task: a fan-out read hands out the lowest shard clock as its token,
+    # so keep idle shards' clocks moving with the wall clock
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, advance_clocks, router)
+        except Exception as e:
+            print(f"Error advancing shard clocks: {str(e)}")
@@ -0,0 +1,161 @@
+# sync.py
+# Row versioning for delta sync.
+#
+# Every write transaction that touches ride_requests or ride_participants
+# takes the next number from the sync clock and stamps it on the rows it
+# inserts or updates. Rows that drop out of someone's list (a deleted ride,
+# a ride the driver released, a participant who left) leave a tombstone
+# with the same version. A client that saw everything up to version N asks
+# for rows and tombstones with version > N.
+#
+# Taking a version updates the clock row, and SQLite holds the write lock
+# from then until commit, so versions become visible in increasing order
+# and a client never skips a row.
+#
+# The clock is a hybrid of a counter and the wall clock: the next version
+# is the previous one plus one, or the current time in milliseconds if
+# that is larger. Versions from different databases (shards, see
+# sharding.py) are then close to each other, so one token can be used
+# against all of them.
+import time
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import case, delete, event, inspect, select, update
+from sqlalchemy.orm import Session
+
+import models
+
+CLOCK_NAME = "rides"
+
+TOMBSTONE_RIDE = "ride"
+TOMBSTONE_UNASSIGNED = "unassigned"
+TOMBSTONE_PARTICIPANT = "participant"
+
+_VERSION_KEY = "sync_version"
+_VERSIONED = (models.RideRequest, models.RideParticipant)
+
+
+def current_version(db: Session) -> int:
+    # Read this before querying rows so nothing committed in between is missed
+    return db.execute(
+        select(models.SyncClock.version).where(models.SyncClock.name == CLOCK_NAME)
+    ).scalar() or 0
+
+
+def pruned_version(db: Session) -> int:
+    return db.execute(
+        select(models.SyncClock.pruned_version).where(models.SyncClock.name == CLOCK_NAME)
+    ).scalar() or 0
+
+
+def needs_full_sync(db: Session, since_version: Optional[int]) -> bool:
+    # No token, or tombstones the client still needs have been pruned
+    return since_version is None or since_version < pruned_version(db)
+
+
+def transaction_version(db: Session) -> int:
+    """Return this transaction's version, taking it from the clock on first use."""
+    version = db.info.get(_VERSION_KEY)
+    if version is not None:
+        return version
+
+    conn = db.connection()
+    now_ms = int(time.time() * 1000)
+    result = conn.execute(
+        update(models.SyncClock)
+        .where(models.SyncClock.name == CLOCK_NAME)
+        .values(version=case(
+            (models.SyncClock.version + 1 > now_ms, models.SyncClock.version + 1),
+            else_=now_ms
+        ))
+    )
+    if result.rowcount == 0:
+        conn.execute(models.SyncClock.__table__.insert().values(name=CLOCK_NAME, version=now_ms, pruned_version=0))
+    version = conn.execute(
+        select(models.SyncClock.version).where(models.SyncClock.name == CLOCK_NAME)
+    ).scalar()
+    db.info[_VERSION_KEY] = version
+    return version
+
+
+def advance_clock(db: Session) -> int:
+    """Take a version without writing any rows and commit, bringing the clock up to the wall clock."""
+    version = transaction_version(db)
+    db.commit()
+    return version
+
+
+def pending_version(db: Session) -> Optional[int]:
+    # The version taken by the current transaction, if it has written anything yet
+    return db.info.get(_VERSION_KEY)
+
+
+def prune_tombstones(db: Session, before_version: int) -> int:
+    """Delete tombstones older than ``before_version`` and commit.
+
+    Clients holding an older token get a full list on their next refresh.
+    Returns the number of tombstones removed.
+    """
+    result = db.execute(delete(models.SyncTombstone).where(models.SyncTombstone.version < before_version))
+    db.execute(
+        update(models.SyncClock)
+        .where(models.SyncClock.name == CLOCK_NAME, models.SyncClock.pruned_version < before_version)
+        .values(pruned_version=before_version)
+    )
+    db.commit()
+    return result.rowcount
+
+
+def tombstones_since(db: Session, since_version: int, *criteria):
+    query = select(models.SyncTombstone.ride_id).where(models.SyncTombstone.version > since_version, *criteria)
+    return set(db.execute(query).scalars())
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_versions(session: Session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, _VERSIONED)]
+    changed += [obj for obj in session.dirty if isinstance(obj, _VERSIONED) and session.is_modified(obj)]
+    removed = [obj for obj in session.deleted if isinstance(obj, _VERSIONED)]
+    if not changed and not removed:
+        return
+
+    version = transaction_version(session)
+    now = datetime.utcnow()
+    tombstones = []
+
+    for obj in changed:
+        obj.version = version
+        obj.updated_at = now
+        state = inspect(obj)
+        if isinstance(obj, models.RideRequest):
+            # The ride left the previous driver's list
+            old_driver = state.attrs.driver_id.history.deleted
+            if old_driver and old_driver[0] is not None and old_driver[0] != obj.driver_id:
+                tombstones.append(dict(kind=TOMBSTONE_UNASSIGNED, ride_id=obj.id, driver_id=old_driver[0]))
+        else:
+            # A participant row moved to another ride (pooling merges)
+            old_ride = state.attrs.ride_id.history.deleted
+            if old_ride and old_ride[0] is not None and old_ride[0] != obj.ride_id:
+                tombstones.append(dict(kind=TOMBSTONE_PARTICIPANT, ride_id=old_ride[0], user_id=obj.user_id))
+
+    for obj in removed:
+        if isinstance(obj, models.RideRequest):
+            tombstones.append(dict(kind=TOMBSTONE_RIDE, ride_id=obj.id, user_id=obj.user_id, driver_id=obj.driver_id))
+        else:
+            tombstones.append(dict(kind=TOMBSTONE_PARTICIPANT, ride_id=obj.ride_id, user_id=obj.user_id))
+
+    for values in tombstones:
+        session.add(models.SyncTombstone(version=version, created_at=now, **values))
+
+
+@event.listens_for(Session, "after_commit")
+def _clear_version(session: Session):
+    session.info.pop(_VERSION_KEY, None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _discard_version(session: Session, transaction):
+    # Rolled back, or closed without committing
+    if transaction.parent is None:
+        session.info.pop(_VERSION_KEY, None)
@@ -0,0 +1,100 @@
+import itertools
+import os
+import sys
+
+import pytest
+
+# The backend uses flat imports (`import models`), run from its own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SHARD_COUNT = 3
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope="session")
+def data_dir(tmp_path_factory):
+    # database.DATABASE_URL is relative to the working directory, so every
+    # database the tests touch (main and shards) lives in a fresh directory
+    path = tmp_path_factory.mktemp("data")
+    cwd = os.getcwd()
+    os.chdir(path)
+
+    import database
+    import sharding
+    from init_db import ensure_schema
+    sharding.shards.configure(database.engine, database.SessionLocal, sharding.local_shard_urls(SHARD_COUNT, str(path)))
+    for shard in sharding.shards:
+        ensure_schema(shard.engine, None if shard.index == 0 else sharding.SHARD_TABLES)
+    yield path
+    os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(data_dir):
+    import rate_limit
+    for budget in list(rate_limit.ROUTE_BUDGETS.values()) + [rate_limit.DEFAULT_BUDGET]:
+        budget.rate = budget.burst = 1e9
+
+    import main
+    import outbox
+    from fastapi.testclient import TestClient
+
+    with TestClient(main.create_app(background_tasks=False, notification_sink=outbox.LoopbackSink())) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="session")
+def shard_spots(client):
+    # A pickup location on every shard, by shard index
+    import sharding
+    spots = {}
+    for step in range(200):
+        lat, lng = 30.25 + step * 0.5, 31.25
+        spots.setdefault(sharding.shards.shard_for_location(lat, lng), (lat, lng))
+    assert len(spots) == SHARD_COUNT
+    return spots
+
+
+def _login(client, path, email):
+    response = client.post(path, data={"username": email, "password": "pw"})
+    assert response.status_code == 200, response.text
+    return {"Authorization": "Bearer " + response.json()["access_token"]}
+
+
+@pytest.fixture
+def rider(client):
+    """Registers a new rider and returns their auth headers."""
+    def register():
+        name = f"rider{next(_names)}"
+        response = client.post("/register", json={"name": name, "email": f"{name}@example.com", "password": "pw"})
+        assert response.status_code == 200, response.text
+        return _login(client, "/login/user", f"{name}@example.com")
+    return register
+
+
+@pytest.fixture
+def driver(client):
+    """Registers a new driver and returns their auth headers."""
+    def register():
+        name = f"driver{next(_names)}"
+        response = client.post("/register/driver", json={
+            "name": name, "email": f"{name}@example.com", "password": "pw",
+            "license_number": f"L-{name}", "vehicle_type": "car", "vehicle_number": f"V-{name}"
+        })
+        assert response.status_code == 200, response.text
+        return _login(client, "/login/driver", f"{name}@example.com")
+    return register
+
+
+@pytest.fixture
+def request_ride(client):
+    """Creates a ride for the given rider, optionally picked up at ``spot``, and returns its id."""
+    def create(headers, spot=None, **fields):
+        body = {"pickup": "Tahrir", "destination": "Giza", "fare": 10, **fields}
+        if spot is not None:
+            body["pickup_lat"], body["pickup_lng"] = spot
+        response = client.post("/ride-request", json=body, headers=headers)
+        assert response.status_code == 200, response.text
+        return response.json()["id"]
+    return create
@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+
+def test_purge_logs_events_and_leaves_tombstones(client, rider, request_ride, shard_spots):
+    import maintenance
+    import models
+    import sync
+    from sharding import shards
+    from sqlalchemy import update
+
+    owner, passenger = rider(), rider()
+    token = client.get("/user/rides", headers=passenger).json()["sync_version"]
+    stale = {index: request_ride(owner, spot) for index, spot in shard_spots.items()}
+    fresh = request_ride(owner, shard_spots[1])
+    for ride_id in stale.values():
+        assert client.post(f"/join-ride/{ride_id}", headers=passenger).status_code == 200
+    for index, ride_id in stale.items():
+        with shards.shards[index].engine.begin() as conn:
+            conn.execute(
+                update(models.RideRequest)
+                .where(models.RideRequest.id == ride_id)
+                .values(created_at=models.RideRequest.created_at - timedelta(days=2))
+            )
+
+    result = maintenance.purge_stale_rides(older_than=timedelta(days=1), chunk_rows=1)
+    assert result["rides_deleted"] >= len(stale)
+
+    for index, ride_id in stale.items():
+        db = shards.session(index)
+        try:
+            assert db.get(models.RideRequest, ride_id) is None
+            events = db.query(models.RideEvent).filter_by(ride_id=ride_id).order_by(models.RideEvent.id).all()
+            assert [(event.event, event.to_status) for event in events][-1] == ("delete", "deleted")
+            assert events[-1].actor_type == "system"
+            kinds = sorted(kind for (kind,) in db.query(models.SyncTombstone.kind).filter_by(ride_id=ride_id))
+            assert kinds == sorted([sync.TOMBSTONE_RIDE, sync.TOMBSTONE_PARTICIPANT])
+        finally:
+            db.close()
+
+    assert client.get(f"/ride/{fresh}", headers=owner).status_code == 200
+    for headers in (owner, passenger):
+        delta = client.get("/user/rides", params={"since_version": token}, headers=headers).json()
+        assert delta["delta"] and delta["removed"] == sorted(stale.values())
@@ -0,0 +1,70 @@
+def test_message_is_dead_lettered_after_max_attempts(data_dir, monkeypatch):
+    import database
+    import models
+    import outbox
+    from sqlalchemy import func
+
+    monkeypatch.setattr(outbox, "BACKOFF_BASE_SECONDS", 0.0)
+    db = database.SessionLocal()
+    try:
+        outbox.enqueue(db, "ride_accepted", "user", 1, {"ride_id": 1})
+        db.commit()
+        message_id = db.query(func.max(models.OutboxMessage.id)).scalar()
+
+        sink = outbox.LoopbackSink(fail=lambda message: message.id == message_id)
+        worker = outbox.OutboxWorker(database.SessionLocal, sink=sink, max_attempts=3)
+        for attempt in range(1, 4):
+            worker.drain_once()
+            db.expire_all()
+            message = db.get(models.OutboxMessage, message_id)
+            assert message.attempts == attempt and message.claimed_by is None
+            assert message.status == (outbox.DEAD if attempt == 3 else outbox.PENDING)
+        assert message.last_error == "loopback failure"
+
+        # Dead letters are left alone until requeued
+        worker.drain_once()
+        db.expire_all()
+        assert db.get(models.OutboxMessage, message_id).attempts == 3
+        assert worker.metrics.snapshot()["dead_lettered"] == 1
+
+        assert outbox.requeue_dead_letters(db) >= 1
+        db.expire_all()
+        message = db.get(models.OutboxMessage, message_id)
+        assert message.status == outbox.PENDING and message.attempts == 0
+        outbox.OutboxWorker(database.SessionLocal, sink=outbox.LoopbackSink()).drain_once()
+        db.expire_all()
+        assert db.get(models.OutboxMessage, message_id) is None
+    finally:
+        db.close()
+
+
+def test_finish_after_an_expired_lease_leaves_the_new_claim_alone(data_dir):
+    import database
+    import models
+    import outbox
+    from sqlalchemy import func
+
+    db = database.SessionLocal()
+    try:
+        outbox.enqueue(db, "rider_joined", "driver", 1, {"ride_id": 1})
+        db.commit()
+        message_id = db.query(func.max(models.OutboxMessage.id)).scalar()
+
+        late = outbox.OutboxWorker(database.SessionLocal, lease_seconds=-1)
+        current = outbox.OutboxWorker(database.SessionLocal)
+        late_token, late_messages = late._claim(database.SessionLocal())
+        token, messages = current._claim(database.SessionLocal())
+        assert message_id in [message.id for message in late_messages]
+        assert message_id in [message.id for message in messages]
+
+        late._finish(database.SessionLocal(), late_token, late_messages, {}, 0.0)
+        late._finish(database.SessionLocal(), late_token, late_messages, {message_id: "late"}, 0.0)
+        db.expire_all()
+        message = db.get(models.OutboxMessage, message_id)
+        assert message.claimed_by == token and message.attempts == 0
+
+        current._finish(database.SessionLocal(), token, messages, {}, 0.0)
+        db.expire_all()
+        assert db.get(models.OutboxMessage, message_id) is None
+    finally:
+        db.close()
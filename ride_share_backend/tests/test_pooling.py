@@ -0,0 +1,63 @@
+def _open_trip(db, ride_ids):
+    import pooling
+
+    requests = {request.id: request for request in pooling.load_open_requests(db) if request.id in ride_ids}
+    trip = pooling.Trip(requests[ride_ids[0]])
+    for ride_id in ride_ids[1:]:
+        trip.members.append(requests[ride_id])
+    return trip
+
+
+def _riders(db, ride_id):
+    import models
+    return sorted(user_id for (user_id,) in db.query(models.RideParticipant.user_id).filter_by(ride_id=ride_id))
+
+
+def test_merge_seats_every_rider_once(client, rider, request_ride, shard_spots):
+    import models
+    import pooling
+    from sharding import shards
+
+    spot = shard_spots[0]
+    trip = {"destination_lat": spot[0] + 0.05, "destination_lng": spot[1] + 0.05}
+    first, second, passenger = rider(), rider(), rider()
+    anchor = request_ride(first, spot, **trip)
+    other = request_ride(second, spot, **trip)
+    assert client.post(f"/join-ride/{other}", headers=passenger).status_code == 200
+
+    db = shards.session(0)
+    try:
+        # A join recorded twice, as the join endpoint allowed before it checked
+        joined = db.query(models.RideParticipant).filter_by(ride_id=other).one()
+        db.add(models.RideParticipant(ride_id=other, user_id=joined.user_id))
+        db.commit()
+
+        assert pooling.apply_trips(db, [_open_trip(db, [anchor, other])]) == 1
+        creator = db.get(models.RideRequest, other).user_id
+        assert _riders(db, anchor) == sorted([joined.user_id, creator])
+        assert _riders(db, other) == []
+        assert db.get(models.RideRequest, anchor).participant_count == 3
+    finally:
+        db.close()
+
+
+def test_rides_sharing_a_rider_are_not_merged(client, rider, request_ride, shard_spots):
+    import models
+    import pooling
+    from sharding import shards
+
+    spot = shard_spots[0]
+    trip = {"destination_lat": spot[0] + 0.05, "destination_lng": spot[1] + 0.05}
+    passenger = rider()
+    rides = [request_ride(rider(), spot, **trip) for _ in range(2)]
+    for ride_id in rides:
+        assert client.post(f"/join-ride/{ride_id}", headers=passenger).status_code == 200
+
+    db = shards.session(0)
+    try:
+        assert pooling.apply_trips(db, [_open_trip(db, rides)]) == 0
+        for ride_id in rides:
+            assert db.get(models.RideRequest, ride_id).status == "pending"
+            assert len(_riders(db, ride_id)) == 1
+    finally:
+        db.close()
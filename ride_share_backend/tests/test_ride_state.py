@@ -0,0 +1,58 @@
+import pytest
+
+
+def _merge(ride_id):
+    # Another transaction (the pooling optimizer, say) moves the ride on
+    import models
+    import ride_state
+    from sharding import shards
+    db = shards.session(shards.shard_for_ride(ride_id))
+    try:
+        ride_state.transition(db, db.get(models.RideRequest, ride_id), "merge", actor_type="system")
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_accept_of_a_ride_merged_since_it_was_read_returns_409(client, rider, driver, request_ride, monkeypatch):
+    from routes import driver as driver_routes
+
+    ride_id = request_ride(rider())
+    claim_driver = driver_routes._claim_driver
+
+    def merge_then_claim(db, driver_id, claimed_ride_id):
+        _merge(claimed_ride_id)
+        return claim_driver(db, driver_id, claimed_ride_id)
+
+    monkeypatch.setattr(driver_routes, "_claim_driver", merge_then_claim)
+    headers = driver()
+    response = client.post(f"/accept-ride/{ride_id}", headers=headers)
+    assert response.status_code == 409, response.text
+    assert "merged" in response.json()["detail"]
+
+    # The failed accept left the driver free
+    monkeypatch.undo()
+    assert client.get("/driver/availability", headers=headers).json()["is_available"]
+
+
+def test_illegal_transitions_are_rejected_and_not_logged(client, rider, driver, request_ride):
+    import models
+    import ride_state
+    from sharding import shards
+
+    headers = driver()
+    ride_id = request_ride(rider())
+    assert client.post(f"/accept-ride/{ride_id}", headers=headers).status_code == 200
+    assert client.post(f"/complete-ride/{ride_id}", headers=headers).status_code == 200
+
+    db = shards.session(shards.shard_for_ride(ride_id))
+    try:
+        ride = db.get(models.RideRequest, ride_id)
+        for event_name in ("accept", "release", "complete", "merge"):
+            with pytest.raises(ride_state.InvalidTransition):
+                ride_state.transition(db, ride, event_name)
+        db.rollback()
+        events = [event for (event,) in db.query(models.RideEvent.event).filter_by(ride_id=ride_id).order_by(models.RideEvent.id)]
+        assert events == ["create", "accept", "complete"]
+    finally:
+        db.close()
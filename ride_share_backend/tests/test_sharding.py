@@ -0,0 +1,19 @@
+import pytest
+
+from conftest import SHARD_COUNT
+
+
+@pytest.mark.parametrize("index", range(SHARD_COUNT))
+def test_ride_ids_are_not_reused_after_a_delete(client, rider, request_ride, shard_spots, index):
+    from sharding import SHARD_ID_SPAN, shards
+
+    owner = rider()
+    first = request_ride(owner, shard_spots[index])
+    second = request_ride(owner, shard_spots[index])
+    assert shards.shard_for_ride(first) == shards.shard_for_ride(second) == index
+    assert first >= index * SHARD_ID_SPAN and second > first
+
+    assert client.delete(f"/ride/{second}", headers=owner).status_code == 200
+    third = request_ride(owner, shard_spots[index])
+    assert third > second
+    assert shards.shard_for_ride(third) == index
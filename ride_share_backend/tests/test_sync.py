@@ -0,0 +1,30 @@
+def test_user_delta_lists_rides_deleted_or_left_as_removed(client, rider, request_ride):
+    owner, passenger = rider(), rider()
+    deleted, left, kept = request_ride(owner), request_ride(owner), request_ride(owner)
+    for ride_id in (deleted, left, kept):
+        assert client.post(f"/join-ride/{ride_id}", headers=passenger).status_code == 200
+    token = client.get("/user/rides", headers=passenger).json()["sync_version"]
+
+    assert client.delete(f"/ride/{deleted}", headers=owner).status_code == 200
+    assert client.post(f"/leave-ride/{left}", headers=passenger).status_code == 200
+
+    delta = client.get("/user/rides", params={"since_version": token}, headers=passenger).json()
+    assert delta["delta"]
+    assert delta["removed"] == sorted([deleted, left])
+    assert kept not in delta["removed"]
+
+    delta = client.get("/user/rides", params={"since_version": token}, headers=owner).json()
+    assert delta["delta"] and delta["removed"] == [deleted]
+
+
+def test_driver_delta_lists_a_cancelled_ride_as_removed(client, rider, driver, request_ride):
+    headers = driver()
+    ride_id = request_ride(rider())
+    assert client.post(f"/accept-ride/{ride_id}", headers=headers).status_code == 200
+    token = client.get("/driver/my-rides", headers=headers).json()["sync_version"]
+
+    assert client.post(f"/cancel-ride/{ride_id}", headers=headers).status_code == 200
+
+    delta = client.get("/driver/my-rides", params={"since_version": token}, headers=headers).json()
+    assert delta["delta"] and delta["removed"] == [ride_id]
+    assert delta["rides"] == []
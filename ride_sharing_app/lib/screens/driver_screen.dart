@@ -65,33 +65,18 @@ class _DriverScreenState extends State<DriverScreen> with SingleTickerProviderSt
     });
 
     try {
-      print('Fetching available rides...');
-      final availableResponse = await ApiService.getAvailableRides();
-      print('Available rides response: $availableResponse');
+      // One request for the whole screen; fares come with the rides
+      print('Fetching driver home...');
+      final homeResponse = await ApiService.getDriverHome();
       
-      print('Fetching driver rides...');
-      final driverResponse = await ApiService.getDriverRides();
-      print('Driver rides response: $driverResponse');
-      
-      if (availableResponse != null) {
-        // Get available rides from the response
+      if (homeResponse != null) {
         final List<Map<String, dynamic>> availableRides = [];
-        for (var ride in (availableResponse['available_rides'] ?? [])) {
-          try {
-            final rideDetails = await ApiService.getRideDetails(ride['id']);
-            availableRides.add({
-              ...Map<String, dynamic>.from(ride),
-              'fare': rideDetails['ride']?['fare'],
-            });
-          } catch (e) {
-            print('Error fetching fare for ride ${ride['id']}: $e');
-            availableRides.add(Map<String, dynamic>.from(ride));
-          }
+        for (var ride in (homeResponse['nearby_rides'] ?? [])) {
+          availableRides.add(Map<String, dynamic>.from(ride));
         }
         
-        // Get accepted rides from driver response
         final List<Map<String, dynamic>> acceptedRides = [];
-        for (var ride in (driverResponse?['rides'] ?? [])) {
+        for (var ride in (homeResponse['my_rides'] ?? [])) {
           acceptedRides.add(Map<String, dynamic>.from(ride));
         }
         
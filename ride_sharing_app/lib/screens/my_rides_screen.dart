@@ -36,34 +36,12 @@ class _MyRidesScreenState extends State<MyRidesScreen> with SingleTickerProvider
     });
 
     try {
-      // Load created rides
-      print('Loading created rides...');
-      final createdResult = await ApiService.getUserRides();
-      print('Created rides response: $createdResult');
+      // Created and joined rides, with fares, in one request
+      print('Loading home screen...');
+      final homeResult = await ApiService.getUserHome();
       
-      // Load joined rides
-      print('Loading joined rides...');
-      final joinedResult = await ApiService.getUserJoinedRides();
-      print('Joined rides response: $joinedResult');
-      
-      final createdRides = (createdResult['rides'] ?? [])
-          .where((ride) => !(joinedResult['rides'] ?? []).any((joinedRide) => joinedRide['id'] == ride['id']))
-          .toList();
-      
-      // Get fare information for joined rides
-      final List<dynamic> joinedRides = [];
-      for (var ride in (joinedResult['rides'] ?? [])) {
-        try {
-          final rideDetails = await ApiService.getRideDetails(ride['id']);
-          joinedRides.add({
-            ...ride,
-            'fare': rideDetails['ride']?['fare'],
-          });
-        } catch (e) {
-          print('Error fetching fare for ride ${ride['id']}: $e');
-          joinedRides.add(ride);
-        }
-      }
+      final createdRides = homeResult['created_rides'] ?? [];
+      final List<dynamic> joinedRides = homeResult['joined_rides'] ?? [];
       
       // Debug log for fare data
       print('Created rides fare structure:');
@@ -26,11 +26,60 @@ class ApiService {
     await prefs.setString('auth_token', token);
   }
   
+  // Store the refresh token used to renew the access token without logging in again
+  static Future<void> setRefreshToken(String refreshToken) async {
+    final prefs = await SharedPreferences.getInstance();
+    await prefs.setString('refresh_token', refreshToken);
+  }
+  
   // Clear the token (logout)
   static Future<void> clearToken() async {
     _token = null;
     final prefs = await SharedPreferences.getInstance();
     await prefs.remove('auth_token');
+    await prefs.remove('refresh_token');
+  }
+  
+  // Refreshes in progress; refresh tokens are single use, so concurrent 401s share one
+  static Future<bool>? _refreshing;
+  
+  static Future<bool> _refreshOnce() {
+    return _refreshing ??= refreshAccessToken().whenComplete(() => _refreshing = null);
+  }
+  
+  // Send an authenticated request; on a 401 renew the expired access token and retry once
+  static Future<http.Response> _authorized(Future<http.Response> Function(String? token) send) async {
+    final token = await getToken();
+    final response = await send(token);
+    if (response.statusCode != 401) return response;
+    // Another request may have renewed it already
+    if (await getToken() == token && !await _refreshOnce()) return response;
+    return send(await getToken());
+  }
+  
+  // Exchange the stored refresh token for a new token pair
+  static Future<bool> refreshAccessToken() async {
+    final prefs = await SharedPreferences.getInstance();
+    final refreshToken = prefs.getString('refresh_token');
+    if (refreshToken == null) return false;
+    
+    try {
+      final response = await http.post(
+        Uri.parse('$baseUrl/token/refresh'),
+        headers: {'Content-Type': 'application/json'},
+        body: jsonEncode({'refresh_token': refreshToken}),
+      ).timeout(Duration(seconds: 15));
+      
+      if (response.statusCode == 200) {
+        final data = jsonDecode(response.body);
+        await setToken(data['access_token']);
+        await setRefreshToken(data['refresh_token']);
+        return true;
+      }
+    } catch (e) {
+      print('Token refresh error: $e');
+    }
+    return false;
   }
   
   // Register a new user
@@ -77,6 +126,9 @@ class ApiService {
         
         if (data['access_token'] != null) {
           await setToken(data['access_token']);
+          if (data['refresh_token'] != null) {
+            await setRefreshToken(data['refresh_token']);
+          }
         }
         
         return data;
@@ -123,14 +175,14 @@ class ApiService {
         throw Exception('Not authenticated');
       }
 
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/ride-request'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
         body: jsonEncode(requestBody),
-      );
+      ));
 
       print('Ride request response status: ${response.statusCode}');
       print('Ride request response body: ${response.body}');
@@ -162,14 +214,12 @@ class ApiService {
   // Get matched rides (with authentication)
   static Future<Map<String, dynamic>> getMatchedRides(String pickup, String destination) async {
     try {
-      final token = await getToken();
-      
-      final response = await http.get(
+      final response = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/match-rides?pickup=$pickup&destination=$destination'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      ).timeout(Duration(seconds: 15));
+      ).timeout(Duration(seconds: 15)));
       
       if (response.statusCode == 200) {
         return jsonDecode(response.body);
@@ -191,13 +241,13 @@ class ApiService {
     }
 
     try {
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/join-ride/$rideId'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Join ride response status: ${response.statusCode}');
       print('Join ride response body: ${response.body}');
@@ -222,13 +272,13 @@ class ApiService {
     }
 
     try {
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/leave-ride/$rideId'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Leave ride response status: ${response.statusCode}');
       print('Leave ride response body: ${response.body}');
@@ -251,13 +301,13 @@ class ApiService {
     }
 
     try {
-      final response = await http.get(
+      final response = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/ride/$rideId'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       if (response.statusCode == 200) {
         final data = json.decode(response.body);
@@ -285,14 +335,13 @@ class ApiService {
   }
   // Get user's joined rides
   static Future<Map<String, dynamic>> getUserJoinedRides() async {
-    final token = await getToken();
-    final response = await http.get(
+    final response = await _authorized((token) => http.get(
       Uri.parse('$baseUrl/user/joined-rides'),
       headers: {
         'Content-Type': 'application/json',
         'Authorization': 'Bearer $token',
       },
-    );
+    ));
 
     if (response.statusCode == 200) {
       return json.decode(response.body);
@@ -309,12 +358,12 @@ class ApiService {
         throw Exception('Authentication token is missing');
       }
       
-      final response = await http.get(
+      final response = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/user/rides'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      ).timeout(Duration(seconds: 15));
+      ).timeout(Duration(seconds: 15)));
       
       if (response.statusCode == 200) {
         return jsonDecode(response.body);
@@ -328,6 +377,27 @@ class ApiService {
     }
   }
   
+  // Everything the rider home / my rides screen needs, in one request
+  static Future<Map<String, dynamic>> getUserHome() async {
+    final token = await getToken();
+    if (token == null) {
+      throw Exception('Authentication token is missing');
+    }
+
+    final response = await _authorized((token) => http.get(
+      Uri.parse('$baseUrl/user/home'),
+      headers: {
+        'Authorization': 'Bearer $token',
+      },
+    ).timeout(Duration(seconds: 15)));
+
+    if (response.statusCode == 200) {
+      return jsonDecode(response.body);
+    } else {
+      throw Exception('Failed to load home screen: ${response.body}');
+    }
+  }
+
   // Delete a ride
   static Future<void> deleteRide(int rideId) async {
     final token = await getToken();
@@ -336,13 +406,13 @@ class ApiService {
     }
 
     try {
-      final response = await http.delete(
+      final response = await _authorized((token) => http.delete(
         Uri.parse('$baseUrl/ride/$rideId'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Delete ride response status: ${response.statusCode}');
       print('Delete ride response body: ${response.body}');
@@ -394,12 +464,12 @@ class ApiService {
     try {
       // First check if we can toggle availability
       print('Checking if driver can toggle availability...');
-      final availabilityResponse = await http.get(
+      final availabilityResponse = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/driver/availability'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       if (availabilityResponse.statusCode != 200) {
         throw Exception('Failed to check driver availability');
@@ -419,13 +489,13 @@ class ApiService {
       }
 
       print('Toggling driver availability...');
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/driver/toggle-availability'),
         headers: {
           'Content-Type': 'application/json',
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Toggle availability response status: ${response.statusCode}');
       print('Toggle availability response body: ${response.body}');
@@ -464,6 +534,9 @@ class ApiService {
         
         if (data['access_token'] != null) {
           await setToken(data['access_token']);
+          if (data['refresh_token'] != null) {
+            await setRefreshToken(data['refresh_token']);
+          }
           // Set driver availability to true after successful login
           try {
             await setDriverAvailability(true);
@@ -493,12 +566,12 @@ class ApiService {
 
     try {
       print('Making request to get available rides...');
-      final response = await http.get(
+      final response = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/available-rides'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Available rides response status: ${response.statusCode}');
       print('Available rides response body: ${response.body}');
@@ -528,12 +601,12 @@ class ApiService {
     try {
       // First, check driver availability
       print('Checking driver availability before accepting ride...');
-      final availabilityResponse = await http.get(
+      final availabilityResponse = await _authorized((token) => http.get(
         Uri.parse('$baseUrl/driver/availability'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
       
       print('Driver availability response status: ${availabilityResponse.statusCode}');
       print('Driver availability response body: ${availabilityResponse.body}');
@@ -560,12 +633,12 @@ class ApiService {
       }
 
       print('Making request to accept ride $rideId...');
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/accept-ride/$rideId'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Accept ride response status: ${response.statusCode}');
       print('Accept ride response body: ${response.body}');
@@ -585,19 +658,41 @@ class ApiService {
     }
   }
 
+  // Availability, active rides, nearby rides and counts for the driver screen, in one request
+  static Future<Map<String, dynamic>> getDriverHome() async {
+    final token = await getToken();
+    if (token == null) {
+      throw Exception('Not authenticated');
+    }
+
+    final response = await _authorized((token) => http.get(
+      Uri.parse('$baseUrl/driver/home'),
+      headers: {
+        'Authorization': 'Bearer $token',
+      },
+    ).timeout(Duration(seconds: 15)));
+
+    if (response.statusCode == 200) {
+      return json.decode(response.body);
+    } else {
+      final errorData = json.decode(response.body);
+      throw Exception(errorData['detail'] ?? 'Failed to load driver home');
+    }
+  }
+
   // Get driver's accepted rides
   static Future<Map<String, dynamic>> getDriverRides() async {
     final token = await getToken();
     print('Making request to get driver rides...');
     print('Using token: ${token?.substring(0, 10)}...');
     
-    final response = await http.get(
+    final response = await _authorized((token) => http.get(
       Uri.parse('$baseUrl/driver/my-rides'),
       headers: {
         'Authorization': 'Bearer $token',
         'Content-Type': 'application/json',
       },
-    );
+    ));
     
     print('Driver rides response status: ${response.statusCode}');
     print('Driver rides response body: ${response.body}');
@@ -634,12 +729,12 @@ class ApiService {
     }
 
     try {
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/complete-ride/$rideId'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       if (response.statusCode == 200) {
         return json.decode(response.body);
@@ -662,12 +757,12 @@ class ApiService {
 
     try {
       print('Making request to cancel ride $rideId...');
-      final response = await http.post(
+      final response = await _authorized((token) => http.post(
         Uri.parse('$baseUrl/cancel-ride/$rideId'),
         headers: {
           'Authorization': 'Bearer $token',
         },
-      );
+      ));
 
       print('Cancel ride response status: ${response.statusCode}');
       print('Cancel ride response body: ${response.body}');